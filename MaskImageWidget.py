@@ -34,29 +34,87 @@ It is structured in three superposed layers:
 - Final layer contains the selection mask
 """
 
+import threading
+
 import numpy
 
 from silx.gui import qt
 from silx.gui.plot import PlotWidget
-from silx.gui.plot import MaskToolsWidget
-from silx.gui.plot import PlotActions
-from silx.gui.plot import PlotToolButtons
-from silx.gui.plot.AlphaSlider import ActiveImageAlphaSlider
 
-from silx.io import is_file
+# Other silx modules are imported on first use, to create widgets quickly
 
 try:
     import h5py
 except ImportError:
     h5py = None
 
+from asyncload import AsyncLoader, read_array, read_session
+from compactmask import CompactMask
+from imagepyramid import ImagePyramid
+from maskhistory import MaskHistory, read_history, write_history
+from mappedio import as_display_array, map_or_read, maps_file, \
+    memory_report
+from maskstats import masked_statistics, write_statistics
+from profiling import Profiler, instrument, restore
+from sessionio import PREVIEW_SUFFIX, map_dataset, read_mask, \
+    read_preview, read_scale, row_blocks, session_writer, write_dataset, \
+    write_mask, write_preview
+
 # TODO: bg colormap handling? see MaskScatterWidget
 
 
+class _SessionLoader(qt.QThread):
+    """Thread reading full resolution session images chunk by chunk.
+
+    Contiguous uncompressed datasets are memory-mapped instead of read.
+    """
+    sigImageLoaded = qt.Signal(str, object)
+    """Emitted with the dataset name and the full resolution array"""
+
+    sigProgress = qt.Signal(str, int)
+    """Emitted with the dataset name and the percentage read"""
+
+    def __init__(self, sessionFile, names, parent=None):
+        super(_SessionLoader, self).__init__(parent)
+        self._sessionFile = sessionFile
+        self._names = names
+        self._cancelled = False
+
+    def cancel(self):
+        """Stop reading after the current chunk"""
+        self._cancelled = True
+
+    def run(self):
+        for name in self._names:
+            dataset = self._sessionFile[name]
+            data = map_dataset(dataset)
+            if data is None:
+                data = numpy.empty(dataset.shape, dtype=dataset.dtype)
+                blocks = row_blocks(dataset)
+                for index, (start, stop) in enumerate(blocks):
+                    if self._cancelled:
+                        return
+                    dataset.read_direct(data,
+                                        source_sel=numpy.s_[start:stop],
+                                        dest_sel=numpy.s_[start:stop])
+                    self.sigProgress.emit(
+                        name, 100 * (index + 1) // len(blocks))
+            if self._cancelled:
+                return
+            self.sigImageLoaded.emit(name, data)
+
+
 class MaskImageWidget(PlotWidget):
     """
 
     """
+    sigFrameChanged = qt.Signal(int)
+    """Emitted with the index of the frame displayed in stack mode"""
+
+    _sigPyramidReady = qt.Signal(object)
+    """Emitted from the worker thread when a background image pyramid
+    is computed"""
+
     # TODO sigMask
     def __init__(self, parent=None, backend=None):
         super(MaskImageWidget, self).__init__(parent=parent, backend=backend)
@@ -65,6 +123,81 @@ class MaskImageWidget(PlotWidget):
 
         self._maskToolsDockWidget = None
 
+        self._maskHistory = MaskHistory()
+        self._maskHistoryTimer = qt.QTimer(self)
+        self._maskHistoryTimer.setSingleShot(True)
+        self._maskHistoryTimer.setInterval(300)
+        self._maskHistoryTimer.timeout.connect(self._recordMask)
+
+        self._asyncLoader = None
+
+        self._stack = None
+        """3D array or h5py Dataset of frames, in stack mode"""
+        self._frameIndex = 0
+        self._stackScales = (0, 1.), (0, 1.)
+
+        self._sessionFile = None
+        self._sessionLoader = None
+        self._sessionScales = {}
+        self._pendingSessionMask = None
+        self._pendingSessionHistory = None
+
+        self._bgPyramid = None
+        """Pyramid of the background image, when enabled"""
+        self._bgSource = None
+        """Full resolution background (image, xscale, yscale)"""
+        self._displaySources = {}
+        """Images set with copy=False and converted to be displayed, by
+        legend: they are saved instead of the displayed copies"""
+        self._bgDisplayed = None
+        """(level, first row, first column, shape) of the displayed region"""
+        self._bgUpdateTimer = qt.QTimer(self)
+        self._bgUpdateTimer.setSingleShot(True)
+        self._bgUpdateTimer.setInterval(50)
+        self._bgUpdateTimer.timeout.connect(self._updateBackgroundLevel)
+        self._sigPyramidReady.connect(self._pyramidReady)
+        self.sigPlotSignal.connect(self._plotSignal)
+
+        self._actionsCreated = False
+        """Actions, tool buttons and toolbar are created on first show, or
+        on first access to one of them (see :meth:`_createActions`)"""
+
+        self._profiling = None
+        """(profiler, instrumented objects) when profiling is enabled"""
+
+    _LAZY_ATTRIBUTES = (
+        "group", "resetZoomAction", "zoomInAction", "zoomOutAction",
+        "xAxisAutoScaleAction", "yAxisAutoScaleAction", "colormapAction",
+        "keepDataAspectRatioButton", "yAxisInvertedButton", "copyAction",
+        "saveAction", "printAction", "keepDataAspectRatioAction",
+        "yAxisInvertedAction")
+    """Attributes created by :meth:`_createActions`"""
+
+    def __getattr__(self, name):
+        # Only called for attributes not found: create the lazy ones
+        if (name in self._LAZY_ATTRIBUTES and
+                not self.__dict__.get("_actionsCreated", True)):
+            self._createActions()
+            return getattr(self, name)
+        raise AttributeError("'%s' object has no attribute '%s'" % (
+            type(self).__name__, name))
+
+    def showEvent(self, event):
+        self._createActions()
+        super(MaskImageWidget, self).showEvent(event)
+
+    def _createActions(self):
+        """Create the actions, tool buttons and toolbar, once.
+
+        Their modules are imported here rather than with this module, so
+        that widgets which are never shown stay cheap to create.
+        """
+        if self._actionsCreated:
+            return
+        self._actionsCreated = True
+        from silx.gui.plot import PlotActions
+        from silx.gui.plot import PlotToolButtons
+
         # Init actions
         self.group = qt.QActionGroup(self)
         self.group.setExclusive(False)
@@ -140,19 +273,168 @@ class MaskImageWidget(PlotWidget):
         """
         return self.getMaskToolsDockWidget().getSelectionMask(copy=copy)
 
-    def setBackgroundImage(self, image, xscale=(0, 1.), yscale=(0, 1.)):
+    def getCompactSelectionMask(self):
+        """Get the current mask as a bit-packed :class:`CompactMask`.
+
+        Mask levels are not preserved: all non-zero pixels are masked.
+
+        :rtype: CompactMask
         """
+        return CompactMask.fromArray(self.getSelectionMask(copy=False))
+
+    def setCompactSelectionMask(self, mask):
+        """Set the mask from a :class:`CompactMask`.
+
+        The mask tools get a writable copy of the unpacked mask cached by
+        *mask*, which is read-only.
+
+        :param CompactMask mask:
+        :return: None if failed, shape of mask if successful.
+        """
+        return self.setSelectionMask(mask.asUint8(), copy=True)
+
+    def setBackgroundImage(self, image, xscale=(0, 1.), yscale=(0, 1.),
+                           pyramid=None, copy=True):
+        """
+
+        With a pyramid, only the region of the image in the current view is
+        displayed, at the resolution of the screen. The pyramid is
+        computed in a worker thread, and a strided preview is displayed in
+        the meantime.
 
         :param image: 2D image, array of shape (nrows, ncolumns)
             or (nrows, ncolumns, 3) or (nrows, ncolumns, 4) RGB(A) pixmap
         :param xscale: Factors for polynomial scaling  for x-axis,
             *(a, b)* such as :math:`x \mapsto a + bx`
         :param yscale: Factors for polynomial scaling  for y-axis
+        :param str pyramid: None (default) to display the full resolution
+            image, "mean" or "max" to display a level of a pyramid built
+            with this reduction.
+        :param bool copy: True (the default) to let the plot copy the image,
+            False to keep a reference to it, e.g. to a memory-mapped file
+            (see :func:`mappedio.open_mapped`). It is converted block by
+            block if the plot cannot use its type.
         """
+        xscale = tuple(xscale)
+        yscale = tuple(yscale)
+        self._bgPyramid = None
+        self._bgDisplayed = None
+        self._bgSource = None
+        self._displaySources.pop(self._bgImageLegend, None)
+        if pyramid is not None:
+            # the plot only gets regions of levels of the pyramid, converted
+            # when displayed: keep the image in its type
+            image = numpy.array(image) if copy else numpy.asanyarray(image)
+            self._bgSource = (image, xscale, yscale)
+            step = max(1, max(image.shape[:2]) // 1024)
+            builder = threading.Thread(target=self._computePyramid,
+                                       args=(self._bgSource, pyramid))
+            builder.daemon = True
+            builder.start()
+            image = as_display_array(image[::step, ::step])
+            xscale = (xscale[0], xscale[1] * step)
+            yscale = (yscale[0], yscale[1] * step)
+        elif not copy:
+            image = self._asDisplayArray(self._bgImageLegend, image)
+
         self.addImage(image, legend=self._bgImageLegend,
                       origin=(xscale[0], yscale[0]),
                       scale=(xscale[1], yscale[1]),
-                      z=0, replace=False)
+                      z=0, replace=False, copy=copy)
+
+    def _computePyramid(self, source, method):
+        """Worker thread: compute the pyramid of a background image"""
+        pyramid = ImagePyramid(source[0], method=method)
+        pyramid.compute()
+        self._sigPyramidReady.emit((source, pyramid))
+
+    def _pyramidReady(self, result):
+        source, pyramid = result
+        if source is self._bgSource:   # else the background was replaced
+            self._bgPyramid = pyramid
+            self._updateBackgroundLevel()
+
+    def _plotSignal(self, event):
+        if event["event"] == "limitsChanged" and self._bgPyramid is not None:
+            # coalesce the events of a pan or zoom
+            self._bgUpdateTimer.start()
+
+    def _updateBackgroundLevel(self):
+        """Display the pyramid level and region matching the view"""
+        if self._bgPyramid is None:
+            return
+        image, (x0, xs), (y0, ys) = self._bgSource
+        xmin, xmax = self.getGraphXLimits()
+        ymin, ymax = self.getGraphYLimits()
+        width, height = self.getPlotBoundsInPixels()[2:]
+
+        cols = (xmin - x0) / xs, (xmax - x0) / xs
+        rows = (ymin - y0) / ys, (ymax - y0) / ys
+        ratio = min(abs(cols[1] - cols[0]) / max(width, 1),
+                    abs(rows[1] - rows[0]) / max(height, 1))
+        level = self._bgPyramid.levelForRatio(ratio)
+        region, (row0, col0), step = self._bgPyramid.getRegion(
+            level, rows, cols)
+
+        displayed = (level, row0, col0, region.shape)
+        if region.size == 0 or displayed == self._bgDisplayed:
+            return
+        self._bgDisplayed = displayed
+        self.addImage(as_display_array(region), legend=self._bgImageLegend,
+                      origin=(x0 + col0 * xs, y0 + row0 * ys),
+                      scale=(xs * step, ys * step),
+                      z=0, replace=False, resetzoom=False, copy=False)
+
+    def _getBackgroundSource(self):
+        """Return the full resolution background (image, xscale, yscale),
+        whatever is displayed: the source of the pyramid, if any, else the
+        data of the plotted image."""
+        if self._bgSource is not None:
+            image, xscale, yscale = self._bgSource
+            return numpy.asarray(image), xscale, yscale
+        item = self.getBackgroundImage()
+        return (self._getSourceData(self._bgImageLegend,
+                                    item.getData(copy=False)),
+                (item.getOrigin()[0], item.getScale()[0]),
+                (item.getOrigin()[1], item.getScale()[1]))
+
+    def _asDisplayArray(self, legend, data):
+        """Return *data* converted for the plot if needed (see
+        :func:`mappedio.as_display_array`), keeping the original to save it
+        """
+        data = numpy.asanyarray(data)
+        converted = as_display_array(data)
+        if converted is not data:
+            self._displaySources[legend] = data
+        return converted
+
+    def _getSourceData(self, legend, displayed):
+        """Return the original data of the image *legend*, given the
+        *displayed* data"""
+        return self._displaySources.get(legend, displayed)
+
+    def _getAsyncLoader(self):
+        if self._asyncLoader is None:
+            self._asyncLoader = AsyncLoader(parent=self)
+        return self._asyncLoader
+
+    def setBackgroundImageAsync(self, source, xscale=(0, 1.), yscale=(0, 1.),
+                                pyramid=None):
+        """Read the background image in a worker thread, then call
+        :meth:`setBackgroundImage`.
+
+        A previous background image load still running is cancelled.
+
+        :param source: numpy array, h5py Dataset, ``.npy`` file path or
+            ``"<file>::<dataset path>"`` HDF5 dataset
+        :return: Future with progress and cancel
+        :rtype: asyncload.LoadFuture
+        """
+        return self._getAsyncLoader().submit(
+            "background",
+            lambda future: read_array(source, future),
+            lambda data: self.setBackgroundImage(
+                data, xscale=xscale, yscale=yscale, pyramid=pyramid))
 
     def getBackgroundImage(self):
         """Return the background image set with :meth:`setBackgroundImage`.
@@ -161,7 +443,7 @@ class MaskImageWidget(PlotWidget):
         """
         return self.getImage(legend=self._bgImageLegend)
 
-    def setImage(self, image, xscale=(0, 1.), yscale=(0, 1.)):
+    def setImage(self, image, xscale=(0, 1.), yscale=(0, 1.), copy=True):
         """Set the main (*active*) image, by providing its data as a 2D
         array or as a pixmap.
 
@@ -170,13 +452,133 @@ class MaskImageWidget(PlotWidget):
         :param xscale: Factors for polynomial scaling  for x-axis,
             *(a, b)* such as :math:`x \mapsto a + bx`
         :param yscale: Factors for polynomial scaling  for y-axis
+        :param bool copy: True (the default) to let the plot copy the image,
+            False to keep a reference to it, e.g. to a memory-mapped file
+            (see :func:`mappedio.open_mapped`). It is converted block by
+            block if the plot cannot use its type.
         """
+        self._displaySources.pop(self._activeImageLegend, None)
+        if not copy:
+            image = self._asDisplayArray(self._activeImageLegend, image)
         self.addImage(image, legend=self._activeImageLegend,
                       origin=(xscale[0], yscale[0]),
                       scale=(xscale[1], yscale[1]),
-                      z=1, replace=False)
+                      z=1, replace=False, copy=copy)
         self.setActiveImage(self._activeImageLegend)
 
+    def setImageAsync(self, source, xscale=(0, 1.), yscale=(0, 1.)):
+        """Read the main (*active*) image in a worker thread, then call
+        :meth:`setImage`.
+
+        A previous image load still running is cancelled.
+
+        :param source: numpy array, h5py Dataset, ``.npy`` file path or
+            ``"<file>::<dataset path>"`` HDF5 dataset
+        :return: Future with progress and cancel
+        :rtype: asyncload.LoadFuture
+        """
+        return self._getAsyncLoader().submit(
+            "image",
+            lambda future: read_array(source, future),
+            lambda data: self.setImage(data, xscale=xscale, yscale=yscale))
+
+    def setStack(self, stack, xscale=(0, 1.), yscale=(0, 1.), index=0):
+        """Set a stack of frames, and display one of them as the active
+        image.
+
+        Frames are read one at a time when displayed, so *stack* can be a
+        h5py Dataset which is not loaded in memory. It must stay open
+        while the stack is used.
+
+        :param stack: 3D array (nframes, nrows, ncolumns) or h5py Dataset
+        :param xscale: Factors for polynomial scaling  for x-axis
+        :param yscale: Factors for polynomial scaling  for y-axis
+        :param int index: Index of the frame to display
+        """
+        self._stack = stack
+        self._stackScales = tuple(xscale), tuple(yscale)
+        self._frameIndex = None
+        self.setFrameIndex(index)
+
+    def getStack(self):
+        """Return the stack set with :meth:`setStack`, or None"""
+        return self._stack
+
+    def setFrameIndex(self, index):
+        """Display another frame of the stack, keeping the current mask.
+
+        :param int index: Index of the frame in the stack
+        """
+        if self._stack is None or index == self._frameIndex:
+            return
+        xscale, yscale = self._stackScales
+        mask = None
+        if self.getImage() is not None:
+            mask = self.getSelectionMask(copy=True)
+        # frames of an array or memory-mapped stack are displayed as views
+        self.setImage(self._stack[index], xscale=xscale, yscale=yscale,
+                      copy=False)
+        if mask is not None and mask.size:
+            self.setSelectionMask(mask, copy=False)
+        self._frameIndex = index
+        self.sigFrameChanged.emit(index)
+
+    def getFrameIndex(self):
+        """Return the index of the displayed frame of the stack"""
+        return self._frameIndex
+
+    def applyMaskToStack(self, chunk=16, nworkers=1, output=None):
+        """Compute, for every frame of the stack, the sum, number of pixels
+        and mean of the frame under each level of the current mask.
+
+        Frames are processed in vectorized chunks, possibly in parallel,
+        see :func:`maskstats.masked_statistics`.
+
+        :param int chunk: Number of frames processed at once
+        :param int nworkers: Number of threads
+        :param str output: Optional HDF5 file to write the results to
+        :return: dict {level: {"sum": array, "count": array, "mean": array}}
+        """
+        if self._stack is None:
+            raise RuntimeError("No stack set, see setStack")
+        stats = masked_statistics(self._stack,
+                                  self.getSelectionMask(copy=False),
+                                  chunk=chunk, nworkers=nworkers)
+        if output is not None:
+            write_statistics(output, stats)
+        return stats
+
+    def getMemoryReport(self):
+        """Return the size of the displayed arrays, and how much of it is
+        memory-mapped rather than resident, see :func:`mappedio.memory_report`.
+
+        :rtype: dict
+        """
+        arrays = {}
+        image = self.getImage()
+        if image is not None:
+            arrays["image"] = image.getData(copy=False)
+        if self._bgSource is not None:
+            arrays["background"] = self._bgSource[0]
+        elif self.getBackgroundImage() is not None:
+            arrays["background"] = self.getBackgroundImage().getData(copy=False)
+        if isinstance(self._stack, numpy.ndarray):
+            arrays["stack"] = self._stack
+        for legend, data in self._displaySources.items():
+            arrays[legend + " source"] = data
+        return memory_report(arrays)
+
+    def _getHeldArrays(self):
+        """Return the arrays kept by the widget, which may be memory-mapped
+        from a session file"""
+        arrays = [self._bgSource[0]] if self._bgSource is not None else []
+        for item in (self.getImage(), self.getBackgroundImage()):
+            if item is not None:
+                arrays.append(item.getData(copy=False))
+        if isinstance(self._stack, numpy.ndarray):
+            arrays.append(self._stack)
+        return arrays + list(self._displaySources.values())
+
     def getImage(self, legend=None):
         """Overloaded from :class:`silx.gui.plot.Plot.Plot`.
 
@@ -204,14 +606,131 @@ class MaskImageWidget(PlotWidget):
     def getMaskToolsDockWidget(self):
         """DockWidget with image mask panel (lazy-loaded)."""
         if self._maskToolsDockWidget is None:
+            from silx.gui.plot import MaskToolsWidget
             self._maskToolsDockWidget = MaskToolsWidget.MaskToolsDockWidget(
                 plot=self, name='Mask')
             self._maskToolsDockWidget.hide()
             self.addDockWidget(qt.Qt.BottomDockWidgetArea,
                                self._maskToolsDockWidget)
+            # the changes of a drawing gesture are recorded as one step
+            self._maskToolsDockWidget.widget().sigMaskChanged.connect(
+                self._maskHistoryTimer.start)
 
         return self._maskToolsDockWidget
 
+    def getMaskHistory(self):
+        """Return the undo/redo history of the selection mask.
+
+        :rtype: maskhistory.MaskHistory
+        """
+        return self._maskHistory
+
+    def _recordMask(self):
+        """Record the current mask in the history, if it changed"""
+        self._maskHistoryTimer.stop()
+        mask = self.getSelectionMask(copy=False)
+        if mask is not None:
+            self._maskHistory.record(mask)
+
+    def undoMask(self):
+        """Restore the mask before the last change.
+
+        :return: False if there is nothing to undo
+        """
+        self._recordMask()
+        mask = self._maskHistory.undo()
+        if mask is None:
+            return False
+        self.setSelectionMask(mask, copy=False)
+        return True
+
+    def redoMask(self):
+        """Restore the mask undone by :meth:`undoMask`.
+
+        :return: False if there is nothing to redo
+        """
+        self._recordMask()
+        mask = self._maskHistory.redo()
+        if mask is None:
+            return False
+        self.setSelectionMask(mask, copy=False)
+        return True
+
+    def _setMaskHistory(self, history):
+        """Replace the history, keeping the memory budget"""
+        history.setMaxBytes(self._maskHistory.getMaxBytes())
+        self._maskHistoryTimer.stop()
+        self._maskHistory = history
+
+    _PROFILED_METHODS = (
+        ("setImage", "data"), ("setBackgroundImage", "data"),
+        ("setFrameIndex", "data"), ("addImage", "data"),
+        ("setSelectionMask", "mask"), ("getSelectionMask", "mask"),
+        ("undoMask", "mask"), ("redoMask", "mask"), ("_recordMask", "mask"),
+        ("applyMaskToStack", "mask"),
+        ("setDefaultColormap", "colormap"))
+    """Methods of the widget timed when profiling, with their category"""
+
+    _PROFILED_MASK_METHODS = (
+        ("updateRectangle", "mask"), ("updatePolygon", "mask"),
+        ("updateDisk", "mask"), ("updateLine", "mask"),
+        ("updateStencil", "mask"), ("updateNotFinite", "mask"),
+        ("clear", "mask"), ("invert", "mask"), ("commit", "mask"),
+        ("undo", "mask"), ("redo", "mask"))
+    """Methods of the mask of the mask tools timed when profiling"""
+
+    _PROFILED_BACKEND_METHODS = (
+        ("replot", "render"), ("draw", "render"), ("paintGL", "render"))
+    """Redraw methods of the plot backends timed when profiling"""
+
+    def enableProfiling(self, capacity=65536, profiler=None):
+        """Time the data updates, mask operations, colormap changes and
+        backend redraws, until :meth:`disableProfiling`.
+
+        The timed methods are wrapped on this instance only while profiling
+        is enabled, so that it costs nothing otherwise. Colormaps changed
+        from the toolbar dialog are timed through :meth:`addImage` and
+        :meth:`setDefaultColormap`. Moves of the alpha slider are recorded
+        as instant events.
+
+        :param int capacity: Number of events kept
+        :param profiling.Profiler profiler: Profiler to record to,
+            default: a new one
+        :return: The profiler, see :meth:`profiling.Profiler.summary`,
+            :meth:`profiling.Profiler.dumpChromeTrace`
+        :rtype: profiling.Profiler
+        """
+        self.disableProfiling()
+        if profiler is None:
+            profiler = Profiler(capacity)
+        maskWidget = self.getMaskToolsDockWidget().widget()
+        self._profiling = profiler, [
+            instrument(self, self._PROFILED_METHODS, profiler),
+            instrument(getattr(maskWidget, "_mask", None),
+                       self._PROFILED_MASK_METHODS, profiler, "mask."),
+            instrument(self._backend, self._PROFILED_BACKEND_METHODS,
+                       profiler, "backend.")]
+        return profiler
+
+    def disableProfiling(self):
+        """Remove the timing wrappers. The profiler keeps its events."""
+        if self._profiling is not None:
+            instrumented = self._profiling[1]
+            self._profiling = None
+            for item in reversed(instrumented):
+                restore(item)
+
+    def getProfiler(self):
+        """Return the profiler in use, None if profiling is disabled.
+
+        :rtype: profiling.Profiler
+        """
+        return None if self._profiling is None else self._profiling[0]
+
+    def _alphaSliderMoved(self, value):
+        if self._profiling is not None:
+            self._profiling[0].mark("alphaSlider", "interaction")
+
     def _createToolBar(self, title, parent):
         """Create a QToolBar from the QAction of the PlotWindow.
 
@@ -240,75 +759,214 @@ class MaskImageWidget(PlotWidget):
                 else:
                     raise RuntimeError()
 
+        from silx.gui.plot.AlphaSlider import ActiveImageAlphaSlider
         alpha_slider = ActiveImageAlphaSlider(parent=self, plot=self)
         alpha_slider.setOrientation(qt.Qt.Horizontal)
+        alpha_slider.valueChanged.connect(self._alphaSliderMoved)
         toolbar.addWidget(alpha_slider)
 
         return toolbar
 
-    def saveSession(self, path):
+    def saveSession(self, path, compression="gzip", incremental=True,
+                    maskEncoding="auto", history=True):
         """Save session data to an HDF5 file.
 
         Data saved:
          - background image (2D dataset) with xscale and yscale
          - image data (2D dataset) with xscale and yscale
-         - mask (2D array)
+         - mask (2D array, bit-packed or run-length encoded when it only
+           contains 0 and 1)
+         - mask undo/redo history (see :func:`maskhistory.write_history`)
+
+        Datasets are chunked and compressed, and store a hash of their
+        content. When saving again to the same file, only the arrays which
+        changed are rewritten, in place if their shape and type did not
+        change. The file is repacked when replaced datasets leave too much
+        unused space, see :func:`sessionio.session_writer`.
+
+        If displayed images are memory-mapped from *path* (see
+        :meth:`loadSession`), the session is written to a temporary file
+        which then replaces *path*, so that they are left untouched.
 
         :param path: Name/path of output file.
+        :param compression: "gzip" (default), "lzf" or None
+        :param bool incremental: False to overwrite the whole file
+        :param str maskEncoding: "auto" (default), "packbits", "rle" or
+            "none", see :func:`sessionio.write_mask`
+        :param bool history: False not to save the mask history
+        :raise RuntimeError: While a lazy :meth:`loadSession` is still
+            reading the full resolution images: only their previews are
+            displayed, and the session mask is not applied yet.
         """
         if h5py is None:
             print("Error: h5py is required in order to save session")
             return
+        if self._sessionLoader is not None:
+            raise RuntimeError("Cannot save while a session is loading")
 
-        bgImage = self.getBackgroundImage()
         image = self.getImage()
-
-        sessionFile = h5py.File(path, "w")
-
-        sessionFile["background"] = bgImage.getData()
-        sessionFile["background X scale"] = [
-            bgImage.getOrigin()[0],
-            bgImage.getScale()[0]]
-        sessionFile["background Y scale"] = [
-            bgImage.getOrigin()[1],
-            bgImage.getScale()[1]]
-
-        sessionFile["image"] = image.getData()
-        sessionFile["image X scale"] = [
-            image.getOrigin()[0],
-            image.getScale()[0]]
-        sessionFile["image Y scale"] = [
-            image.getOrigin()[1],
-            image.getScale()[1]]
-
-        sessionFile["mask"] = self.getSelectionMask()
-        sessionFile.close()
-
-    def loadSession(self, path):
+        self._recordMask()
+
+        replace = maps_file(self._getHeldArrays(), path)
+        with session_writer(path, incremental, replace) as sessionFile:
+            for name, (data, xscale, yscale) in (
+                    ("background", self._getBackgroundSource()),
+                    ("image", (self._getSourceData(self._activeImageLegend,
+                                                   image.getData(copy=False)),
+                               (image.getOrigin()[0], image.getScale()[0]),
+                               (image.getOrigin()[1], image.getScale()[1])))):
+                if (write_dataset(sessionFile, name, data, compression) or
+                        name + PREVIEW_SUFFIX not in sessionFile):
+                    # downsampled copy displayed first by lazy session loading
+                    write_preview(sessionFile, name, data)
+                write_dataset(sessionFile, name + " X scale", xscale)
+                write_dataset(sessionFile, name + " Y scale", yscale)
+
+            write_mask(sessionFile, "mask", self.getSelectionMask(copy=False),
+                       compression, maskEncoding)
+            if history:
+                write_history(sessionFile, self._maskHistory)
+            elif "mask history" in sessionFile:
+                del sessionFile["mask history"]
+
+    def loadSession(self, path, lazy=False):
         """Load session from an HDF5 file.
 
         Data loaded:
          - background image (2D dataset) with xscale and yscale
          - image data (2D dataset) with xscale and yscale
          - mask (2D array)
+         - mask undo/redo history, if saved
+
+        In lazy mode, downsampled previews of the images are displayed
+        immediately, and the full resolution images are read chunk by chunk
+        (or memory-mapped) in a background thread. The mask is applied once
+        the full resolution image is loaded.
 
         :param path: Name/path of session file
+        :param bool lazy: True to return before the full resolution images
+            are loaded.
         """
+        from silx.io import is_file
         if not is_file(path):
-            raise IOError("Cannot read %s as an HDF5 file")
+            raise IOError("Cannot read %s as an HDF5 file" % path)
         # todo: sanity tests
 
+        self._closeSessionFile()
         sessionFile = h5py.File(path, "r")
 
-        self.setBackgroundImage(sessionFile["background"],
-                                xscale=sessionFile["background X scale"],
-                                yscale=sessionFile["background Y scale"])
-        self.setImage(sessionFile["image"],
-                      xscale=sessionFile["image X scale"],
-                      yscale=sessionFile["image Y scale"])
-        self.setSelectionMask(sessionFile["mask"])
+        bgXScale = read_scale(sessionFile, "background X scale")
+        bgYScale = read_scale(sessionFile, "background Y scale")
+        xscale = read_scale(sessionFile, "image X scale")
+        yscale = read_scale(sessionFile, "image Y scale")
+
+        if not lazy:
+            # contiguous uncompressed images are memory-mapped, not read
+            self.setBackgroundImage(map_or_read(sessionFile["background"]),
+                                    xscale=bgXScale, yscale=bgYScale,
+                                    copy=False)
+            self.setImage(map_or_read(sessionFile["image"]),
+                          xscale=xscale, yscale=yscale, copy=False)
+            mask = read_mask(sessionFile, "mask")
+            self.setSelectionMask(mask, copy=False)
+            self._setMaskHistory(read_history(
+                sessionFile, mask, maxBytes=self._maskHistory.getMaxBytes()))
+            sessionFile.close()
+            return
+
+        for name, setter, (x0, xs), (y0, ys) in (
+                ("background", self.setBackgroundImage, bgXScale, bgYScale),
+                ("image", self.setImage, xscale, yscale)):
+            preview, step = read_preview(sessionFile, name)
+            setter(preview, xscale=(x0, xs * step), yscale=(y0, ys * step))
+
+        self._sessionFile = sessionFile
+        self._sessionScales = {"background": (bgXScale, bgYScale),
+                               "image": (xscale, yscale)}
+        self._pendingSessionMask = read_mask(sessionFile, "mask")
+        self._pendingSessionHistory = read_history(
+            sessionFile, self._pendingSessionMask,
+            maxBytes=self._maskHistory.getMaxBytes())
+
+        self._sessionLoader = _SessionLoader(sessionFile,
+                                             ["background", "image"],
+                                             parent=self)
+        self._sessionLoader.sigImageLoaded.connect(self._sessionImageLoaded)
+        self._sessionLoader.finished.connect(self._sessionLoaderFinished)
+        self._sessionLoader.start()
+
+    def loadSessionAsync(self, path):
+        """Read a session file in a worker thread, then display it as
+        :meth:`loadSession`.
+
+        Pending image, background and session loads are cancelled.
 
-        sessionFile.close()
+        :param path: Name/path of session file
+        :return: Future with progress and cancel
+        :rtype: asyncload.LoadFuture
+        """
+        from silx.io import is_file
+        if not is_file(path):
+            raise IOError("Cannot read %s as an HDF5 file" % path)
+        self._closeSessionFile()
+        loader = self._getAsyncLoader()
+        loader.cancel("image")
+        loader.cancel("background")
+
+        names = ["background", "background X scale", "background Y scale",
+                 "image", "image X scale", "image Y scale", "mask",
+                 "mask history"]
+
+        def display(session):
+            self.setBackgroundImage(session["background"],
+                                    xscale=session["background X scale"],
+                                    yscale=session["background Y scale"])
+            self.setImage(session["image"],
+                          xscale=session["image X scale"],
+                          yscale=session["image Y scale"])
+            self.setSelectionMask(session["mask"], copy=False)
+            self._setMaskHistory(session["mask history"])
+
+        historyBytes = self._maskHistory.getMaxBytes()
+        return loader.submit(
+            "session",
+            lambda future: read_session(path, names, future, historyBytes),
+            display)
+
+    def _sessionImageLoaded(self, name, data):
+        """Replace a preview by its full resolution image"""
+        if self.sender() is not self._sessionLoader:
+            return  # queued by the loader of a previous session
+        xscale, yscale = self._sessionScales[name]
+        # data is read for this widget only, or memory-mapped: do not copy
+        if name == "background":
+            self.setBackgroundImage(data, xscale=xscale, yscale=yscale,
+                                    copy=False)
+        else:
+            self.setImage(data, xscale=xscale, yscale=yscale, copy=False)
+            if self._pendingSessionMask is not None:
+                self.setSelectionMask(self._pendingSessionMask, copy=False)
+                self._setMaskHistory(self._pendingSessionHistory)
+                self._pendingSessionMask = None
+                self._pendingSessionHistory = None
+
+    def _sessionLoaderFinished(self):
+        if self.sender() is self._sessionLoader:
+            self._closeSessionFile()
+
+    def _closeSessionFile(self):
+        """Stop lazy session loading and close the session file"""
+        if self._sessionLoader is not None:
+            loader, self._sessionLoader = self._sessionLoader, None
+            loader.sigImageLoaded.disconnect(self._sessionImageLoaded)
+            loader.finished.disconnect(self._sessionLoaderFinished)
+            loader.cancel()
+            loader.wait()
+            loader.deleteLater()
+        if self._sessionFile is not None:
+            # memory-mapped images do not depend on the h5py file handle
+            self._sessionFile.close()
+            self._sessionFile = None
 
 
 if __name__ == "__main__":
@@ -34,27 +34,33 @@ It is structured in three superposed layers:
 - Final layer contains the selection mask
 """
 
+import collections
+
 import numpy
 
 from silx.gui import qt
-from silx.gui import icons
 from silx.gui.plot import PlotWidget
-from silx.gui.plot import PlotActions
-from silx.gui.plot import PlotToolButtons
-
-from silx.gui.plot.AlphaSlider import NamedScatterAlphaSlider
-
-from silx.gui.plot.ColormapDialog import ColormapDialog
 
-from silx.gui.plot import ScatterMaskToolsWidget
-
-from silx.io import is_file
+# Other silx modules are imported on first use, to create widgets quickly
 
 try:
     import h5py
 except ImportError:
     h5py = None
 
+from asyncload import AsyncLoader, read_array, read_session
+from compactmask import CompactMask
+from coordmap import AffineMapping, PixelPointIndex
+from datastats import StatisticsCache
+from maskhistory import MaskHistory, read_history, write_history
+from mappedio import as_display_array, map_or_read, maps_file, \
+    memory_report
+from profiling import Profiler, instrument, restore
+from scatterlod import bin_scatter, visible_points
+from spatialindex import GridIndex
+from sessionio import SCATTER_LAYERS, read_mask, scatter_layer_names, \
+    session_writer, write_mask
+
 
 class ColormapToolButton(qt.QToolButton):
     def __init__(self, parent=None, plot=None):
@@ -62,7 +68,16 @@ class ColormapToolButton(qt.QToolButton):
         self._scatter_dialog = None
         super(ColormapToolButton, self).__init__(parent)
         self.plot = plot
+        self._statistics = StatisticsCache()
 
+        # Colormap changes are applied at most once per display refresh
+        self._pendingColormaps = {}
+        self._colormapTimer = qt.QTimer(self)
+        self._colormapTimer.setSingleShot(True)
+        self._colormapTimer.setInterval(16)
+        self._colormapTimer.timeout.connect(self._applyColormaps)
+
+        from silx.gui import icons
         icon = icons.getQIcon('colormap')
         self.setIcon(icon)
 
@@ -81,6 +96,7 @@ class ColormapToolButton(qt.QToolButton):
 
     def _setBgCmap(self):
         if self._bg_dialog is None:
+            from silx.gui.plot.ColormapDialog import ColormapDialog
             self._bg_dialog = ColormapDialog()
 
         image = self.plot.getBackgroundImage()
@@ -94,20 +110,8 @@ class ColormapToolButton(qt.QToolButton):
             # Set dialog from active image
             colormap = image.getColormap()
 
-            data = image.getData(copy=False)
-
-            goodData = data[numpy.isfinite(data)]
-            if goodData.size > 0:
-                dataMin = goodData.min()
-                dataMax = goodData.max()
-            else:
-                qt.QMessageBox.warning(
-                    self, "No Data",
-                    "Image data does not contain any real value")
-                dataMin, dataMax = 1., 10.
-
-            self._bg_dialog.setHistogram()
-            self._bg_dialog.setDataRange(dataMin, dataMax)
+            self._setDialogStatistics(self._bg_dialog, "background",
+                                      image.getData(copy=False))
 
         self._bg_dialog.setColormap(**colormap)
 
@@ -118,16 +122,48 @@ class ColormapToolButton(qt.QToolButton):
 
         if not result:  # Restore the previous colormap
             self._bgColormapChanged(colormap)
+        self._applyColormaps()
+
+    def _setDialogStatistics(self, dialog, name, data):
+        """Set the histogram and data range of a colormap dialog from the
+        cached statistics of *data*.
+
+        :param str name: "background" or "scatter"
+        """
+        stats = self._statistics.get(name, data,
+                                     self.plot.getDataVersion(name))
+        if stats["count"] > 0:
+            dialog.setHistogram(stats["histogram"], stats["bin_edges"])
+            dialog.setDataRange(stats["min"], stats["max"])
+        else:
+            qt.QMessageBox.warning(
+                self, "No Data",
+                "Image data does not contain any real value")
+            dialog.setHistogram()
+            dialog.setDataRange(1., 10.)
+
+    def invalidateStatistics(self, name=None):
+        """Drop the cached statistics of "background", "scatter" or both
+        (None)."""
+        self._statistics.invalidate(name)
 
     def _bgColormapChanged(self, colormap):
-        image = self.plot.getBackgroundImage()
-        if image is not None:
-            # Update image: This do not preserve pixmap
-            self.plot.setBackgroundImage(image.getData(copy=False),
-                                         colormap=colormap)
+        self._pendingColormaps["background"] = colormap
+        if not self._colormapTimer.isActive():
+            self._colormapTimer.start()
+
+    def _applyColormaps(self):
+        """Apply the latest colormap changes to the existing plot items"""
+        self._colormapTimer.stop()
+        pending, self._pendingColormaps = self._pendingColormaps, {}
+        if "background" in pending:
+            self.plot.setBackgroundColormap(pending["background"])
+        if "scatter" in pending:
+            self.plot.setScatterColormap(pending["scatter"])
 
     def _setScatterCmap(self):
         if self._scatter_dialog is None:
+            from silx.gui.plot.ColormapDialog import ColormapDialog
             self._scatter_dialog = ColormapDialog()
 
         scatter = self.plot.getScatter()
@@ -141,20 +177,8 @@ class ColormapToolButton(qt.QToolButton):
             # Set dialog from active scatter
             colormap = scatter.getColormap()
 
-            data = scatter.getValueData(copy=False)
-
-            goodData = data[numpy.isfinite(data)]
-            if goodData.size > 0:
-                dataMin = goodData.min()
-                dataMax = goodData.max()
-            else:
-                qt.QMessageBox.warning(
-                    self, "No Data",
-                    "Image data does not contain any real value")
-                dataMin, dataMax = 1., 10.
-
-            self._scatter_dialog.setHistogram()
-            self._scatter_dialog.setDataRange(dataMin, dataMax)
+            self._setDialogStatistics(self._scatter_dialog, "scatter",
+                                      scatter.getValueData(copy=False))
         self._scatter_dialog.setColormap(**colormap)
 
         # Run the dialog listening to colormap change
@@ -163,16 +187,13 @@ class ColormapToolButton(qt.QToolButton):
         self._scatter_dialog.sigColormapChanged.disconnect(self._scatterColormapChanged)
 
         if not result:  # Restore the previous colormap
-            self._bgColormapChanged(colormap)
+            self._scatterColormapChanged(colormap)
+        self._applyColormaps()
 
     def _scatterColormapChanged(self, colormap):
-        scatter = self.plot.getScatter()
-        if scatter is not None:
-            self.plot.setScatter(scatter.getXData(copy=False),
-                                 scatter.getYData(copy=False),
-                                 scatter.getValueData(copy=False),
-                                 info=scatter.getInfo(),
-                                 colormap=colormap)
+        self._pendingColormaps["scatter"] = colormap
+        if not self._colormapTimer.isActive():
+            self._colormapTimer.start()
 
 
 class MaskScatterWidget(PlotWidget):
@@ -187,10 +208,101 @@ class MaskScatterWidget(PlotWidget):
     def __init__(self, parent=None, backend=None):
         super(MaskScatterWidget, self).__init__(parent=parent, backend=backend)
         self._activeScatterLegend = "active scatter"
+        self._lodScatterLegend = "active scatter LOD"
         self._bgImageLegend = "background image"
 
+        self._spatialIndex = None
+        """Index of the active scatter points, built on first selection"""
+
+        self._scatterLayers = collections.OrderedDict()
+        """Named scatter layers: dict of x, y, values, info and mask"""
+        self._selectedLayers = []
+        """Names of the layers concatenated in the active scatter"""
+        self._layerSlices = {}
+        """Slice of each selected layer in the active scatter"""
+        self._displaySources = {}
+        """Arrays set with copy=False and converted to be displayed, by
+        session dataset name: they are saved instead of the displayed
+        copies"""
+
+        self._dataVersions = {"background": 0, "scatter": 0}
+
+        self._mappingCache = {}
+        """Background mapping, pixel of each scatter point and pixel to
+        points index, computed on demand for the current data versions"""
+
+        self._asyncLoader = None
+
+        self._lodEnabled = False
+        self._lodThreshold = 100000
+        self._lodStatistic = "mean"
+        self._lodUpdateTimer = qt.QTimer(self)
+        self._lodUpdateTimer.setSingleShot(True)
+        self._lodUpdateTimer.setInterval(50)
+        self._lodUpdateTimer.timeout.connect(self._updateScatterLod)
+
         self._maskToolsDockWidget = None
 
+        self._maskHistory = MaskHistory()
+        self._maskHistoryTimer = qt.QTimer(self)
+        self._maskHistoryTimer.setSingleShot(True)
+        self._maskHistoryTimer.setInterval(300)
+        self._maskHistoryTimer.timeout.connect(self._recordMask)
+
+        self._actionsCreated = False
+        """Actions, tool buttons and toolbar are created on first show, or
+        on first access to one of them (see :meth:`_createActions`)"""
+
+        self._profiling = None
+        """(profiler, instrumented objects) when profiling is enabled"""
+
+        self.setActiveCurveHandling(False)   # avoids color change when selecting
+
+        self.sigContentChanged.connect(self._onContentChanged)
+        self.sigActiveScatterChanged.connect(self._invalidateSpatialIndex)
+        self.sigPlotSignal.connect(self._plotSignal)
+
+    def _onContentChanged(self, action, kind, legend):
+        if kind == "scatter" and legend == self._activeScatterLegend:
+            self.sigActiveScatterChanged.emit()
+        elif kind == "image" and legend == self._bgImageLegend:
+            self._mappingCache.clear()
+
+    _LAZY_ATTRIBUTES = (
+        "group", "resetZoomAction", "zoomInAction", "zoomOutAction",
+        "xAxisAutoScaleAction", "yAxisAutoScaleAction", "colormapButton",
+        "keepDataAspectRatioButton", "yAxisInvertedButton", "copyAction",
+        "saveAction", "printAction", "alphaSlider", "colormapAction",
+        "keepDataAspectRatioAction", "yAxisInvertedAction",
+        "alphaSliderAction")
+    """Attributes created by :meth:`_createActions`"""
+
+    def __getattr__(self, name):
+        # Only called for attributes not found: create the lazy ones
+        if (name in self._LAZY_ATTRIBUTES and
+                not self.__dict__.get("_actionsCreated", True)):
+            self._createActions()
+            return getattr(self, name)
+        raise AttributeError("'%s' object has no attribute '%s'" % (
+            type(self).__name__, name))
+
+    def showEvent(self, event):
+        self._createActions()
+        super(MaskScatterWidget, self).showEvent(event)
+
+    def _createActions(self):
+        """Create the actions, tool buttons and toolbar, once.
+
+        Their modules are imported here rather than with this module, so
+        that widgets which are never shown stay cheap to create.
+        """
+        if self._actionsCreated:
+            return
+        self._actionsCreated = True
+        from silx.gui.plot import PlotActions
+        from silx.gui.plot import PlotToolButtons
+        from silx.gui.plot.AlphaSlider import NamedScatterAlphaSlider
+
         # Init actions
         self.group = qt.QActionGroup(self)
         self.group.setExclusive(False)
@@ -237,18 +349,14 @@ class MaskScatterWidget(PlotWidget):
 
         self.alphaSlider = NamedScatterAlphaSlider(parent=self, plot=self)
         self.alphaSlider.setOrientation(qt.Qt.Horizontal)
+        self.alphaSlider.valueChanged.connect(self._alphaSliderMoved)
 
         # Creating the toolbar also create actions for toolbuttons
         self._toolbar = self._createToolBar(title='Plot', parent=None)
         self.addToolBar(self._toolbar)
 
-        self.setActiveCurveHandling(False)   # avoids color change when selecting
-
-        self.sigContentChanged.connect(self._onContentChanged)
-
-    def _onContentChanged(self, action, kind, legend):
-        if kind == "scatter" and legend == self._activeScatterLegend:
-            self.sigActiveScatterChanged.emit()
+        if self.getScatter() is not None:
+            self.alphaSlider.setLegend(self._activeScatterLegend)
 
     def setSelectionMask(self, mask, copy=True):
         """Set the mask to a new array.
@@ -274,8 +382,28 @@ class MaskScatterWidget(PlotWidget):
         """
         return self.getMaskToolsDockWidget().getSelectionMask(copy=copy)
 
+    def getCompactSelectionMask(self):
+        """Get the current mask as a bit-packed :class:`CompactMask`.
+
+        Mask levels are not preserved: all non-zero points are masked.
+
+        :rtype: CompactMask
+        """
+        return CompactMask.fromArray(self.getSelectionMask(copy=False))
+
+    def setCompactSelectionMask(self, mask):
+        """Set the mask from a :class:`CompactMask`.
+
+        The mask tools get a writable copy of the unpacked mask cached by
+        *mask*, which is read-only.
+
+        :param CompactMask mask:
+        :return: None if failed, shape of mask if successful.
+        """
+        return self.setSelectionMask(mask.asUint8(), copy=True)
+
     def setBackgroundImage(self, image, xscale=(0, 1.), yscale=(0, 1.),
-                           colormap=None):
+                           colormap=None, copy=True):
         """
 
         :param image: 2D image, array of shape (nrows, ncolumns)
@@ -283,12 +411,73 @@ class MaskScatterWidget(PlotWidget):
         :param xscale: Factors for polynomial scaling  for x-axis,
             *(a, b)* such as :math:`x \mapsto a + bx`
         :param yscale: Factors for polynomial scaling  for y-axis
+        :param bool copy: True (the default) to let the plot copy the image,
+            False to keep a reference to it, e.g. to a memory-mapped file
+            (see :func:`mappedio.open_mapped`). It is converted block by
+            block if the plot cannot use its type.
         """
+        self._displaySources.pop("background", None)
+        if not copy:
+            image = self._asDisplayArray("background", image)
         self.addImage(image, legend=self._bgImageLegend,
                       origin=(xscale[0], yscale[0]),
                       scale=(xscale[1], yscale[1]),
                       z=0, replace=False,
-                      colormap=colormap)
+                      colormap=colormap, copy=copy)
+        self._dataReplaced("background")
+
+    def _asDisplayArray(self, name, data):
+        """Return *data* converted for the plot if needed (see
+        :func:`mappedio.as_display_array`), keeping the original to save it
+        """
+        data = numpy.asanyarray(data)
+        converted = as_display_array(data)
+        if converted is not data:
+            self._displaySources[name] = data
+        return converted
+
+    def _getSourceData(self, name, displayed):
+        """Return the original data of the session dataset *name*, given
+        the *displayed* data"""
+        return self._displaySources.get(name, displayed)
+
+    def _getAsyncLoader(self):
+        if self._asyncLoader is None:
+            self._asyncLoader = AsyncLoader(parent=self)
+        return self._asyncLoader
+
+    def setBackgroundImageAsync(self, source, xscale=(0, 1.), yscale=(0, 1.),
+                                colormap=None):
+        """Read the background image in a worker thread, then call
+        :meth:`setBackgroundImage`.
+
+        A previous background image load still running is cancelled.
+
+        :param source: numpy array, h5py Dataset, ``.npy`` file path or
+            ``"<file>::<dataset path>"`` HDF5 dataset
+        :return: Future with progress and cancel
+        :rtype: asyncload.LoadFuture
+        """
+        return self._getAsyncLoader().submit(
+            "background",
+            lambda future: read_array(source, future),
+            lambda data: self.setBackgroundImage(
+                data, xscale=xscale, yscale=yscale, colormap=colormap))
+
+    def _dataReplaced(self, name):
+        """Invalidate what is cached about "background" or "scatter" data"""
+        self._dataVersions[name] += 1
+        if self._actionsCreated:
+            self.colormapButton.invalidateStatistics(name)
+        self._mappingCache.clear()
+
+    def getDataVersion(self, name):
+        """Return a counter incremented each time the "background" image
+        or the "scatter" data is replaced.
+
+        :rtype: int
+        """
+        return self._dataVersions[name]
 
     def getBackgroundImage(self):
         """Return the background image set with :meth:`setBackgroundImage`.
@@ -297,7 +486,29 @@ class MaskScatterWidget(PlotWidget):
         """
         return self.getImage(legend=self._bgImageLegend)
 
-    def setScatter(self, x, y, v=None, info=None, colormap=None):
+    def setBackgroundColormap(self, colormap):
+        """Change the colormap of the background image without resending
+        its data. RGB(A) background images are not affected.
+
+        :param colormap: Colormap description
+        """
+        image = self.getBackgroundImage()
+        if image is not None and hasattr(image, "setColormap"):
+            image.setColormap(colormap)
+
+    def setScatterColormap(self, colormap):
+        """Change the colormap of the active scatter (and of its LOD
+        display) without resending its data.
+
+        :param colormap: Colormap description
+        """
+        for legend in (self._activeScatterLegend, self._lodScatterLegend):
+            scatter = self.getScatter(legend)
+            if scatter is not None:
+                scatter.setColormap(colormap)
+
+    def setScatter(self, x, y, v=None, info=None, colormap=None,
+                   copy=True):
         """Set the scatter data, by providing its data as a 1D
         array or as a pixmap.
 
@@ -305,12 +516,128 @@ class MaskScatterWidget(PlotWidget):
         :param y: 1D array of y coordinates
         :param v: Array of values for each point, represented as the color
              of the point on the plot.
+        :param bool copy: True (the default) to let the plot copy the
+            arrays, False to keep references to them, e.g. to memory-mapped
+            files (see :func:`mappedio.open_mapped`). They are converted
+            block by block if the plot cannot use their type.
+
+        The scatter layers, if any, are removed (see
+        :meth:`addScatterLayer`).
         """
+        self._clearScatterLayers()
+        self._setActiveScatter(x, y, v, info=info, colormap=colormap,
+                               copy=copy)
+
+    def _clearScatterLayers(self):
+        self._scatterLayers.clear()
+        self._selectedLayers = []
+        self._layerSlices = {}
+
+    def _setActiveScatter(self, x, y, v=None, info=None, colormap=None,
+                          copy=True):
+        for name in ("scatter x", "scatter y", "scatter values"):
+            self._displaySources.pop(name, None)
+        if not copy:
+            x = self._asDisplayArray("scatter x", x)
+            y = self._asDisplayArray("scatter y", y)
+            if v is not None:
+                v = self._asDisplayArray("scatter values", v)
         self.addScatter(x, y, v, legend=self._activeScatterLegend,
-                        info=info, colormap=colormap)
+                        info=info, colormap=colormap, copy=copy)
+        self._dataReplaced("scatter")
 
-        self.alphaSlider.setLegend(self._activeScatterLegend)
+        if self._actionsCreated:
+            self.alphaSlider.setLegend(self._activeScatterLegend)
         self.sigActiveScatterChanged.emit()
+        if self._lodEnabled:
+            self._updateScatterLod()
+
+    def setScatterAsync(self, x, y, v=None, info=None, colormap=None):
+        """Read the scatter data in a worker thread, then call
+        :meth:`setScatter`.
+
+        A previous scatter load still running is cancelled.
+
+        :param x: Source of the x coordinates: numpy array, h5py Dataset,
+            ``.npy`` file path or ``"<file>::<dataset path>"`` HDF5 dataset
+        :param y: Source of the y coordinates
+        :param v: Source of the values, or None
+        :return: Future with progress and cancel
+        :rtype: asyncload.LoadFuture
+        """
+        sources = [x, y] if v is None else [x, y, v]
+
+        def read(future):
+            count = len(sources)
+            return [read_array(source, future,
+                               progress=(100 * i // count,
+                                         100 * (i + 1) // count))
+                    for i, source in enumerate(sources)]
+
+        def display(arrays):
+            self.setScatter(*arrays, info=info, colormap=colormap)
+
+        return self._getAsyncLoader().submit("scatter", read, display)
+
+    def setScatterLod(self, enabled, threshold=100000, statistic="mean"):
+        """Configure the level-of-detail display of the active scatter.
+
+        When enabled and more than *threshold* points are in the view,
+        the points are binned on a grid of the size of the plot area in
+        pixels and one point per non-empty bin is displayed, colored by the
+        min, max or mean value of the bin. The full resolution scatter
+        stays the active scatter (hidden), so that the mask tools keep
+        working on the original points.
+
+        :param bool enabled: True to enable the LOD display
+        :param int threshold: Number of visible points above which the LOD
+            display is used
+        :param str statistic: "min", "max" or "mean" value of the points of
+            a bin
+        """
+        self._lodEnabled = bool(enabled)
+        self._lodThreshold = int(threshold)
+        self._lodStatistic = statistic
+        self._updateScatterLod()
+
+    def _plotSignal(self, event):
+        if event["event"] == "limitsChanged" and self._lodEnabled:
+            # coalesce the events of a pan or zoom
+            self._lodUpdateTimer.start()
+
+    def _updateScatterLod(self):
+        """Display either the active scatter or its binned version,
+        depending on the number of points in the view"""
+        scatter = self.getScatter()
+        if scatter is None:
+            self.remove(self._lodScatterLegend, kind="scatter")
+            return
+
+        x = scatter.getXData(copy=False)
+        y = scatter.getYData(copy=False)
+        xrange_ = self.getGraphXLimits()
+        yrange = self.getGraphYLimits()
+        inside = None
+        if self._lodEnabled and len(x) > self._lodThreshold:
+            inside = visible_points(x, y, xrange_, yrange)
+            if numpy.count_nonzero(inside) <= self._lodThreshold:
+                inside = None
+
+        if inside is None:
+            self.remove(self._lodScatterLegend, kind="scatter")
+            scatter.setVisible(True)
+            return
+
+        width, height = self.getPlotBoundsInPixels()[2:]
+        bins = bin_scatter(x, y, scatter.getValueData(copy=False),
+                           xrange_, yrange,
+                           max(int(width), 1), max(int(height), 1),
+                           inside=inside)
+        scatter.setVisible(False)
+        self.addScatter(bins["x"], bins["y"], bins[self._lodStatistic],
+                        legend=self._lodScatterLegend,
+                        colormap=scatter.getColormap(),
+                        z=scatter.getZValue(), copy=False)
 
     def getScatter(self, legend=None):
         """Return the currently displayed scatter.
@@ -324,6 +651,258 @@ class MaskScatterWidget(PlotWidget):
                     legend=self._activeScatterLegend)
         return super(MaskScatterWidget, self).getScatter(legend)
 
+    def addScatterLayer(self, name, x, y, v=None, info=None, mask=None,
+                        copy=True, select=False):
+        """Add a named scatter layer, or replace the layer of this name.
+
+        The active scatter, displayed and masked by the mask tools, is the
+        concatenation of the selected layers (see
+        :meth:`setSelectedScatterLayers`), built once per selection: a
+        mask gesture updates the points of all the selected layers in a
+        single pass. The layers which are not selected are not displayed
+        and keep their mask.
+
+        A scatter set with :meth:`setScatter` becomes the first layer,
+        named :attr:`defaultLayerName` and selected, when the first layer
+        is added.
+
+        :param str name: Name of the layer (without "/")
+        :param x: 1D array of x coordinates
+        :param y: 1D array of y coordinates
+        :param v: Values of the points, default: the index of the layer,
+            so that layers are told apart by their color
+        :param mask: uint8 mask of the points, default: no point masked
+        :param bool copy: False to keep references to the arrays, e.g. to
+            memory-mapped files
+        :param bool select: True to add the layer to the selected layers
+            (rebuilding the active scatter)
+        """
+        if "/" in name:
+            raise ValueError("Invalid scatter layer name: %s" % name)
+        toArray = numpy.array if copy else numpy.asarray
+        x = toArray(x).reshape(-1)
+        y = toArray(y).reshape(-1)
+        if v is None:
+            index = list(self._scatterLayers).index(name) \
+                if name in self._scatterLayers else len(self._scatterLayers)
+            v = numpy.full(x.shape, index, dtype=numpy.float32)
+        v = toArray(v).reshape(-1)
+        if mask is None:
+            mask = numpy.zeros(x.shape, dtype=numpy.uint8)
+        mask = toArray(mask, dtype=numpy.uint8).reshape(-1)
+        if not len(x) == len(y) == len(v) == len(mask):
+            raise ValueError("Scatter layer arrays of different sizes")
+
+        self._adoptActiveScatter()
+        rebuild = select or name in self._selectedLayers
+        if rebuild:
+            selected = list(self._selectedLayers)
+            if name not in selected:
+                selected.append(name)
+            self._storeLayerMasks(selected)
+        self._scatterLayers[name] = {"x": x, "y": y, "values": v,
+                                     "info": info, "mask": mask}
+        if rebuild:
+            self._buildActiveScatter(selected)
+
+    defaultLayerName = "scatter"
+    """Name of the layer made of the scatter set with :meth:`setScatter`"""
+
+    def _adoptActiveScatter(self):
+        """Make the scatter set with :meth:`setScatter` the first layer,
+        selected, so that it is kept (and saved) with the layers"""
+        scatter = self.getScatter()
+        if self._scatterLayers or scatter is None:
+            return
+        x = self._getSourceData("scatter x", scatter.getXData(copy=False))
+        y = self._getSourceData("scatter y", scatter.getYData(copy=False))
+        values = self._getSourceData("scatter values",
+                                     scatter.getValueData(copy=False))
+        if values is None:
+            values = numpy.zeros(x.shape, dtype=numpy.float32)
+        name = self.defaultLayerName
+        # the mask of a selected layer is read from the active mask
+        self._scatterLayers[name] = {
+            "x": x, "y": y, "values": values,
+            "info": scatter.getInfo(),
+            "mask": numpy.zeros(x.shape, dtype=numpy.uint8)}
+        self._selectedLayers = [name]
+        self._layerSlices = {name: slice(0, len(x))}
+
+    def removeScatterLayer(self, name):
+        """Remove a scatter layer, rebuilding the active scatter if the
+        layer was selected.
+
+        :raise KeyError: If there is no layer of this name
+        """
+        del self._scatterLayers[name]
+        if name in self._selectedLayers:
+            self.setSelectedScatterLayers(
+                [n for n in self._selectedLayers if n != name])
+
+    def getScatterLayerNames(self):
+        """Return the names of the scatter layers, in their order.
+
+        :rtype: list of str
+        """
+        return list(self._scatterLayers)
+
+    def getScatterLayer(self, name):
+        """Return the data of a scatter layer.
+
+        :return: dict of the x, y, values and info of the layer. The
+            arrays must not be modified.
+        :raise KeyError: If there is no layer of this name
+        """
+        layer = self._scatterLayers[name]
+        return {key: layer[key] for key in ("x", "y", "values", "info")}
+
+    def getSelectedScatterLayers(self):
+        """Return the names of the layers of the active scatter.
+
+        :rtype: list of str
+        """
+        return list(self._selectedLayers)
+
+    def setSelectedScatterLayers(self, names):
+        """Display and mask the given scatter layers, concatenated in the
+        active scatter.
+
+        :param names: Names of the layers, in the order of concatenation
+        :raise KeyError: If one of the layers does not exist
+        """
+        names = list(names)
+        for name in names:
+            if name not in self._scatterLayers:
+                raise KeyError(name)
+        self._storeLayerMasks(names)
+        self._buildActiveScatter(names)
+
+    def getLayerSelectionMask(self, name, copy=True):
+        """Return the mask of a scatter layer.
+
+        :param bool copy: False to get a view of the mask of the active
+            scatter for a selected layer, which MUST not be modified
+        :rtype: 1D numpy.ndarray of uint8
+        :raise KeyError: If there is no layer of this name
+        """
+        layer = self._scatterLayers[name]
+        if name in self._layerSlices:
+            mask = self.getSelectionMask(copy=False)
+            if mask is not None and len(mask):
+                mask = mask[self._layerSlices[name]]
+                return numpy.array(mask) if copy else mask
+        return numpy.array(layer["mask"]) if copy else layer["mask"]
+
+    def setLayerSelectionMask(self, name, mask):
+        """Set the mask of a scatter layer.
+
+        :param mask: uint8 array of the size of the layer
+        :raise KeyError: If there is no layer of this name
+        """
+        layer = self._scatterLayers[name]
+        mask = numpy.array(mask, dtype=numpy.uint8).reshape(-1)
+        if len(mask) != len(layer["x"]):
+            raise ValueError("Mask and scatter layer of different sizes")
+        if name not in self._layerSlices:
+            layer["mask"] = mask
+            return
+        active = self.getSelectionMask(copy=True)
+        active[self._layerSlices[name]] = mask
+        self.setSelectionMask(active, copy=False)
+
+    def _storeLayerMasks(self, keep=()):
+        """Copy the masks of the selected layers from the active scatter
+        mask, before the selection changes.
+
+        The data of the layers which stay selected (*keep*) are views of
+        the active scatter arrays, used to build the next ones. The other
+        layers get their own copy, so that the current arrays are freed.
+        """
+        active = self.getSelectionMask(copy=False) if self._layerSlices \
+            else None
+        for name, slice_ in self._layerSlices.items():
+            layer = self._scatterLayers.get(name)
+            if layer is None:
+                continue
+            if active is not None and len(active) >= slice_.stop:
+                layer["mask"] = numpy.array(active[slice_])
+            if name not in keep:
+                for key in ("x", "y", "values"):
+                    layer[key] = numpy.array(layer[key])
+        self._layerSlices = {}
+
+    def _buildActiveScatter(self, names):
+        """Set the concatenation of the given layers as the active scatter,
+        and the concatenation of their masks as the selection mask.
+
+        The data of the layers become views of the new arrays, so that
+        they are held in memory once.
+        """
+        self._selectedLayers = list(names)
+        layers = [self._scatterLayers[name] for name in names]
+        if not layers:
+            for name in ("scatter x", "scatter y", "scatter values"):
+                self._displaySources.pop(name, None)
+            self.remove(self._activeScatterLegend, kind="scatter")
+            self.remove(self._lodScatterLegend, kind="scatter")
+            self._dataReplaced("scatter")
+            self._maskHistory.reset()
+            return
+
+        arrays = {key: numpy.concatenate([layer[key] for layer in layers])
+                  for key in ("x", "y", "values", "mask")}
+        start = 0
+        for name, layer in zip(names, layers):
+            slice_ = slice(start, start + len(layer["x"]))
+            start = slice_.stop
+            self._layerSlices[name] = slice_
+            for key in ("x", "y", "values"):
+                layer[key] = arrays[key][slice_]
+
+        scatter = self.getScatter()
+        colormap = None if scatter is None else scatter.getColormap()
+        self._setActiveScatter(arrays["x"], arrays["y"], arrays["values"],
+                               colormap=colormap, copy=False)
+        self.setSelectionMask(arrays["mask"], copy=False)
+        self._maskHistoryTimer.stop()
+        self._maskHistory.reset(arrays["mask"])
+
+    def getMemoryReport(self):
+        """Return the size of the displayed arrays, and how much of it is
+        memory-mapped rather than resident, see :func:`mappedio.memory_report`.
+
+        :rtype: dict
+        """
+        arrays = {}
+        image = self.getBackgroundImage()
+        if image is not None:
+            arrays["background"] = image.getData(copy=False)
+        scatter = self.getScatter()
+        if scatter is not None:
+            arrays["scatter x"] = scatter.getXData(copy=False)
+            arrays["scatter y"] = scatter.getYData(copy=False)
+            arrays["scatter values"] = scatter.getValueData(copy=False)
+        for name, data in self._displaySources.items():
+            arrays[name + " source"] = data
+        return memory_report(arrays)
+
+    def _getHeldArrays(self):
+        """Return the arrays kept by the widget, which may be memory-mapped
+        from a session file"""
+        arrays = []
+        image = self.getBackgroundImage()
+        if image is not None:
+            arrays.append(image.getData(copy=False))
+        scatter = self.getScatter()
+        if scatter is not None:
+            arrays += [scatter.getXData(copy=False),
+                       scatter.getYData(copy=False),
+                       scatter.getValueData(copy=False)]
+        for layer in self._scatterLayers.values():
+            arrays += [layer["x"], layer["y"], layer["values"]]
+        return arrays + list(self._displaySources.values())
+
     def getMaskAction(self):
         """QAction toggling image mask dock widget
 
@@ -334,14 +913,283 @@ class MaskScatterWidget(PlotWidget):
     def getMaskToolsDockWidget(self):
         """DockWidget with image mask panel (lazy-loaded)."""
         if self._maskToolsDockWidget is None:
+            from silx.gui.plot import ScatterMaskToolsWidget
             self._maskToolsDockWidget = ScatterMaskToolsWidget.ScatterMaskToolsDockWidget(
                 plot=self, name='Mask')
             self._maskToolsDockWidget.hide()
             self.addDockWidget(qt.Qt.BottomDockWidgetArea,
                                self._maskToolsDockWidget)
+            self._installSpatialIndex()
+            # the changes of a drawing gesture are recorded as one step
+            self._maskToolsDockWidget.widget().sigMaskChanged.connect(
+                self._maskHistoryTimer.start)
 
         return self._maskToolsDockWidget
 
+    def getMaskHistory(self):
+        """Return the undo/redo history of the selection mask.
+
+        :rtype: maskhistory.MaskHistory
+        """
+        return self._maskHistory
+
+    def _recordMask(self):
+        """Record the current mask in the history, if it changed"""
+        self._maskHistoryTimer.stop()
+        mask = self.getSelectionMask(copy=False)
+        if mask is not None:
+            self._maskHistory.record(mask)
+
+    def undoMask(self):
+        """Restore the mask before the last change.
+
+        :return: False if there is nothing to undo
+        """
+        self._recordMask()
+        mask = self._maskHistory.undo()
+        if mask is None:
+            return False
+        self.setSelectionMask(mask, copy=False)
+        return True
+
+    def redoMask(self):
+        """Restore the mask undone by :meth:`undoMask`.
+
+        :return: False if there is nothing to redo
+        """
+        self._recordMask()
+        mask = self._maskHistory.redo()
+        if mask is None:
+            return False
+        self.setSelectionMask(mask, copy=False)
+        return True
+
+    def _setMaskHistory(self, history):
+        """Replace the history, keeping the memory budget"""
+        history.setMaxBytes(self._maskHistory.getMaxBytes())
+        self._maskHistoryTimer.stop()
+        self._maskHistory = history
+
+    _PROFILED_METHODS = (
+        ("setScatter", "data"), ("setBackgroundImage", "data"),
+        ("addScatter", "data"), ("addImage", "data"),
+        ("addScatterLayer", "data"), ("setSelectedScatterLayers", "data"),
+        ("setSelectionMask", "mask"), ("getSelectionMask", "mask"),
+        ("undoMask", "mask"), ("redoMask", "mask"), ("_recordMask", "mask"),
+        ("rasterizeSelectionMask", "mask"),
+        ("setBackgroundColormap", "colormap"),
+        ("setScatterColormap", "colormap"),
+        ("setDefaultColormap", "colormap"))
+    """Methods of the widget timed when profiling, with their category"""
+
+    _PROFILED_MASK_METHODS = (
+        ("updateRectangle", "mask"), ("updatePolygon", "mask"),
+        ("updateDisk", "mask"), ("updateLine", "mask"),
+        ("updatePoints", "mask"), ("updateNotFinite", "mask"),
+        ("clear", "mask"), ("invert", "mask"), ("commit", "mask"),
+        ("undo", "mask"), ("redo", "mask"))
+    """Methods of the mask of the mask tools timed when profiling"""
+
+    _PROFILED_BACKEND_METHODS = (
+        ("replot", "render"), ("draw", "render"), ("paintGL", "render"))
+    """Redraw methods of the plot backends timed when profiling"""
+
+    def enableProfiling(self, capacity=65536, profiler=None):
+        """Time the data updates, mask operations, colormap changes and
+        backend redraws, until :meth:`disableProfiling`.
+
+        The timed methods are wrapped on this instance only while profiling
+        is enabled, so that it costs nothing otherwise. Moves of the alpha
+        slider are recorded as instant events.
+
+        :param int capacity: Number of events kept
+        :param profiling.Profiler profiler: Profiler to record to,
+            default: a new one
+        :return: The profiler, see :meth:`profiling.Profiler.summary`,
+            :meth:`profiling.Profiler.dumpChromeTrace`
+        :rtype: profiling.Profiler
+        """
+        self.disableProfiling()
+        if profiler is None:
+            profiler = Profiler(capacity)
+        maskWidget = self.getMaskToolsDockWidget().widget()
+        self._profiling = profiler, [
+            instrument(self, self._PROFILED_METHODS, profiler),
+            instrument(getattr(maskWidget, "_mask", None),
+                       self._PROFILED_MASK_METHODS, profiler, "mask."),
+            instrument(self._backend, self._PROFILED_BACKEND_METHODS,
+                       profiler, "backend.")]
+        return profiler
+
+    def disableProfiling(self):
+        """Remove the timing wrappers. The profiler keeps its events."""
+        if self._profiling is not None:
+            instrumented = self._profiling[1]
+            self._profiling = None
+            for item in reversed(instrumented):
+                restore(item)
+
+    def getProfiler(self):
+        """Return the profiler in use, None if profiling is disabled.
+
+        :rtype: profiling.Profiler
+        """
+        return None if self._profiling is None else self._profiling[0]
+
+    def _alphaSliderMoved(self, value):
+        if self._profiling is not None:
+            self._profiling[0].mark("alphaSlider", "interaction")
+
+    def _invalidateSpatialIndex(self):
+        self._spatialIndex = None
+        self._mappingCache.clear()
+
+    def getSpatialIndex(self):
+        """Return the spatial index of the active scatter points, built on
+        first call after each change of the active scatter.
+
+        :rtype: GridIndex or None if there is no active scatter
+        """
+        if self._spatialIndex is None:
+            scatter = self.getScatter()
+            if scatter is None:
+                return None
+            self._spatialIndex = GridIndex(scatter.getXData(copy=False),
+                                           scatter.getYData(copy=False))
+        return self._spatialIndex
+
+    def getBackgroundMapping(self):
+        """Return the mapping between data coordinates and the pixels of
+        the background image.
+
+        :rtype: coordmap.AffineMapping or None if there is no background
+        """
+        if "mapping" not in self._mappingCache:
+            image = self.getBackgroundImage()
+            if image is None:
+                return None
+            (x0, y0), (xs, ys) = image.getOrigin(), image.getScale()
+            self._mappingCache["mapping"] = AffineMapping(
+                image.getData(copy=False).shape, (x0, xs), (y0, ys))
+        return self._mappingCache["mapping"]
+
+    def _getPointPixels(self):
+        """Flat background pixel index of every active scatter point, -1
+        outside of the image, or None if the background or the scatter is
+        missing"""
+        if "pixels" not in self._mappingCache:
+            mapping = self.getBackgroundMapping()
+            scatter = self.getScatter()
+            if mapping is None or scatter is None:
+                return None
+            self._mappingCache["pixels"] = mapping.flatIndices(
+                scatter.getXData(copy=False), scatter.getYData(copy=False))
+        return self._mappingCache["pixels"]
+
+    def sampleBackground(self, fill=numpy.nan):
+        """Return the value of the background image under each point of the
+        active scatter.
+
+        :param fill: Value for the points outside of the image
+        :return: Array of one value (or RGB(A) pixel) per point, or None
+            if the background or the scatter is missing
+        """
+        pixels = self._getPointPixels()
+        if pixels is None:
+            return None
+        image = self.getBackgroundImage().getData(copy=False)
+        return self.getBackgroundMapping().sample(image, None, None,
+                                                  fill=fill, flat=pixels)
+
+    def rasterizeSelectionMask(self, mode="any"):
+        """Project the scatter selection mask onto the background image
+        grid.
+
+        :param str mode: "any" for a uint8 mask of the pixels containing at
+            least one masked point, "count" for the number of masked points
+            in each pixel
+        :return: 2D array of the shape of the background image, or None if
+            the background or the scatter is missing
+        """
+        pixels = self._getPointPixels()
+        if pixels is None:
+            return None
+        return self.getBackgroundMapping().rasterize(
+            self.getSelectionMask(copy=False), None, None,
+            mode=mode, flat=pixels)
+
+    def _getPixelPointIndex(self):
+        if "index" not in self._mappingCache:
+            pixels = self._getPointPixels()
+            if pixels is None:
+                return None
+            shape = self.getBackgroundMapping().shape
+            self._mappingCache["index"] = PixelPointIndex(
+                pixels, shape[0] * shape[1])
+        return self._mappingCache["index"]
+
+    def getPointsInPixel(self, row, col):
+        """Return the indices of the active scatter points inside a pixel
+        of the background image.
+
+        The index sorting the points by pixel is built on first call.
+
+        :rtype: 1D numpy.ndarray of int, or None if the background or the
+            scatter is missing
+        """
+        index = self._getPixelPointIndex()
+        if index is None:
+            return None
+        return index.pointsInPixel(
+            row * self.getBackgroundMapping().shape[1] + col)
+
+    def getPointsInPixels(self, pixelMask):
+        """Return the indices of the active scatter points inside the
+        non-zero pixels of a mask of the background image shape.
+
+        :rtype: 1D numpy.ndarray of int, or None if the background or the
+            scatter is missing
+        """
+        index = self._getPixelPointIndex()
+        if index is None:
+            return None
+        return index.pointsInPixels(pixelMask)
+
+    def _installSpatialIndex(self):
+        """Make the rectangle, polygon and pencil tools of the mask panel
+        only test the points of the spatial index cells they overlap."""
+        maskWidget = self._maskToolsDockWidget.widget()
+        scatterMask = getattr(maskWidget, "_mask", None)
+        if scatterMask is None or not hasattr(scatterMask, "updatePoints"):
+            return  # Unsupported mask tools, keep the default behavior
+
+        # The mask tools use (row, column), that is (y, x), coordinates
+        def updateRectangle(level, y, x, height, width, mask=True):
+            index = self.getSpatialIndex()
+            scatterMask.updatePoints(
+                level, index.queryRect(x, x + width, y, y + height), mask)
+
+        def updatePolygon(level, vertices, mask=True):
+            index = self.getSpatialIndex()
+            vertices = numpy.asarray(vertices)[:, (1, 0)]
+            scatterMask.updatePoints(
+                level, index.queryPolygon(vertices), mask)
+
+        def updateDisk(level, cy, cx, radius, mask=True):
+            index = self.getSpatialIndex()
+            scatterMask.updatePoints(
+                level, index.queryDisk(cx, cy, radius), mask)
+
+        def updateLine(level, y0, x0, y1, x1, width, mask=True):
+            index = self.getSpatialIndex()
+            scatterMask.updatePoints(
+                level, index.queryStroke(x0, y0, x1, y1, width), mask)
+
+        scatterMask.updateRectangle = updateRectangle
+        scatterMask.updatePolygon = updatePolygon
+        scatterMask.updateDisk = updateDisk
+        scatterMask.updateLine = updateLine
+
     def _createToolBar(self, title, parent):
         """Create a QToolBar from the QAction of the PlotWindow.
 
@@ -379,15 +1227,28 @@ class MaskScatterWidget(PlotWidget):
         self.alphaSliderAction = toolbar.addWidget(self.alphaSlider)
         return toolbar
 
-    def saveSession(self, path):
+    def saveSession(self, path, maskEncoding="auto", history=True):
         """Save session data to an HDF5 file.
 
         Data saved:
          - background image (2D dataset) with xscale and yscale
-         - scatter data: x, y, values (3 x 1D datasets)
-         - mask (1D array)
+         - scatter data: x, y, values (3 x 1D datasets), or, if the
+           widget has scatter layers, the x, y, values and mask datasets
+           of each layer in ``scatter layers/<name>``, with its index and
+           its position in the selected layers (-1 if not selected) as
+           attributes
+         - mask of the active scatter (1D array, bit-packed or run-length
+           encoded when it only contains 0 and 1)
+         - mask undo/redo history (see :func:`maskhistory.write_history`)
+
+        If displayed data is memory-mapped from *path* (see
+        :meth:`loadSession`), the session is written to a temporary file
+        which then replaces *path*, so that it is left untouched.
 
         :param path: Name/path of output file.
+        :param str maskEncoding: "auto" (default), "packbits", "rle" or
+            "none", see :func:`sessionio.write_mask`
+        :param bool history: False not to save the mask history
         """
         if h5py is None:
             print("Error: h5py is required in order to save session")
@@ -396,50 +1257,153 @@ class MaskScatterWidget(PlotWidget):
         bgImage = self.getBackgroundImage()
         scatter = self.getScatter()
 
-        sessionFile = h5py.File(path, "w")
-
-        sessionFile["background"] = bgImage.getData()
-        sessionFile["background X scale"] = [
-            bgImage.getOrigin()[0],
-            bgImage.getScale()[0]]
-        sessionFile["background Y scale"] = [
-            bgImage.getOrigin()[1],
-            bgImage.getScale()[1]]
-
-        sessionFile["scatter x"] = scatter.getXData()
-        sessionFile["scatter y"] = scatter.getYData()
-        sessionFile["scatter values"] = scatter.getValueData()
-
-        sessionFile["mask"] = self.getSelectionMask()
-        sessionFile.close()
+        replace = maps_file(self._getHeldArrays(), path)
+        with session_writer(path, incremental=False,
+                            replace=replace) as sessionFile:
+            sessionFile["background"] = self._getSourceData(
+                "background", bgImage.getData(copy=False))
+            sessionFile["background X scale"] = [
+                bgImage.getOrigin()[0],
+                bgImage.getScale()[0]]
+            sessionFile["background Y scale"] = [
+                bgImage.getOrigin()[1],
+                bgImage.getScale()[1]]
+
+            if self._scatterLayers:
+                layersGroup = sessionFile.create_group(SCATTER_LAYERS)
+                for index, name in enumerate(self._scatterLayers):
+                    layer = self._scatterLayers[name]
+                    group = layersGroup.create_group(name)
+                    group.attrs["index"] = index
+                    group.attrs["selected"] = \
+                        self._selectedLayers.index(name) \
+                        if name in self._selectedLayers else -1
+                    group["x"] = layer["x"]
+                    group["y"] = layer["y"]
+                    group["values"] = layer["values"]
+                    write_mask(group, "mask",
+                               self.getLayerSelectionMask(name, copy=False),
+                               compression=None, encoding=maskEncoding)
+            else:
+                sessionFile["scatter x"] = self._getSourceData(
+                    "scatter x", scatter.getXData(copy=False))
+                sessionFile["scatter y"] = self._getSourceData(
+                    "scatter y", scatter.getYData(copy=False))
+                sessionFile["scatter values"] = self._getSourceData(
+                    "scatter values", scatter.getValueData(copy=False))
+
+            write_mask(sessionFile, "mask", self.getSelectionMask(copy=False),
+                       compression=None, encoding=maskEncoding)
+            if history:
+                self._recordMask()
+                write_history(sessionFile, self._maskHistory)
 
     def loadSession(self, path):
         """Load session from an HDF5 file.
 
         Data loaded:
          - background image (2D dataset) with xscale and yscale
-         - scatter data: x, y, values (3 x 1D datasets)
+         - scatter data: x, y, values (3 x 1D datasets), or the scatter
+           layers and their masks
          - mask (1D array)
+         - mask undo/redo history, if saved
 
         :param path: Name/path of session file
         """
+        from silx.io import is_file
         if not is_file(path):
             raise IOError("Cannot read %s as an HDF5 file")
         # todo: sanity tests
 
         sessionFile = h5py.File(path, "r")
 
-        self.setBackgroundImage(sessionFile["background"],
+        # contiguous uncompressed datasets are memory-mapped, not read
+        self.setBackgroundImage(map_or_read(sessionFile["background"]),
                                 xscale=sessionFile["background X scale"],
-                                yscale=sessionFile["background Y scale"])
+                                yscale=sessionFile["background Y scale"],
+                                copy=False)
+
+        names, selected = scatter_layer_names(sessionFile)
+        if names:
+            self._clearScatterLayers()
+            for name in names:
+                group = sessionFile[SCATTER_LAYERS][name]
+                self.addScatterLayer(name, map_or_read(group["x"]),
+                                     map_or_read(group["y"]),
+                                     map_or_read(group["values"]),
+                                     mask=read_mask(group, "mask"),
+                                     copy=False)
+            self.setSelectedScatterLayers(selected)
+            mask = self.getSelectionMask(copy=False)
+        else:
+            self.setScatter(map_or_read(sessionFile["scatter x"]),
+                            map_or_read(sessionFile["scatter y"]),
+                            map_or_read(sessionFile["scatter values"]),
+                            copy=False)
+            mask = read_mask(sessionFile, "mask")
+            self.setSelectionMask(mask, copy=False)
+        self._setMaskHistory(read_history(
+            sessionFile, mask, maxBytes=self._maskHistory.getMaxBytes()))
 
-        self.setScatter(sessionFile["scatter x"],
-                        sessionFile["scatter y"],
-                        sessionFile["scatter values"])
+        sessionFile.close()
 
-        self.setSelectionMask(sessionFile["mask"])
+    def loadSessionAsync(self, path):
+        """Read a session file in a worker thread, then display it as
+        :meth:`loadSession`.
 
-        sessionFile.close()
+        Pending background, scatter and session loads are cancelled.
+
+        :param path: Name/path of session file
+        :return: Future with progress and cancel
+        :rtype: asyncload.LoadFuture
+        """
+        from silx.io import is_file
+        if not is_file(path):
+            raise IOError("Cannot read %s as an HDF5 file" % path)
+        loader = self._getAsyncLoader()
+        loader.cancel("background")
+        loader.cancel("scatter")
+
+        historyBytes = self._maskHistory.getMaxBytes()
+
+        def read(future):
+            with h5py.File(path, "r") as sessionFile:
+                layerNames, selected = scatter_layer_names(sessionFile)
+            names = ["background", "background X scale",
+                     "background Y scale"]
+            if layerNames:
+                names += ["%s/%s/%s" % (SCATTER_LAYERS, name, key)
+                          for name in layerNames
+                          for key in ("x", "y", "values", "mask")]
+            else:
+                names += ["scatter x", "scatter y", "scatter values"]
+            names += ["mask", "mask history"]
+            session = read_session(path, names, future, historyBytes)
+            return session, layerNames, selected
+
+        def display(result):
+            session, layerNames, selected = result
+            self.setBackgroundImage(session["background"],
+                                    xscale=session["background X scale"],
+                                    yscale=session["background Y scale"])
+            if layerNames:
+                self._clearScatterLayers()
+                for name in layerNames:
+                    prefix = "%s/%s/" % (SCATTER_LAYERS, name)
+                    self.addScatterLayer(name, session[prefix + "x"],
+                                         session[prefix + "y"],
+                                         session[prefix + "values"],
+                                         mask=session[prefix + "mask"],
+                                         copy=False)
+                self.setSelectedScatterLayers(selected)
+            else:
+                self.setScatter(session["scatter x"],
+                                session["scatter y"],
+                                session["scatter values"])
+                self.setSelectionMask(session["mask"], copy=False)
+            self._setMaskHistory(session["mask history"])
+
+        return loader.submit("session", read, display)
 
 
 if __name__ == "__main__":
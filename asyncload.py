@@ -0,0 +1,241 @@
+# coding: utf-8
+"""
+Background loading of arrays for :mod:`MaskImageWidget` and
+:mod:`MaskScatterWidget`.
+
+Reading and preprocessing run in a thread pool. The prepared arrays are
+handed back to the GUI thread through a queued signal, where a callback
+gives them to the plot.
+"""
+
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+import numpy
+
+from silx.gui import qt
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+from maskhistory import read_history
+from sessionio import read_mask, read_scale, row_blocks
+
+
+class LoadFuture(qt.QObject):
+    """Handle on a background load, created by :meth:`AsyncLoader.submit`.
+
+    Signals are emitted in the GUI thread.
+    """
+
+    sigProgress = qt.Signal(int)
+    """Emitted with the percentage of the load done"""
+
+    sigFinished = qt.Signal()
+    """Emitted when the load succeeded (after the data was given to the
+    plot), failed or was cancelled"""
+
+    def __init__(self, key, callback, parent=None):
+        super(LoadFuture, self).__init__(parent)
+        self._key = key
+        self._callback = callback
+        self._cancelled = False
+        self._done = False
+        self._progress = 0
+        self._result = None
+        self._exception = None
+
+    def cancel(self):
+        """Request the load to stop. The data is not given to the plot."""
+        if not self._done:
+            self._cancelled = True
+            self._finish()
+
+    def isCancelled(self):
+        return self._cancelled
+
+    def isDone(self):
+        """True if the load is finished, successful or not"""
+        return self._done
+
+    def progress(self):
+        """Percentage of the load done"""
+        return self._progress
+
+    def result(self):
+        """Return the loaded data (None if not done or failed)"""
+        return self._result
+
+    def exception(self):
+        """Return the exception raised by the load, if any"""
+        return self._exception
+
+    def setProgress(self, progress):
+        """Called from the worker thread to report progress.
+
+        :raise CancelledError: If the load was cancelled
+        """
+        if self._cancelled:
+            raise CancelledError()
+        self._progress = int(progress)
+        self.sigProgress.emit(self._progress)
+
+    def _finish(self):
+        self._done = True
+        self.sigFinished.emit()
+
+
+class AsyncLoader(qt.QObject):
+    """Run load tasks in a thread pool and deliver their result in the GUI
+    thread.
+
+    Only the latest load of each *key* is delivered: submitting a new load
+    cancels the previous one with the same key.
+
+    :param int maxWorkers: Number of worker threads
+    """
+
+    _sigLoaded = qt.Signal(object, object, object)
+    """Emitted from a worker thread with (future, result, exception)"""
+
+    def __init__(self, parent=None, maxWorkers=2):
+        super(AsyncLoader, self).__init__(parent)
+        self._executor = ThreadPoolExecutor(maxWorkers)
+        self._current = {}
+        self._sigLoaded.connect(self._loaded, qt.Qt.QueuedConnection)
+
+    def submit(self, key, task, callback):
+        """Start a background load.
+
+        :param str key: Target of the load (e.g. "image")
+        :param task: Function called in a worker thread with the
+            :class:`LoadFuture` as argument, returning the loaded data. It
+            should call :meth:`LoadFuture.setProgress` regularly.
+        :param callback: Function called in the GUI thread with the result
+        :rtype: LoadFuture
+        """
+        previous = self._current.get(key)
+        if previous is not None:
+            previous.cancel()
+        future = LoadFuture(key, callback, parent=self)
+        self._current[key] = future
+        self._executor.submit(self._run, future, task)
+        return future
+
+    def _run(self, future, task):
+        try:
+            result = task(future)
+        except CancelledError:
+            return
+        except Exception as e:
+            self._sigLoaded.emit(future, None, e)
+        else:
+            self._sigLoaded.emit(future, result, None)
+
+    def _loaded(self, future, result, exception):
+        if self._current.get(future._key) is future:
+            del self._current[future._key]
+        if future.isCancelled():
+            return
+        future._exception = exception
+        if exception is None:
+            future._result = result
+            future._callback(result)
+            future._progress = 100
+        future._finish()
+
+    def cancel(self, key):
+        """Cancel the pending load of *key*, if any"""
+        future = self._current.pop(key, None)
+        if future is not None:
+            future.cancel()
+
+    def cancelAll(self):
+        """Cancel all the pending loads"""
+        for future in list(self._current.values()):
+            future.cancel()
+        self._current.clear()
+
+    def shutdown(self):
+        """Cancel pending loads and stop the worker threads"""
+        self.cancelAll()
+        self._executor.shutdown(wait=True)
+
+
+def read_array(source, future=None, dtype=None, progress=(0, 100)):
+    """Read an array from a file or dataset, block by block.
+
+    :param source: numpy array (possibly memory-mapped), h5py Dataset,
+        path of a ``.npy`` file, or ``"<file>::<dataset path>"`` for an
+        HDF5 dataset
+    :param LoadFuture future: To report progress and check cancellation
+    :param dtype: Type to convert the data to, default: same type in the
+        native byte order
+    :param progress: (first, last) percentage to report for this array
+    :rtype: numpy.ndarray
+    """
+    if isinstance(source, str):
+        if "::" in source:
+            path, name = source.split("::", 1)
+            with h5py.File(path, "r") as h5file:
+                return read_array(h5file[name], future, dtype, progress)
+        elif source.lower().endswith(".npy"):
+            source = numpy.load(source, mmap_mode="r")
+        else:
+            raise ValueError("Unsupported source: %s" % source)
+
+    if dtype is None:
+        dtype = source.dtype.newbyteorder("=")
+    dtype = numpy.dtype(dtype)
+    if (isinstance(source, numpy.ndarray) and
+            not isinstance(source, numpy.memmap) and source.dtype == dtype):
+        return source   # already in memory
+
+    data = numpy.empty(source.shape, dtype=dtype)
+    if data.ndim == 0:
+        data[()] = source[()]
+        return data
+    blocks = row_blocks(source)
+    first, last = progress
+    for index, (start, stop) in enumerate(blocks):
+        if future is not None:
+            future.setProgress(first + (last - first) * index // len(blocks))
+        if h5py is not None and isinstance(source, h5py.Dataset):
+            if source.dtype == dtype:
+                source.read_direct(data, source_sel=numpy.s_[start:stop],
+                                   dest_sel=numpy.s_[start:stop])
+                continue
+        data[start:stop] = source[start:stop]
+    return data
+
+
+def read_session(path, names, future=None, historyBytes=32 * 2**20):
+    """Read the datasets of a session file.
+
+    Scale datasets (names ending with " scale") are read as (origin,
+    scale) pairs, "mask" (and names ending with "/mask", e.g. the masks
+    of scatter layers) with :func:`sessionio.read_mask` and
+    "mask history" (after "mask") with :func:`maskhistory.read_history`.
+
+    :param str path: Session file
+    :param names: Names of the datasets to read
+    :param int historyBytes: Memory budget of the mask history
+    :return: dict of the data by name
+    """
+    result = {}
+    with h5py.File(path, "r") as sessionFile:
+        for index, name in enumerate(names):
+            span = (100 * index // len(names),
+                    100 * (index + 1) // len(names))
+            if name.endswith(" scale"):
+                result[name] = read_scale(sessionFile, name)
+            elif name == "mask" or name.endswith("/mask"):
+                result[name] = read_mask(sessionFile, name)
+            elif name == "mask history":
+                result[name] = read_history(sessionFile, result.get("mask"),
+                                            name, historyBytes)
+            else:
+                result[name] = read_array(sessionFile[name], future,
+                                          progress=span)
+    return result
@@ -0,0 +1,230 @@
+"""
+Benchmark of the multipoop ``f0`` kernel over array size, number of workers
+and parallel backend.
+
+Backends:
+
+- ``serial``: plain numpy call
+- ``queue``: fresh processes returning their chunk through a
+  :class:`multiprocessing.Queue` (the original multipoop approach)
+- ``threads``: thread pool writing chunks in place, numpy releases the GIL
+  inside the ufuncs
+- ``shm``: :class:`parallel_array.ArrayPool` shared memory process pool,
+  the input being shared once per size, outside of the timed calls
+
+Usage::
+
+    python bench_f0.py --min-exp 3 --max-exp 9 --output bench_f0
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+from multipoop import f0
+from parallel_array import ArrayPool, chunk_bounds
+
+
+BACKENDS = ("serial", "queue", "threads", "shm")
+
+
+def _queue_worker(func, x, start, stop, queue):
+    queue.put(func(x[start:stop]))
+
+
+def queue_map(func, x, nworkers):
+    """Original multipoop fan-out: the input is pickled into every process
+    and each result chunk comes back through a queue."""
+    bounds = chunk_bounds(len(x), -(-len(x) // nworkers))
+    queues = [multiprocessing.Queue() for _ in bounds]
+    processes = [multiprocessing.Process(target=_queue_worker,
+                                         args=(func, x, start, stop, q))
+                 for (start, stop), q in zip(bounds, queues)]
+    for p in processes:
+        p.start()
+    y = numpy.empty_like(x)
+    for (start, stop), q in zip(bounds, queues):
+        y[start:stop] = q.get()
+    for p in processes:
+        p.join()
+    return y
+
+
+def thread_map(executor, func, x, nworkers):
+    """Evaluate chunks in a thread pool, writing in place in the output."""
+    y = numpy.empty_like(x)
+
+    def work(bounds):
+        start, stop = bounds
+        y[start:stop] = func(x[start:stop])
+
+    list(executor.map(work, chunk_bounds(len(x), -(-len(x) // nworkers))))
+    return y
+
+
+def available_memory():
+    """Available physical memory in bytes, or None if unknown."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def worker_counts(maximum):
+    """Powers of 2 up to *maximum*, plus *maximum*."""
+    counts = []
+    n = 1
+    while n < maximum:
+        counts.append(n)
+        n *= 2
+    counts.append(maximum)
+    return counts
+
+
+def measure(func, repeats, warmup):
+    """Return the list of *repeats* durations of *func()*, measured with
+    :func:`time.perf_counter` after *warmup* untimed calls."""
+    for _ in range(warmup):
+        func()
+    durations = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - t0)
+    return durations
+
+
+def run(sizes, workers, backends, repeats=5, warmup=1):
+    """Run the benchmark.
+
+    :return: List of result records (dict)
+    """
+    results = []
+    pools = {}
+    executors = {}
+    try:
+        for size in sizes:
+            x = numpy.linspace(0, 120245, size)
+            reference = f0(x)
+
+            for backend in backends:
+                for nworkers in ([1] if backend == "serial" else workers):
+                    shared = None
+                    if backend == "serial":
+                        call = lambda: f0(x)
+                    elif backend == "queue":
+                        call = lambda: queue_map(f0, x, nworkers)
+                    elif backend == "threads":
+                        if nworkers not in executors:
+                            executors[nworkers] = ThreadPoolExecutor(nworkers)
+                        executor = executors[nworkers]
+                        call = lambda: thread_map(executor, f0, x, nworkers)
+                    else:
+                        if nworkers not in pools:
+                            pools[nworkers] = ArrayPool(nworkers)
+                        pool = pools[nworkers]
+                        # x is copied to shared memory once, not timed
+                        shared = pool.share(x)
+                        call = lambda: pool.map(f0, shared)
+
+                    try:
+                        assert numpy.allclose(call(), reference)
+                        durations = measure(call, repeats, warmup)
+                    finally:
+                        if shared is not None:
+                            pool.unshare(shared)
+                    record = {"backend": backend,
+                              "size": size,
+                              "workers": nworkers,
+                              "median": float(numpy.median(durations)),
+                              "min": min(durations),
+                              "repeats": repeats}
+                    results.append(record)
+                    print("%(backend)8s N=%(size)-11d workers=%(workers)-3d "
+                          "median=%(median).6fs" % record)
+    finally:
+        for pool in pools.values():
+            pool.close()
+        for executor in executors.values():
+            executor.shutdown()
+    return results
+
+
+def crossover_table(results):
+    """Smallest size at which each (backend, workers) beats serial numpy.
+
+    :return: List of (backend, workers, size or None)
+    """
+    serial = dict((r["size"], r["median"]) for r in results
+                  if r["backend"] == "serial")
+    table = {}
+    for r in results:
+        if r["backend"] == "serial" or r["size"] not in serial:
+            continue
+        key = (r["backend"], r["workers"])
+        table.setdefault(key, None)
+        if r["median"] < serial[r["size"]]:
+            if table[key] is None or r["size"] < table[key]:
+                table[key] = r["size"]
+    return [key + (table[key],) for key in sorted(table)]
+
+
+def write_results(results, prefix):
+    """Write *results* to ``<prefix>.csv`` and ``<prefix>.json``."""
+    fields = ["backend", "size", "workers", "median", "min", "repeats"]
+    with open(prefix + ".csv", "w") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(results)
+    with open(prefix + ".json", "w") as f:
+        json.dump({"results": results,
+                   "crossover": crossover_table(results)}, f, indent=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--min-exp", type=int, default=3,
+                        help="Smallest size as a power of 10")
+    parser.add_argument("--max-exp", type=int, default=9,
+                        help="Largest size as a power of 10")
+    parser.add_argument("--max-workers", type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument("--backends", default=",".join(BACKENDS),
+                        help="Comma separated list of backends")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--output", default="bench_f0",
+                        help="Prefix of the CSV and JSON result files")
+    args = parser.parse_args()
+
+    # input, reference, result, and the temporaries of f0
+    memory = available_memory()
+    sizes = []
+    for exp in range(args.min_exp, args.max_exp + 1):
+        size = 10 ** exp
+        if memory is not None and 6 * 8 * size > memory:
+            print("Skipping N=%d: not enough memory" % size)
+            continue
+        sizes.append(size)
+
+    results = run(sizes,
+                  worker_counts(args.max_workers),
+                  args.backends.split(","),
+                  repeats=args.repeats,
+                  warmup=args.warmup)
+    write_results(results, args.output)
+
+    print("\nCrossover (smallest N faster than serial numpy):")
+    for backend, nworkers, size in crossover_table(results):
+        print("%8s workers=%-3d %s" % (
+            backend, nworkers, "never" if size is None else size))
+
+
+if __name__ == "__main__":
+    main()
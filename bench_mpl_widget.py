@@ -0,0 +1,110 @@
+"""
+Benchmark of the refresh rate of the :mod:`mpl_widget` window.
+
+Modes:
+
+- ``full``: the original redraw, clearing the axes, plotting a new line
+  and drawing the whole canvas
+- ``blit``: :meth:`mpl_widget.Window.setData`, updating the line data and
+  blitting it over the cached background
+
+Usage::
+
+    python bench_mpl_widget.py --sizes 10,1000,100000 --duration 2
+"""
+
+import argparse
+import csv
+import json
+import time
+
+import numpy
+
+from matplotlib.backends.qt_compat import QtWidgets
+
+from mpl_widget import Window
+
+
+MODES = ("full", "blit")
+
+
+def full_redraw(window, x, y):
+    """Original Window.plot redraw: new line on cleared axes, full draw"""
+    window.ax.clear()
+    window.ax.plot(x, y, '*-')
+    window.canvas.draw()
+
+
+def refresh_rate(app, update, frames, duration):
+    """Number of updates per second, each one displayed before the next.
+
+    :param update: Function called with the index of the frame
+    :param frames: Number of different data sets cycled through
+    :param float duration: Measurement duration in seconds
+    """
+    count = 0
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < duration:
+        update(count % frames)
+        app.processEvents()
+        count += 1
+    return count / (time.perf_counter() - t0)
+
+
+def run(app, sizes, modes, duration=2., frames=16):
+    """Run the benchmark.
+
+    :return: List of result records (dict)
+    """
+    results = []
+    rng = numpy.random.RandomState(0)
+    for size in sizes:
+        x = numpy.arange(size)
+        ys = rng.rand(frames, size)
+        for mode in modes:
+            window = Window()
+            window.show()
+            app.processEvents()
+            if mode == "full":
+                update = lambda i: full_redraw(window, x, ys[i])
+            else:
+                window.setData(x, ys[0])   # sets the limits
+                app.processEvents()
+                update = lambda i: window.setData(x, ys[i])
+            record = {"mode": mode, "size": size,
+                      "fps": refresh_rate(app, update, frames, duration)}
+            results.append(record)
+            print("%(mode)5s N=%(size)-9d %(fps)8.1f frames/s" % record)
+            window.close()
+    return results
+
+
+def write_results(results, prefix):
+    """Write *results* to ``<prefix>.csv`` and ``<prefix>.json``."""
+    with open(prefix + ".csv", "w") as f:
+        writer = csv.DictWriter(f, fieldnames=["mode", "size", "fps"])
+        writer.writeheader()
+        writer.writerows(results)
+    with open(prefix + ".json", "w") as f:
+        json.dump({"results": results}, f, indent=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default="10,1000,100000",
+                        help="Comma separated numbers of points")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--duration", type=float, default=2.,
+                        help="Seconds per measurement")
+    parser.add_argument("--output", default="bench_mpl_widget",
+                        help="Prefix of the CSV and JSON result files")
+    args = parser.parse_args()
+
+    app = QtWidgets.QApplication([])
+    results = run(app, [int(s) for s in args.sizes.split(",")],
+                  args.modes.split(","), duration=args.duration)
+    write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
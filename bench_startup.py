@@ -0,0 +1,115 @@
+"""
+Benchmark of the import and construction time of the mask widgets.
+
+Every measurement runs in a fresh interpreter, so that modules imported by
+a previous measurement are not cached:
+
+- ``import``: import of the widget module
+- ``construct``: creation of ``--count`` widgets, never shown
+- ``show``: first display of one widget (creates its toolbar)
+
+Usage::
+
+    QT_QPA_PLATFORM=offscreen python bench_startup.py --count 30 \\
+        --output bench_startup
+"""
+
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+
+import numpy
+
+
+WIDGETS = ("MaskImageWidget", "MaskScatterWidget")
+
+_SCRIPT = """
+import json, sys, time
+t0 = time.perf_counter()
+import %(module)s
+t1 = time.perf_counter()
+from silx.gui import qt
+app = qt.QApplication([])
+widgets = []
+t2 = time.perf_counter()
+for _ in range(%(count)d):
+    widgets.append(%(module)s.%(module)s())
+t3 = time.perf_counter()
+widgets[0].show()
+app.processEvents()
+t4 = time.perf_counter()
+json.dump({"import": t1 - t0, "construct": t3 - t2, "show": t4 - t3},
+          sys.stdout)
+"""
+
+
+def measure_once(module, count):
+    """Run one measurement in a new interpreter.
+
+    :return: dict of the durations in seconds
+    """
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    here = os.path.dirname(os.path.abspath(__file__))
+    env["PYTHONPATH"] = os.pathsep.join(
+        [here] + [p for p in env.get("PYTHONPATH", "").split(os.pathsep)
+                  if p])
+    output = subprocess.check_output(
+        [sys.executable, "-c", _SCRIPT % {"module": module, "count": count}],
+        env=env)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def run(widgets, count, repeats):
+    """Run the benchmark.
+
+    :return: List of result records (dict)
+    """
+    results = []
+    for module in widgets:
+        runs = [measure_once(module, count) for _ in range(repeats)]
+        for step in ("import", "construct", "show"):
+            durations = [r[step] for r in runs]
+            record = {"widget": module,
+                      "step": step,
+                      "count": count if step == "construct" else 1,
+                      "median": float(numpy.median(durations)),
+                      "min": min(durations),
+                      "repeats": repeats}
+            results.append(record)
+            print("%(widget)18s %(step)9s x%(count)-4d "
+                  "median=%(median).4fs" % record)
+    return results
+
+
+def write_results(results, prefix):
+    """Write *results* to ``<prefix>.csv`` and ``<prefix>.json``."""
+    fields = ["widget", "step", "count", "median", "min", "repeats"]
+    with open(prefix + ".csv", "w") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(results)
+    with open(prefix + ".json", "w") as f:
+        json.dump({"results": results}, f, indent=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--widgets", default=",".join(WIDGETS),
+                        help="Comma separated list of widget modules")
+    parser.add_argument("--count", type=int, default=30,
+                        help="Number of widgets created")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", default="bench_startup",
+                        help="Prefix of the CSV and JSON result files")
+    args = parser.parse_args()
+
+    results = run(args.widgets.split(","), args.count, args.repeats)
+    write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
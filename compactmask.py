@@ -0,0 +1,170 @@
+# coding: utf-8
+"""
+Compact storage of binary selection masks.
+
+A :class:`CompactMask` stores one bit per pixel (or scatter point) with
+:func:`numpy.packbits`, that is 8 times less memory than the uint8 arrays
+used by the silx mask tools. It can also be converted to and from a
+run-length encoding, which is smaller for sparse masks.
+
+Only the masked / not masked information is kept: masks using several
+levels are flattened to ``mask != 0``.
+"""
+
+import numpy
+
+
+_POPCOUNT = numpy.array([bin(i).count("1") for i in range(256)],
+                        dtype=numpy.uint8)
+"""Number of bits set in each byte value"""
+
+
+class CompactMask(object):
+    """Bit-packed binary mask of any shape.
+
+    :param numpy.ndarray bits: Packed bits (1D uint8 array of
+        ``ceil(size / 8)`` bytes, big-endian bit order)
+    :param shape: Shape of the unpacked mask
+    """
+    def __init__(self, bits, shape):
+        self._shape = tuple(int(n) for n in shape)
+        self._size = int(numpy.prod(self._shape))
+        bits = numpy.asarray(bits, dtype=numpy.uint8).ravel()
+        if len(bits) != (self._size + 7) // 8:
+            raise ValueError("Packed bits do not match mask shape")
+        self._bits = bits
+        self._clearPadding()
+        self._unpacked = None
+
+    @classmethod
+    def fromArray(cls, mask):
+        """Create a compact mask from an array (non-zero is masked)."""
+        mask = numpy.asarray(mask)
+        return cls(numpy.packbits(mask != 0, axis=None), mask.shape)
+
+    @classmethod
+    def zeros(cls, shape):
+        """Create an empty mask."""
+        size = int(numpy.prod(shape))
+        return cls(numpy.zeros(((size + 7) // 8,), dtype=numpy.uint8), shape)
+
+    @classmethod
+    def fromRle(cls, starts, lengths, shape):
+        """Create a compact mask from a run-length encoding.
+
+        :param starts: Flat (C order) index of the first item of each run
+        :param lengths: Number of masked items of each run
+        :param shape: Shape of the mask
+        """
+        size = int(numpy.prod(shape))
+        starts = numpy.asarray(starts, dtype=numpy.int64)
+        lengths = numpy.asarray(lengths, dtype=numpy.int64)
+        # +1 at each run start, -1 after each run end, then integrate
+        steps = numpy.zeros((size + 1,), dtype=numpy.int8)
+        numpy.add.at(steps, starts, 1)
+        numpy.add.at(steps, starts + lengths, -1)
+        flat = numpy.cumsum(steps[:-1], dtype=numpy.int8) != 0
+        return cls(numpy.packbits(flat), shape)
+
+    def _clearPadding(self):
+        """Reset the unused bits of the last byte"""
+        extra = len(self._bits) * 8 - self._size
+        padding = numpy.uint8((1 << extra) - 1)
+        if extra and self._bits[-1] & padding:
+            # do not modify the caller's array
+            self._bits = self._bits.copy()
+            self._bits[-1] &= ~padding
+
+    @property
+    def shape(self):
+        """Shape of the unpacked mask"""
+        return self._shape
+
+    @property
+    def nbytes(self):
+        """Memory used by the packed bits"""
+        return self._bits.nbytes
+
+    def getBits(self, copy=True):
+        """Return the packed bits (see :func:`numpy.packbits`)."""
+        return numpy.array(self._bits) if copy else self._bits
+
+    def asUint8(self):
+        """Return the mask as a uint8 array of 0 and 1, as used by the
+        silx mask tools.
+
+        The unpacked array is computed once and cached. It is read-only:
+        copy it to get an array the mask tools can draw in.
+        """
+        if self._unpacked is None:
+            unpacked = numpy.unpackbits(self._bits, count=self._size)
+            unpacked = unpacked.reshape(self._shape)
+            unpacked.flags.writeable = False
+            self._unpacked = unpacked
+        return self._unpacked
+
+    def count(self):
+        """Number of masked items"""
+        return int(_POPCOUNT[self._bits].sum(dtype=numpy.int64))
+
+    def toRle(self):
+        """Return the run-length encoding of the flattened mask.
+
+        :return: (starts, lengths) arrays of int64
+        """
+        flat = numpy.unpackbits(self._bits, count=self._size)
+        edges = numpy.diff(numpy.concatenate(([0], flat, [0])).astype(
+            numpy.int8))
+        starts = numpy.flatnonzero(edges == 1)
+        ends = numpy.flatnonzero(edges == -1)
+        return starts.astype(numpy.int64), (ends - starts).astype(numpy.int64)
+
+    def rleSize(self):
+        """Number of bytes needed by :meth:`toRle` arrays"""
+        flat = numpy.unpackbits(self._bits, count=self._size)
+        return 16 * numpy.count_nonzero(numpy.diff(flat, prepend=0) == 1)
+
+    def _check(self, other):
+        if not isinstance(other, CompactMask):
+            other = CompactMask.fromArray(other)
+        if other.shape != self.shape:
+            raise ValueError("Mask shapes differ: %s, %s" % (
+                self.shape, other.shape))
+        return other
+
+    def __or__(self, other):
+        other = self._check(other)
+        return CompactMask(self._bits | other._bits, self._shape)
+
+    def __and__(self, other):
+        other = self._check(other)
+        return CompactMask(self._bits & other._bits, self._shape)
+
+    def __xor__(self, other):
+        other = self._check(other)
+        return CompactMask(self._bits ^ other._bits, self._shape)
+
+    def __invert__(self):
+        return CompactMask(~self._bits, self._shape)
+
+    def union(self, other):
+        """Items masked in this mask or in *other*"""
+        return self | other
+
+    def intersection(self, other):
+        """Items masked in both this mask and *other*"""
+        return self & other
+
+    def invert(self):
+        """Items not masked in this mask"""
+        return ~self
+
+    def __eq__(self, other):
+        if not isinstance(other, CompactMask):
+            return NotImplemented
+        return (self._shape == other._shape and
+                numpy.array_equal(self._bits, other._bits))
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
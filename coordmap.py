@@ -0,0 +1,130 @@
+# coding: utf-8
+"""
+Vectorized mapping between scatter points and the pixels of an image
+placed in the same plot with an (origin, scale) affine transform.
+
+This module does not depend on Qt.
+"""
+
+import numpy
+
+
+class AffineMapping(object):
+    """Mapping between data coordinates and the pixels of an image.
+
+    Pixel *(row, col)* covers data coordinates
+    ``x0 + col * xs <= x < x0 + (col + 1) * xs`` and likewise for y, as
+    for images displayed with ``origin=(x0, y0)`` and ``scale=(xs, ys)``.
+
+    :param shape: (nrows, ncols) of the image
+    :param xscale: (x0, xs) origin and scale along x
+    :param yscale: (y0, ys) origin and scale along y
+    """
+    def __init__(self, shape, xscale=(0, 1.), yscale=(0, 1.)):
+        self.shape = tuple(int(n) for n in shape[:2])
+        self._x0, xs = float(xscale[0]), float(xscale[1])
+        self._y0, ys = float(yscale[0]), float(yscale[1])
+        self._xinv = 1. / xs
+        self._yinv = 1. / ys
+
+    def pointsToPixels(self, x, y):
+        """Return the (row, col) pixel of every point, -1 if outside.
+
+        :rtype: 2-tuple of 1D numpy.ndarray of int
+        """
+        cols = numpy.floor((numpy.asarray(x) - self._x0) * self._xinv)
+        rows = numpy.floor((numpy.asarray(y) - self._y0) * self._yinv)
+        nrows, ncols = self.shape
+        # NaN coordinates fail both comparisons
+        inside = (rows >= 0) & (rows < nrows) & (cols >= 0) & (cols < ncols)
+        rows = numpy.where(inside, rows, -1).astype(numpy.intp)
+        cols = numpy.where(inside, cols, -1).astype(numpy.intp)
+        return rows, cols
+
+    def flatIndices(self, x, y):
+        """Return the flat (C order) pixel index of every point, -1 if
+        outside."""
+        rows, cols = self.pointsToPixels(x, y)
+        flat = rows * self.shape[1] + cols
+        flat[rows < 0] = -1
+        return flat
+
+    def pixelsToPoints(self, rows, cols):
+        """Return the data coordinates of pixel centers"""
+        xs, ys = 1. / self._xinv, 1. / self._yinv
+        return (self._x0 + (numpy.asarray(cols) + 0.5) * xs,
+                self._y0 + (numpy.asarray(rows) + 0.5) * ys)
+
+    def sample(self, image, x, y, fill=numpy.nan, flat=None):
+        """Values of *image* under every point.
+
+        :param numpy.ndarray image: Image of shape :attr:`shape` (or RGB(A)
+            pixmap)
+        :param fill: Value for the points outside of the image
+        :param flat: Result of :meth:`flatIndices` if already computed
+        :rtype: numpy.ndarray
+        """
+        image = numpy.asarray(image)
+        if flat is None:
+            flat = self.flatIndices(x, y)
+        pixels = image.reshape((-1,) + image.shape[2:])
+        outside = flat < 0
+        values = pixels[numpy.where(outside, 0, flat)]
+        if numpy.any(outside):
+            values = values.astype(numpy.result_type(values, fill))
+            values[outside] = fill
+        return values
+
+    def rasterize(self, mask, x, y, mode="any", flat=None):
+        """Project a scatter mask onto the image grid.
+
+        :param mask: 1D array of the mask of the points (non-zero: masked)
+        :param str mode: "any" for a uint8 image of pixels containing at
+            least one masked point, "count" for the number of masked
+            points per pixel
+        :param flat: Result of :meth:`flatIndices` if already computed
+        :rtype: 2D numpy.ndarray
+        """
+        if flat is None:
+            flat = self.flatIndices(x, y)
+        selected = flat[(numpy.asarray(mask) != 0) & (flat >= 0)]
+        size = self.shape[0] * self.shape[1]
+        counts = numpy.bincount(selected, minlength=size).reshape(self.shape)
+        if mode == "count":
+            return counts
+        return (counts > 0).astype(numpy.uint8)
+
+
+class PixelPointIndex(object):
+    """Inverse lookup of the points falling in each pixel, using the point
+    indices sorted by pixel.
+
+    :param flat: Flat pixel index of every point (-1 if outside), as
+        returned by :meth:`AffineMapping.flatIndices`
+    :param int npixels: Number of pixels of the image
+    """
+    def __init__(self, flat, npixels):
+        flat = numpy.asarray(flat)
+        inside = numpy.flatnonzero(flat >= 0)
+        self._order = inside[numpy.argsort(flat[inside], kind="stable")]
+        counts = numpy.bincount(flat[inside], minlength=npixels)
+        self._offsets = numpy.zeros((npixels + 1,), dtype=numpy.intp)
+        numpy.cumsum(counts, out=self._offsets[1:])
+        self._flat = flat
+
+    def pointsInPixel(self, flatIndex):
+        """Indices of the points in the pixel of flat index *flatIndex*"""
+        return self._order[self._offsets[flatIndex]:
+                           self._offsets[flatIndex + 1]]
+
+    def pointsInPixels(self, pixelMask):
+        """Indices of the points inside the non-zero pixels of an image
+        mask, in increasing order."""
+        pixelMask = numpy.asarray(pixelMask).reshape(-1) != 0
+        flat = self._flat
+        return numpy.flatnonzero((flat >= 0) &
+                                 pixelMask[numpy.where(flat >= 0, flat, 0)])
+
+    def countPerPixel(self):
+        """Number of points in each pixel (flat array)"""
+        return numpy.diff(self._offsets)
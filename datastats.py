@@ -0,0 +1,109 @@
+# coding: utf-8
+"""
+Statistics of the finite values of an array (range, histogram,
+percentiles), computed block by block without copying the finite values.
+
+This module does not depend on Qt.
+"""
+
+import numpy
+
+
+BLOCK_SIZE = 2**20
+"""Number of items processed at once"""
+
+
+def _blocks(data, block):
+    flat = data.reshape(-1)
+    for start in range(0, flat.size, block):
+        yield flat[start:start + block]
+
+
+def compute_statistics(data, bins=256, percentiles=(1, 99),
+                       block=BLOCK_SIZE):
+    """Compute the statistics of the finite values of *data*.
+
+    The array is read twice by blocks: once for the range, once for the
+    histogram. Percentiles are interpolated from the histogram.
+
+    :param numpy.ndarray data: Array of any shape
+    :param int bins: Number of histogram bins
+    :param percentiles: Percentiles to compute
+    :param int block: Number of items processed at once
+    :return: dict with keys ``"min"``, ``"max"``, ``"count"`` (number of
+        finite values), ``"histogram"``, ``"bin_edges"`` and
+        ``"percentiles"`` (dict). min and max are None if there is no
+        finite value.
+    """
+    data = numpy.asarray(data)
+    if data.dtype == bool:
+        data = data.view(numpy.uint8)   # for numpy.histogram
+    vmin, vmax, count = numpy.inf, -numpy.inf, 0
+    for values in _blocks(data, block):
+        if not numpy.issubdtype(values.dtype, numpy.inexact):
+            # integer and bool values are all finite
+            if values.size:
+                count += values.size
+                vmin = min(vmin, values.min())
+                vmax = max(vmax, values.max())
+            continue
+        finite = numpy.isfinite(values)
+        count += int(numpy.count_nonzero(finite))
+        vmin = min(vmin, numpy.min(values, where=finite, initial=numpy.inf))
+        vmax = max(vmax, numpy.max(values, where=finite, initial=-numpy.inf))
+
+    stats = {"min": None, "max": None, "count": count,
+             "histogram": numpy.zeros((bins,), dtype=numpy.int64),
+             "bin_edges": numpy.linspace(0., 1., bins + 1),
+             "percentiles": {}}
+    if count == 0:
+        return stats
+    stats["min"], stats["max"] = vmin, vmax
+
+    edges = numpy.linspace(float(vmin), float(vmax), bins + 1)
+    if vmin == vmax:
+        edges = numpy.linspace(float(vmin) - .5, float(vmax) + .5, bins + 1)
+    histogram = stats["histogram"]
+    for values in _blocks(data, block):
+        # non finite values fall outside of the edges and are not counted
+        histogram += numpy.histogram(values, bins=edges)[0]
+    stats["bin_edges"] = edges
+
+    cumulated = numpy.cumsum(histogram) / float(count)
+    for percentile in percentiles:
+        stats["percentiles"][percentile] = float(numpy.interp(
+            percentile / 100., numpy.concatenate(([0.], cumulated)), edges))
+    return stats
+
+
+class StatisticsCache(object):
+    """Statistics of several named arrays, recomputed only when the array
+    or its version changes.
+
+    :param int bins: Number of histogram bins
+    """
+    def __init__(self, bins=256):
+        self._bins = bins
+        self._cache = {}
+
+    def get(self, name, data, version=0):
+        """Return the statistics of *data* (see :func:`compute_statistics`).
+
+        :param str name: Name of the array (e.g. "background")
+        :param numpy.ndarray data: The array
+        :param version: Version of the data, to change when the array is
+            modified in place or replaced
+        """
+        key = (id(data), version)
+        cached = self._cache.get(name)
+        if cached is None or cached[0] != key:
+            cached = key, compute_statistics(data, bins=self._bins)
+            self._cache[name] = cached
+        return cached[1]
+
+    def invalidate(self, name=None):
+        """Drop the statistics of *name*, or of all arrays if None"""
+        if name is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(name, None)
@@ -0,0 +1,86 @@
+# coding: utf-8
+"""
+Min/max decimation of long 1D signals for display.
+
+The visible range of the signal is split in one bin per horizontal pixel,
+and each bin is drawn as a vertical segment from its minimum to its
+maximum. The drawn extremes of every pixel, hence of the whole view, are
+the extremes of the full resolution signal.
+
+This module does not depend on Qt.
+"""
+
+import collections
+
+import numpy
+
+
+def minmax_envelope(x, y, xmin, xmax, npixels):
+    """Min/max envelope of the samples of *y* with ``xmin <= x <= xmax``.
+
+    The samples just outside of the range are kept so that the line
+    continues to the border of the view. Ranges with less than two samples
+    per pixel are returned as is. Bins without finite value are drawn as
+    gaps.
+
+    :param x: 1D array of increasing abscissas
+    :param y: 1D array of values
+    :param int npixels: Number of bins
+    :return: (x, y) arrays of at most ``2 * npixels + 2`` points
+    """
+    first = numpy.searchsorted(x, xmin, side="left")
+    last = numpy.searchsorted(x, xmax, side="right")
+    before, after = max(first - 1, 0), min(last + 1, len(x))
+    if last - first <= 2 * npixels:
+        return x[before:after], y[before:after]
+
+    edges = numpy.linspace(xmin, xmax, npixels + 1)[:-1]
+    # start of each non-empty bin, relative to first
+    starts = numpy.unique(numpy.searchsorted(x[first:last], edges))
+    starts = starts[starts < last - first]   # bins after the last sample
+    values = y[first:last]
+    with numpy.errstate(invalid="ignore"):
+        mins = numpy.fmin.reduceat(values, starts)
+        maxs = numpy.fmax.reduceat(values, starts)
+
+    xs = numpy.empty((2 * len(starts) + 2,), dtype=numpy.result_type(x))
+    ys = numpy.empty((2 * len(starts) + 2,),
+                     dtype=numpy.result_type(y, numpy.float64))
+    xs[1:-1] = numpy.repeat(x[first + starts], 2)
+    ys[1:-1:2] = mins
+    ys[2:-1:2] = maxs
+    xs[0], ys[0] = x[before], y[before]
+    xs[-1], ys[-1] = x[after - 1], y[after - 1]
+    if before == first:
+        xs, ys = xs[1:], ys[1:]
+    if after == last:
+        xs, ys = xs[:-1], ys[:-1]
+    return xs, ys
+
+
+class MinMaxDecimator(object):
+    """Min/max envelopes of a signal, cached for the recently displayed
+    ranges (e.g. to go back and forth with the navigation toolbar).
+
+    :param x: 1D array of increasing abscissas
+    :param y: 1D array of values
+    :param int cacheSize: Number of envelopes kept
+    """
+    def __init__(self, x, y, cacheSize=16):
+        self.x = numpy.asarray(x)
+        self.y = numpy.asarray(y)
+        self._cacheSize = cacheSize
+        self._cache = collections.OrderedDict()
+
+    def envelope(self, xmin, xmax, npixels):
+        """Return the (x, y) envelope of a range, see
+        :func:`minmax_envelope`."""
+        key = float(xmin), float(xmax), int(npixels)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        result = minmax_envelope(self.x, self.y, xmin, xmax, int(npixels))
+        self._cache[key] = result
+        if len(self._cache) > self._cacheSize:
+            self._cache.popitem(last=False)
+        return result
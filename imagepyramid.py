@@ -0,0 +1,86 @@
+# coding: utf-8
+"""
+Multi-resolution (mipmap) pyramid of an image, used to display large
+images at the resolution of the screen.
+
+This module does not depend on Qt.
+"""
+
+import math
+
+import numpy
+
+from sessionio import downsample
+
+
+class ImagePyramid(object):
+    """Image and its successive 2x2 reductions.
+
+    Level 0 is the full resolution image, level *k* is reduced by a factor
+    ``2**k``. Levels are added until the largest side is at most
+    *minSize* pixels.
+
+    :param numpy.ndarray image: Image (nrows, ncols) or RGB(A) pixmap
+    :param str method: "mean" or "max" reduction of each 2x2 block
+    :param int minSize: Size of the largest side of the coarsest level
+    """
+    def __init__(self, image, method="mean", minSize=512):
+        self._levels = [image]
+        self._method = method
+        self._minSize = minSize
+
+    def compute(self):
+        """Compute all the levels (this can run in a worker thread)"""
+        while max(self._levels[-1].shape[:2]) > self._minSize:
+            self._levels.append(downsample(self._levels[-1], 2,
+                                           method=self._method))
+
+    def getLevelCount(self):
+        """Number of levels computed so far"""
+        return len(self._levels)
+
+    def getLevel(self, level):
+        """Return the image at *level* (no copy)"""
+        return self._levels[level]
+
+    def getShape(self):
+        """Shape of the full resolution image"""
+        return self._levels[0].shape
+
+    def levelForRatio(self, ratio):
+        """Coarsest level which still shows at least one image pixel per
+        screen pixel.
+
+        :param float ratio: Number of full resolution image pixels per
+            screen pixel
+        """
+        if ratio <= 1. or not numpy.isfinite(ratio):
+            return 0
+        level = int(math.floor(math.log(ratio, 2)))
+        return min(level, len(self._levels) - 1)
+
+    def getRegion(self, level, rows, cols, margin=0.25):
+        """Return the part of a level covering a region of the full
+        resolution image, extended by *margin* of its size on each side
+        so that small pans do not need a new region.
+
+        :param int level: Pyramid level
+        :param rows: (first, last) row range in full resolution pixels
+        :param cols: (first, last) column range in full resolution pixels
+        :return: (image region (a view), (first row, first column) of the
+            region in full resolution pixels, level step)
+        """
+        step = 2 ** level
+        data = self._levels[level]
+        nrows, ncols = data.shape[:2]
+
+        def bounds(first, last, size):
+            first, last = sorted((first / step, last / step))
+            extra = (last - first) * margin
+            first = int(min(max(math.floor(first - extra), 0), size))
+            last = int(min(max(math.ceil(last + extra), 0), size))
+            return first, last
+
+        row0, row1 = bounds(rows[0], rows[1], nrows)
+        col0, col1 = bounds(cols[0], cols[1], ncols)
+        return data[row0:row1, col0:col1], (row0 * step, col0 * step), step
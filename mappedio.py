@@ -0,0 +1,232 @@
+# coding: utf-8
+"""
+Memory-mapped access to raw ``.npy``, EDF and contiguous HDF5 data, and
+conversion of such arrays to a type the plot backends can display
+without loading them as a whole.
+
+This module does not depend on Qt.
+"""
+
+import mmap
+import os
+
+import numpy
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+from sessionio import map_dataset, row_blocks
+
+
+DISPLAY_DTYPES = tuple(numpy.dtype(t) for t in (
+    numpy.uint8, numpy.int8, numpy.uint16, numpy.int16,
+    numpy.uint32, numpy.int32, numpy.float32, numpy.float64))
+"""Types of data the plot items use as is (in native byte order)"""
+
+EDF_DTYPES = {
+    "SignedByte": "i1", "UnsignedByte": "u1",
+    "SignedShort": "i2", "UnsignedShort": "u2",
+    "SignedInteger": "i4", "UnsignedInteger": "u4",
+    "SignedLong": "i4", "UnsignedLong": "u4",
+    "Signed64": "i8", "Unsigned64": "u8",
+    "FloatValue": "f4", "FloatIEEE32": "f4", "Float": "f4",
+    "DoubleValue": "f8", "DoubleIEEE64": "f8", "Double": "f8",
+}
+"""Numpy type of the EDF DataType keywords"""
+
+
+def read_edf_header(fileobj):
+    """Read the ``{ ... }`` header of an EDF frame.
+
+    :param fileobj: Binary file positioned at the start of a frame
+    :return: dict of the header keywords, or None at the end of the file
+    """
+    line = fileobj.readline()
+    while line and not line.strip():
+        line = fileobj.readline()
+    if not line:
+        return None
+    if not line.strip().startswith(b"{"):
+        raise ValueError("Not an EDF header")
+    header = {}
+    for line in iter(fileobj.readline, b""):
+        if line.strip().startswith(b"}"):
+            return header
+        if b"=" in line:
+            key, value = line.split(b"=", 1)
+            header[key.strip().decode("ascii")] = \
+                value.strip().rstrip(b";").strip().decode("ascii")
+    raise ValueError("Truncated EDF header")
+
+
+def map_edf(path, frame=0):
+    """Memory-map a frame of an uncompressed EDF file.
+
+    :param str path: EDF file
+    :param int frame: Index of the frame in the file
+    :rtype: numpy.memmap
+    """
+    with open(path, "rb") as fileobj:
+        index = 0
+        while True:
+            header = read_edf_header(fileobj)
+            if header is None:
+                raise IndexError("No frame %d in %s" % (frame, path))
+            offset = fileobj.tell()
+            size = int(header["Size"])
+            if index == frame:
+                break
+            fileobj.seek(offset + size)
+            index += 1
+
+    if header.get("Compression", "None") not in ("None", "NoCompression"):
+        raise ValueError("Compressed EDF cannot be mapped: %s" % path)
+    dtype = numpy.dtype(EDF_DTYPES[header["DataType"]])
+    if header.get("ByteOrder", "LowByteFirst") == "HighByteFirst":
+        dtype = dtype.newbyteorder(">")
+    else:
+        dtype = dtype.newbyteorder("<")
+    shape = tuple(int(header[key]) for key in ("Dim_3", "Dim_2", "Dim_1")
+                  if key in header)
+    return numpy.memmap(path, mode="r", dtype=dtype, shape=shape,
+                        offset=offset)
+
+
+def open_mapped(source, frame=0):
+    """Memory-map an array stored raw in a file.
+
+    :param str source: path of a ``.npy`` or ``.edf`` file, or
+        ``"<file>::<dataset path>"`` for a contiguous, uncompressed HDF5
+        dataset
+    :param int frame: Index of the frame, for multi-frame EDF files
+    :return: Read-only memory-mapped array
+    :raise ValueError: If the data cannot be mapped
+    """
+    if "::" in source:
+        path, name = source.split("::", 1)
+        with h5py.File(path, "r") as h5file:
+            data = map_dataset(h5file[name])
+        if data is None:
+            raise ValueError("Dataset is chunked or compressed: %s" % source)
+        return data
+    if source.lower().endswith(".npy"):
+        return numpy.load(source, mmap_mode="r")
+    if source.lower().endswith(".edf"):
+        return map_edf(source, frame)
+    raise ValueError("Unsupported source: %s" % source)
+
+
+def is_mapped(array):
+    """True if *array* is (a view of) a memory-mapped file"""
+    while isinstance(array, numpy.ndarray):
+        if isinstance(array, numpy.memmap):
+            return True
+        array = array.base
+    return isinstance(array, mmap.mmap)
+
+
+def mapped_filename(array):
+    """Name of the file *array* is (a view of) a memory-map of, or None"""
+    while isinstance(array, numpy.ndarray):
+        if getattr(array, "filename", None) is not None:
+            return array.filename
+        array = array.base
+    return None
+
+
+def maps_file(arrays, path):
+    """True if one of *arrays* is memory-mapped from the file *path*.
+
+    Such a file must not be truncated nor rewritten in place while the
+    arrays are in use, see :func:`sessionio.session_writer`.
+    """
+    for array in arrays:
+        filename = mapped_filename(array)
+        if filename is None:
+            continue
+        try:
+            if os.path.samefile(filename, path):
+                return True
+        except OSError:   # either file does not exist (anymore)
+            continue
+    return False
+
+
+def display_dtype(dtype, dtypes=DISPLAY_DTYPES):
+    """Type to convert data of type *dtype* to, to display it.
+
+    64-bit integers are converted to float64, which is exact up to 2**53,
+    other types to float32.
+    """
+    native = numpy.dtype(dtype).newbyteorder("=")
+    if native in dtypes:
+        return native
+    if native.kind == "b":
+        return numpy.dtype(numpy.uint8)
+    if native.itemsize >= 8 and native.kind in "iuf":
+        return numpy.dtype(numpy.float64)
+    return numpy.dtype(numpy.float32)
+
+
+def as_display_array(data, dtypes=DISPLAY_DTYPES, nrows=None):
+    """Return *data* as is if the plot items can use it without copy, or
+    else a converted copy, filled block of rows by block of rows.
+
+    The copy is for display only: the widgets save their data in its
+    original type.
+
+    Converting by blocks never loads more than one block of a memory-mapped
+    source at once, and avoids full size temporaries.
+
+    :param numpy.ndarray data: Array, possibly memory-mapped
+    :param dtypes: Types used as is
+    :param int nrows: Number of rows converted at once (see
+        :func:`sessionio.row_blocks`)
+    :rtype: numpy.ndarray
+    """
+    data = numpy.asanyarray(data)
+    dtype = display_dtype(data.dtype, dtypes)
+    if data.dtype == dtype and data.flags.c_contiguous:
+        return data
+    converted = numpy.empty(data.shape, dtype=dtype)
+    if data.ndim == 0:
+        converted[()] = data[()]
+        return converted
+    for start, stop in row_blocks(data, nrows):
+        converted[start:stop] = data[start:stop]
+    return converted
+
+
+def memory_report(arrays):
+    """Memory used by the arrays displayed in a widget.
+
+    :param dict arrays: {name: array}
+    :return: dict with one entry per array ``{"nbytes", "mapped"}``, plus
+        ``"mapped"``, the total size of the memory-mapped arrays, that
+        is the resident memory saved by not copying them (their pages are
+        loaded on access and can be reclaimed), and ``"resident"``, the
+        total size of the other arrays
+    """
+    report = {"arrays": {}, "mapped": 0, "resident": 0}
+    for name, array in arrays.items():
+        if array is None:
+            continue
+        mapped = is_mapped(array)
+        report["arrays"][name] = {"nbytes": int(array.nbytes),
+                                  "mapped": mapped}
+        report["mapped" if mapped else "resident"] += int(array.nbytes)
+    return report
+
+
+def map_or_read(dataset):
+    """Memory-map an HDF5 dataset if possible, else read it.
+
+    :param h5py.Dataset dataset:
+    :rtype: numpy.ndarray
+    """
+    data = map_dataset(dataset)
+    if data is None:
+        data = dataset[()]
+    return data
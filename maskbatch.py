@@ -0,0 +1,187 @@
+# coding: utf-8
+"""
+Apply the mask of a saved session to new image or scatter scans, without
+display.
+
+The mask is read from a session file written by the ``saveSession`` method
+of :mod:`MaskImageWidget` or :mod:`MaskScatterWidget`. Each input is
+an image (or a 1D array of scatter values) of the shape of the mask, or a
+stack of them, read chunk by chunk. The sum, number of items and mean
+under each mask level are computed for every frame, with one process per
+input file, and written to an HDF5 file, one group per input.
+
+Usage::
+
+    python maskbatch.py session.h5 scan_*.h5 --dataset /entry/data \\
+        --output stats.h5 --workers 8
+
+Inputs can be ``.npy`` files, uncompressed ``.edf`` files, HDF5 files
+(with ``--dataset``, or another session file of the same kind), or
+``"<file>::<dataset path>"``. The scatter values of a session with scatter
+layers are the values of its selected layers, concatenated as its mask.
+
+This module does not depend on Qt.
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+from mappedio import open_mapped
+from maskstats import masked_statistics, write_statistics
+from sessionio import SCATTER_LAYERS, load_session_mask, row_blocks, \
+    scatter_layer_names, session_kind
+
+
+_mask = None
+"""Mask of the session, loaded once in each worker process"""
+
+
+def _init_worker(session):
+    global _mask
+    _mask = load_session_mask(session)[1]
+
+
+def open_input(source, dataset=None, kind="image"):
+    """Open the data of an input, without reading it.
+
+    :param str source: Input file, see the module documentation
+    :param str dataset: Path of the dataset in HDF5 inputs, default: the
+        session dataset of *kind*
+    :param str kind: "image" or "scatter", the kind of the session
+    :return: (data, h5file) with data a memory-mapped array or a h5py
+        Dataset, and h5file the HDF5 file to close (or None)
+    """
+    if "::" in source:
+        source, dataset = source.split("::", 1)
+    if source.lower().endswith((".npy", ".edf")):
+        return open_mapped(source), None
+
+    h5file = h5py.File(source, "r")
+    try:
+        if dataset is None:
+            if session_kind(h5file) != kind:
+                raise ValueError("%s is not a %s session" % (source, kind))
+            dataset = "image" if kind == "image" else "scatter values"
+            if dataset not in h5file and SCATTER_LAYERS in h5file:
+                selected = scatter_layer_names(h5file)[1]
+                layers = h5file[SCATTER_LAYERS]
+                data = numpy.concatenate(
+                    [layers[name]["values"][()] for name in selected] or
+                    [numpy.zeros((0,))])
+                h5file.close()
+                return data, None
+        return h5file[dataset], h5file
+    except Exception:
+        h5file.close()
+        raise
+
+
+def _add_statistics(total, stats):
+    for level, level_stats in stats.items():
+        if level not in total:
+            total[level] = {"sum": numpy.zeros((1,)),
+                            "count": numpy.zeros((1,), dtype=numpy.int64)}
+        total[level]["sum"] += level_stats["sum"]
+        total[level]["count"] += level_stats["count"]
+
+
+def frame_statistics(data, mask):
+    """Statistics of a single image (or scatter values) under each level
+    of a mask, read block of rows by block of rows.
+
+    :return: Same as :func:`maskstats.masked_statistics`, for one frame
+    """
+    total = {}
+    for start, stop in row_blocks(data):
+        block = numpy.asarray(data[start:stop])
+        _add_statistics(total, masked_statistics(block[numpy.newaxis],
+                                                 mask[start:stop]))
+    for level in numpy.unique(mask):
+        if level != 0 and int(level) not in total:   # not in any block
+            _add_statistics(total, {int(level): {"sum": 0., "count": 0}})
+    for level_stats in total.values():
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            level_stats["mean"] = level_stats["sum"] / level_stats["count"]
+    return total
+
+
+def apply_mask(data, mask, chunk=16):
+    """Statistics of every frame of *data* under each level of *mask*.
+
+    :param data: Array or h5py Dataset of the shape of the mask (one
+        frame), or a stack of frames of this shape
+    :param numpy.ndarray mask: uint8 mask
+    :param int chunk: Number of frames read at once
+    :return: See :func:`maskstats.masked_statistics`
+    """
+    if tuple(data.shape) == mask.shape:
+        return frame_statistics(data, mask)
+    return masked_statistics(data, mask, chunk=chunk)
+
+
+def process_file(source, dataset=None, kind="image", chunk=16):
+    """Worker process: apply the session mask to one input.
+
+    :return: (source, statistics, error message or None)
+    """
+    try:
+        data, h5file = open_input(source, dataset, kind)
+        try:
+            return source, apply_mask(data, _mask, chunk), None
+        finally:
+            if h5file is not None:
+                h5file.close()
+    except Exception as e:
+        return source, None, "%s: %s" % (type(e).__name__, e)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("session", help="Session file with the mask")
+    parser.add_argument("inputs", nargs="+", help="Scans to process")
+    parser.add_argument("--dataset", default=None,
+                        help="Dataset of the HDF5 inputs")
+    parser.add_argument("--output", default="maskbatch.h5",
+                        help="HDF5 file of the statistics")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk", type=int, default=16,
+                        help="Number of frames read at once")
+    args = parser.parse_args(argv)
+
+    with h5py.File(args.session, "r") as h5file:
+        kind = session_kind(h5file)
+
+    t0 = time.time()
+    failures = 0
+    with ProcessPoolExecutor(args.workers, initializer=_init_worker,
+                             initargs=(args.session,)) as executor:
+        results = executor.map(
+            process_file, args.inputs, [args.dataset] * len(args.inputs),
+            [kind] * len(args.inputs), [args.chunk] * len(args.inputs))
+        for index, (source, stats, error) in enumerate(results):
+            if error is not None:
+                failures += 1
+                print("%s: failed, %s" % (source, error))
+                continue
+            group = "%04d %s" % (index, os.path.basename(source))
+            write_statistics(args.output, stats, group=group)
+            print("%s: %s" % (source, ", ".join(
+                "level %d mean %g" % (level, numpy.nanmean(s["mean"]))
+                for level, s in sorted(stats.items()))))
+    print("%d files processed in %.2fs, %d failed" % (
+        len(args.inputs), time.time() - t0, failures))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
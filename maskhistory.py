@@ -0,0 +1,260 @@
+# coding: utf-8
+"""
+Undo/redo history of a selection mask storing the differences between
+successive states rather than full copies.
+
+Each step is the XOR of two states, split in bit planes (a binary mask
+only has one), bit-packed and compressed with zlib. A step touching a few
+thousand pixels of a 16 Mpixel mask takes a few kB.
+
+This module does not depend on Qt.
+"""
+
+import collections
+import hashlib
+import zlib
+
+import numpy
+
+
+class MaskDelta(object):
+    """Compressed XOR difference between two masks of the same shape.
+
+    :param numpy.ndarray delta: uint8 array, XOR of the two masks
+    :param int level: zlib compression level
+    """
+    def __init__(self, delta, level=1):
+        delta = numpy.ascontiguousarray(delta, dtype=numpy.uint8).reshape(-1)
+        self.size = delta.size
+        self.planes = []
+        """List of (bit, compressed packed bits) of the non-empty planes"""
+        used = numpy.bitwise_or.reduce(delta) if delta.size else 0
+        for bit in range(8):
+            if used & (1 << bit):
+                packed = numpy.packbits((delta >> bit) & 1)
+                self.planes.append((bit, zlib.compress(packed.tobytes(),
+                                                       level)))
+
+    @property
+    def nbytes(self):
+        """Size of the compressed planes"""
+        return sum(len(data) for _, data in self.planes)
+
+    def apply(self, mask):
+        """XOR the difference into *mask*, in place.
+
+        :param numpy.ndarray mask: C contiguous uint8 array
+        """
+        flat = mask.reshape(-1)
+        for bit, data in self.planes:
+            packed = numpy.frombuffer(zlib.decompress(data), dtype=numpy.uint8)
+            plane = numpy.unpackbits(packed)[:self.size]
+            if bit:
+                plane <<= bit
+            flat ^= plane
+
+    @classmethod
+    def fromPlanes(cls, planes, size):
+        """Create a difference from its (bit, compressed data) planes"""
+        delta = cls.__new__(cls)
+        delta.size = size
+        delta.planes = list(planes)
+        return delta
+
+
+class MaskHistory(object):
+    """Undo/redo history of a mask.
+
+    Call :meth:`record` with the mask after each change. Steps are dropped,
+    oldest first, to keep the compressed steps under *maxBytes*. The
+    current state itself is kept as an uncompressed copy.
+
+    :param int maxBytes: Memory budget of the stored steps
+    :param int level: zlib compression level (1: fastest)
+    """
+    def __init__(self, maxBytes=32 * 2**20, level=1):
+        self._maxBytes = maxBytes
+        self._level = level
+        self._current = None
+        self._undo = collections.deque()
+        self._redo = []
+        self._nbytes = 0
+
+    def reset(self, mask=None):
+        """Forget all steps, and start from *mask*"""
+        self._undo.clear()
+        del self._redo[:]
+        self._nbytes = 0
+        self._current = None
+        if mask is not None:
+            self._current = numpy.array(mask, dtype=numpy.uint8, order="C")
+
+    def record(self, mask):
+        """Add a step if *mask* differs from the current state.
+
+        Recording clears the redo steps. If the shape of the mask changes,
+        the history restarts from *mask*.
+
+        :param numpy.ndarray mask: New state of the mask
+        :return: True if a step was added
+        """
+        mask = numpy.asarray(mask, dtype=numpy.uint8)
+        if self._current is None or self._current.shape != mask.shape:
+            self.reset(mask)
+            return False
+        delta = numpy.bitwise_xor(self._current, mask)
+        if not delta.any():
+            return False
+        self._nbytes -= sum(step.nbytes for step in self._redo)
+        self._redo = []
+        self._push(self._undo, MaskDelta(delta, self._level))
+        self._current[...] = mask
+        self._evict()
+        return True
+
+    def _push(self, steps, step):
+        steps.append(step)
+        self._nbytes += step.nbytes
+
+    def _evict(self):
+        """Drop the oldest undo steps, then the farthest redo steps, until
+        the budget is met"""
+        while self._nbytes > self._maxBytes and self._undo:
+            self._nbytes -= self._undo.popleft().nbytes
+        while self._nbytes > self._maxBytes and self._redo:
+            self._nbytes -= self._redo.pop(0).nbytes
+
+    def undo(self):
+        """Go back one step.
+
+        :return: Copy of the new current mask, or None if there is nothing
+            to undo
+        """
+        if not self._undo:
+            return None
+        step = self._undo.pop()
+        step.apply(self._current)
+        self._redo.append(step)
+        return self.getCurrent()
+
+    def redo(self):
+        """Go forward one step.
+
+        :return: Copy of the new current mask, or None if there is nothing
+            to redo
+        """
+        if not self._redo:
+            return None
+        step = self._redo.pop()
+        step.apply(self._current)
+        self._undo.append(step)
+        return self.getCurrent()
+
+    def canUndo(self):
+        return len(self._undo) > 0
+
+    def canRedo(self):
+        return len(self._redo) > 0
+
+    def getUndoCount(self):
+        return len(self._undo)
+
+    def getRedoCount(self):
+        return len(self._redo)
+
+    def getCurrent(self):
+        """Return a copy of the current mask, or None"""
+        return None if self._current is None else self._current.copy()
+
+    def getMaxBytes(self):
+        return self._maxBytes
+
+    def setMaxBytes(self, maxBytes):
+        """Change the memory budget, dropping the oldest steps if needed"""
+        self._maxBytes = maxBytes
+        self._evict()
+
+    @property
+    def nbytes(self):
+        """Size of the compressed steps"""
+        return self._nbytes
+
+
+def _write_steps(group, steps):
+    for index, step in enumerate(steps):
+        data = b"".join(planeData for _, planeData in step.planes)
+        group["%d" % index] = numpy.frombuffer(data, dtype=numpy.uint8) \
+            if data else numpy.zeros((0,), dtype=numpy.uint8)
+        attrs = group["%d" % index].attrs
+        attrs["bits"] = [bit for bit, _ in step.planes]
+        attrs["sizes"] = [len(planeData) for _, planeData in step.planes]
+        attrs["size"] = step.size
+
+
+def _read_steps(group):
+    steps = []
+    for index in range(len(group)):
+        dataset = group["%d" % index]
+        data = dataset[()].tobytes()
+        offsets = numpy.cumsum([0] + list(dataset.attrs["sizes"]))
+        planes = [(int(bit), data[offsets[i]:offsets[i + 1]])
+                  for i, bit in enumerate(dataset.attrs["bits"])]
+        steps.append(MaskDelta.fromPlanes(planes, int(dataset.attrs["size"])))
+    return steps
+
+
+def history_digest(history):
+    """Return a SHA-1 hex digest of the steps of a :class:`MaskHistory`"""
+    sha1 = hashlib.sha1()
+    for kind, steps in ((b"undo", history._undo), (b"redo", history._redo)):
+        sha1.update(kind)
+        for step in steps:
+            sha1.update(b"%d:" % step.size)
+            for bit, data in step.planes:
+                sha1.update(b"%d,%d:" % (bit, len(data)))
+                sha1.update(data)
+    return sha1.hexdigest()
+
+
+def write_history(group, history, name="mask history"):
+    """Write the steps of a :class:`MaskHistory` to an HDF5 group.
+
+    Steps are stored as ``<name>/undo/<i>`` and ``<name>/redo/<i>`` uint8
+    datasets of compressed planes, oldest first. The current state is not
+    stored: it is the session mask. An existing group is replaced, unless
+    it holds the same steps (see the ``sha1`` attribute of the group).
+
+    :return: True if the history was written, False if it was up to date
+    :rtype: bool
+    """
+    digest = history_digest(history)
+    if name in group:
+        if group[name].attrs.get("sha1") == digest:
+            return False
+        del group[name]
+    root = group.create_group(name)
+    _write_steps(root.create_group("undo"), history._undo)
+    _write_steps(root.create_group("redo"), history._redo)
+    root.attrs["sha1"] = digest
+    return True
+
+
+def read_history(group, mask, name="mask history", maxBytes=32 * 2**20):
+    """Read a history written by :func:`write_history`.
+
+    :param mask: Current state of the mask (the session mask)
+    :param int maxBytes: Memory budget of the history, the oldest steps
+        read are dropped if needed
+    :return: MaskHistory, with no steps if the group does not exist
+    """
+    history = MaskHistory(maxBytes)
+    history.reset(mask)
+    if name not in group:
+        return history
+    root = group[name]
+    for step in _read_steps(root["undo"]):
+        history._push(history._undo, step)
+    for step in _read_steps(root["redo"]):
+        history._push(history._redo, step)
+    history._evict()
+    return history
@@ -0,0 +1,106 @@
+# coding: utf-8
+"""
+Statistics of a stack of frames (or of a stack of scatter value arrays)
+under a selection mask, computed in vectorized chunks of frames.
+
+This module does not depend on Qt.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+def frame_blocks(nframes, chunk):
+    """List of (first, last) frame ranges of at most *chunk* frames"""
+    return [(first, min(first + chunk, nframes))
+            for first in range(0, nframes, chunk)]
+
+
+def _chunk_statistics(frames, levels, masks):
+    """Statistics of a (nframes, ...) chunk for every mask level"""
+    frames = numpy.asarray(frames, dtype=numpy.float64)
+    flat = frames.reshape(len(frames), -1)
+    finite = numpy.isfinite(flat)
+    result = {}
+    for level, mask in zip(levels, masks):
+        selected = finite & mask
+        result[level] = (
+            numpy.sum(flat, axis=1, where=selected),
+            numpy.count_nonzero(selected, axis=1))
+    return result
+
+
+def masked_statistics(stack, mask, chunk=16, nworkers=1):
+    """Sum, number of pixels and mean of every frame under each level of a
+    mask.
+
+    Non-finite values are ignored. Level 0 (not masked) is not reported:
+    each non-zero level of the mask is a region of interest.
+
+    :param stack: 3D array (nframes, nrows, ncols), 2D array of scatter
+        values (nframes, npoints), or h5py Dataset, read *chunk* frames at
+        a time
+    :param numpy.ndarray mask: Mask of the shape of one frame (uint8)
+    :param int chunk: Number of frames processed at once
+    :param int nworkers: Number of threads processing chunks in parallel
+        (numpy releases the GIL in reductions)
+    :return: dict {level: {"sum": array, "count": array, "mean": array}}
+        with one value per frame
+    """
+    mask = numpy.asarray(mask)
+    if mask.shape != tuple(stack.shape[1:]):
+        raise ValueError("Mask shape %s does not match frame shape %s" % (
+            mask.shape, tuple(stack.shape[1:])))
+    flat_mask = mask.reshape(-1)
+    levels = [int(level) for level in numpy.unique(flat_mask) if level != 0]
+    masks = [flat_mask == level for level in levels]
+
+    nframes = stack.shape[0]
+    stats = dict((level, {"sum": numpy.zeros((nframes,)),
+                          "count": numpy.zeros((nframes,), dtype=numpy.int64)})
+                 for level in levels)
+
+    def process(bounds):
+        first, last = bounds
+        # h5py datasets are read here, chunk by chunk
+        return bounds, _chunk_statistics(stack[first:last], levels, masks)
+
+    blocks = frame_blocks(nframes, chunk)
+    if nworkers > 1:
+        with ThreadPoolExecutor(nworkers) as executor:
+            results = list(executor.map(process, blocks))
+    else:
+        results = map(process, blocks)
+
+    for (first, last), chunk_stats in results:
+        for level, (sums, counts) in chunk_stats.items():
+            stats[level]["sum"][first:last] = sums
+            stats[level]["count"][first:last] = counts
+
+    for level in levels:
+        counts = stats[level]["count"]
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            stats[level]["mean"] = stats[level]["sum"] / counts
+    return stats
+
+
+def write_statistics(path, stats, group="mask statistics"):
+    """Write the result of :func:`masked_statistics` to an HDF5 file.
+
+    Datasets are stored as ``<group>/level <level>/{sum,count,mean}``.
+    An existing group of the same name is replaced.
+    """
+    with h5py.File(path, "a") as h5file:
+        if group in h5file:
+            del h5file[group]
+        root = h5file.create_group(group)
+        for level, level_stats in stats.items():
+            level_group = root.create_group("level %d" % level)
+            for name, values in level_stats.items():
+                level_group[name] = values
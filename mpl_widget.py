@@ -1,12 +1,79 @@
 # https://stackoverflow.com/a/12465861/4494781
 
-from matplotlib.backends.backend_qt4agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.backends.backend_qt4agg import NavigationToolbar2QTAgg as NavigationToolbar
+import sys
+import threading
+import time
+
+from matplotlib.backends.qt_compat import QtCore, QtWidgets
+from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.backends.backend_qtagg import NavigationToolbar2QT as NavigationToolbar
 import matplotlib.pyplot as plt
 
+import numpy
 import random
 
-class Window(QtGui.QDialog):
+from decimate import MinMaxDecimator
+from ringbuffer import RingBuffer
+
+
+class BlitLine(object):
+    ''' A line redrawn alone over a cached image of the rest of the axes.
+
+    The cached background is taken after each full draw of the canvas
+    (first display, resize, zoom or pan, change of the axes limits).
+    Updating the data only restores the background, draws the line and
+    blits the axes area, instead of redrawing axes, ticks and labels.
+    '''
+    def __init__(self, canvas, ax, *args, **kwargs):
+        self.canvas = canvas
+        self.ax = ax
+        self.line, = ax.plot([], [], *args, animated=True, **kwargs)
+        self._background = None
+        self.canvas.mpl_connect('draw_event', self._onDraw)
+
+    def _onDraw(self, event):
+        self._background = self.canvas.copy_from_bbox(self.ax.bbox)
+        # animated artists are not drawn by a full draw
+        self.ax.draw_artist(self.line)
+
+    def setData(self, x, y):
+        ''' Update the data of the line and redraw it.
+
+        :return: True if only the line was redrawn, False if the limits
+            changed and the whole canvas was redrawn
+        '''
+        self.line.set_data(x, y)
+        limitsChanged = self._updateLimits(x, y)
+        if limitsChanged or self._background is None:
+            self.canvas.draw()
+            return False
+        self.canvas.restore_region(self._background)
+        self.ax.draw_artist(self.line)
+        self.canvas.blit(self.ax.bbox)
+        return True
+
+    def _updateLimits(self, x, y):
+        ''' Grow the axes limits to show all the data.
+
+        :return: True if the limits changed
+        '''
+        changed = False
+        for values, getLimits, setLimits in (
+                (x, self.ax.get_xlim, self.ax.set_xlim),
+                (y, self.ax.get_ylim, self.ax.set_ylim)):
+            values = numpy.asarray(values, dtype=numpy.float64)
+            if values.size == 0:
+                continue
+            vmin, vmax = numpy.nanmin(values), numpy.nanmax(values)
+            low, high = getLimits()
+            if vmin < low or vmax > high:
+                margin = 0.05 * (vmax - vmin) or 0.5
+                setLimits(vmin - margin, vmax + margin)
+                changed = True
+        return changed
+
+
+class Window(QtWidgets.QDialog):
     def __init__(self, parent=None):
         super(Window, self).__init__(parent)
 
@@ -21,15 +88,39 @@ class Window(QtGui.QDialog):
         # it takes the Canvas widget and a parent
         self.toolbar = NavigationToolbar(self.canvas, self)
 
+        # the axes and the line are created once, only the data changes
+        self.ax = self.figure.add_subplot(111)
+        self.blitLine = BlitLine(self.canvas, self.ax, '*-')
+
+        # long signals are drawn as min/max envelopes of the visible range
+        self.decimationThreshold = 100000
+        self._decimator = None
+        self.ax.callbacks.connect('xlim_changed', self._xlimChanged)
+
         # Just some button connected to `plot` method
-        self.button = QtGui.QPushButton('Plot')
+        self.button = QtWidgets.QPushButton('Plot')
         self.button.clicked.connect(self.plot)
 
+        self.streamButton = QtWidgets.QPushButton('Stream')
+        self.streamButton.setCheckable(True)
+        self.streamButton.toggled.connect(self._streamToggled)
+        self.status = QtWidgets.QLabel()
+
+        # streaming mode: producer thread -> ring buffer -> timer redraw
+        self.ring = None
+        self._producer = None
+        self._stopProducer = threading.Event()
+        self._streamTimer = QtCore.QTimer(self)
+        self._streamTimer.timeout.connect(self._refreshStream)
+        self._lastReport = (0, 0)
+
         # set the layout
-        layout = QtGui.QVBoxLayout()
+        layout = QtWidgets.QVBoxLayout()
         layout.addWidget(self.toolbar)
         layout.addWidget(self.canvas)
         layout.addWidget(self.button)
+        layout.addWidget(self.streamButton)
+        layout.addWidget(self.status)
         self.setLayout(layout)
 
     def plot(self):
@@ -37,20 +128,115 @@ class Window(QtGui.QDialog):
         # random data
         data = [random.random() for i in range(10)]
 
-        # create an axis
-        ax = self.figure.add_subplot(111)
-
-        # discards the old graph
-        ax.hold(False)
-
-        # plot data
-        ax.plot(data, '*-')
+        self.setData(numpy.arange(len(data)), data)
+
+    def setData(self, x, y):
+        ''' Replace the plotted data, redrawing only the line when the axes
+        limits do not change.
+
+        Signals longer than :attr:`decimationThreshold` are drawn as the
+        min/max envelope of the visible range with one bin per pixel (see
+        :mod:`decimate`), recomputed on zoom and pan. *x* must then be
+        increasing.
+        '''
+        if len(x) <= self.decimationThreshold:
+            self._decimator = None
+            self.blitLine.setData(x, y)
+            return
+        self._decimator = MinMaxDecimator(x, y)
+        self.blitLine.setData(*self._envelope(x[0], x[-1]))
+
+    def _envelope(self, xmin, xmax):
+        xmin, xmax = sorted((xmin, xmax))
+        npixels = max(1, int(round(self.ax.bbox.width)))
+        return self._decimator.envelope(xmin, xmax, npixels)
+
+    def _xlimChanged(self, ax):
+        ''' Recompute the envelope of the new range (toolbar zoom, pan,
+        home, back, forward); the canvas draw follows '''
+        if self._decimator is not None:
+            self.blitLine.line.set_data(*self._envelope(*ax.get_xlim()))
+
+    def startStreaming(self, capacity=10000, maxFps=30, source=None):
+        ''' Display the last *capacity* samples of a stream, redrawn at
+        most *maxFps* times per second.
+
+        :param source: Function called in a background thread with the
+            ring buffer and a threading.Event, pushing batches of samples
+            until the event is set. Default: :func:`simulatedSource`.
+        '''
+        self.stopStreaming()
+        self.ring = RingBuffer(capacity)
+        self._lastReport = (0, 0)
+        self._stopProducer = threading.Event()
+        self._producer = threading.Thread(
+            target=source or simulatedSource,
+            args=(self.ring, self._stopProducer))
+        self._producer.daemon = True
+        self._producer.start()
+        self._streamTimer.start(max(1, int(1000 / maxFps)))
+
+    def stopStreaming(self):
+        ''' Stop the producer thread and the periodic redraw '''
+        self._streamTimer.stop()
+        if self._producer is not None:
+            self._stopProducer.set()
+            self._producer.join()
+            self._producer = None
+
+    def _streamToggled(self, checked):
+        if checked:
+            self.startStreaming()
+        else:
+            self.stopStreaming()
+
+    def _refreshStream(self):
+        ''' Timer: draw the buffered samples if new ones arrived '''
+        samples, new = self.ring.read()
+        if new == 0:
+            return
+        # x is the age of the samples, so that the limits stay fixed
+        self.setData(numpy.arange(1 - len(samples), 1), samples)
+
+        report = (self.ring.dropped, self.ring.coalesced)
+        if report != self._lastReport:
+            self._lastReport = report
+            self.status.setText(
+                '%d samples dropped, %d batches coalesced' % report)
+
+    def getStreamingReport(self):
+        ''' Return the counters of the streaming mode: samples received,
+        dropped (overwritten before being displayed) and batches coalesced
+        (displayed together in one redraw) '''
+        if self.ring is None:
+            return {'total': 0, 'dropped': 0, 'coalesced': 0}
+        return {'total': self.ring.getTotal(),
+                'dropped': self.ring.dropped,
+                'coalesced': self.ring.coalesced}
+
+    def closeEvent(self, event):
+        self.stopStreaming()
+        super(Window, self).closeEvent(event)
+
+
+def simulatedSource(ring, stop, rate=5000., batch=50):
+    ''' Push a noisy sine sampled at *rate* Hz, by batches, until *stop*
+    is set '''
+    start = time.time()
+    count = 0
+    while not stop.is_set():
+        t = (count + numpy.arange(batch)) / rate
+        ring.push(numpy.sin(2 * numpy.pi * t) +
+                  0.1 * numpy.random.standard_normal(batch))
+        count += batch
+        # sleep until the next batch is due, without drifting
+        delay = start + count / rate - time.time()
+        if delay > 0:
+            stop.wait(delay)
 
-        # refresh canvas
-        self.canvas.draw()
 
 if __name__ == '__main__':
-    app = QtGui.QApplication(sys.argv)
+    app = QtWidgets.QApplication(sys.argv)
 
     main = Window()
     main.show()
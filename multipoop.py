@@ -1,40 +1,50 @@
 import numpy
 import time
-import multiprocessing
 
-x0 = numpy.linspace(0, 120245, 1000000)
-t0 = time.time()
+from parallel_array import ArrayPool, parallel_map_array
+
 
 def f0(x):
     return x**2 + numpy.cos(x)
 
-y0 = f0(x0)
 
-t1 = time.time()
+if __name__ == "__main__":
+    from fused_f0 import f0_tiled
+
+    x0 = numpy.linspace(0, 120245, 1000000)
+    t0 = time.time()
 
-nprocess = 12
+    y0 = f0(x0)
 
-first_idx = lambda i: i * len(x0) // nprocess
-last_idx = lambda i: (i + 1) * len(x0) // nprocess
+    t1 = time.time()
 
-def f(x, i, queue):
-    ret = numpy.empty((last_idx(i) - first_idx(i),))
-    ret = x[first_idx(i):last_idx(i)]**2 + numpy.cos(x[first_idx(i):last_idx(i)])
-    queue.put(ret)
+    nprocess = 12
+    chunk = len(x0) // (4 * nprocess)
 
-queues = [multiprocessing.Queue() for _ in range(nprocess)]
-processes = [multiprocessing.Process(target=f, args=(x0, i, queues[i])) for i in range(nprocess)]
+    y1 = parallel_map_array(f0, x0, nworkers=nprocess, chunk=chunk)
 
-for i in range(nprocess):
-    processes[i].start()
+    t2 = time.time()
 
-y1 = numpy.empty_like(x0)
-for i, q in enumerate(queues):
-    y1[first_idx(i):last_idx(i)] =  q.get()
+    with ArrayPool(nprocess) as pool:
+        key = pool.share(x0)
+        pool.map(f0, key, chunk=chunk)    # warm up the workers
 
-t2 = time.time()
+        t3 = time.time()
+        y2 = pool.map(f0, key, chunk=chunk)
+        t4 = time.time()
 
-print("Numpy time", (t1 - t0))
-print("multiprocessing time", (t2 - t1))
-assert numpy.allclose(y0, y1)
+        pool.map(f0_tiled, key, chunk=chunk, inplace=True)
+        t5 = time.time()
+        y3 = pool.map(f0_tiled, key, chunk=chunk, inplace=True)
+        t6 = time.time()
 
+    print("Numpy time", (t1 - t0))
+    print("multiprocessing time", (t2 - t1))
+    print("speedup", (t1 - t0) / (t2 - t1))
+    print("persistent pool time", (t4 - t3))
+    print("speedup", (t1 - t0) / (t4 - t3))
+    print("persistent pool, fused kernel time", (t6 - t5))
+    print("speedup", (t1 - t0) / (t6 - t5))
+    assert numpy.allclose(y0, y1)
+    assert numpy.allclose(y0, y2)
+    assert numpy.allclose(y0, y3)
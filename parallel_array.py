@@ -0,0 +1,389 @@
+"""
+Chunked parallel evaluation of element-wise array kernels.
+
+Input and output arrays live in memory-mapped scratch files, on the
+``/dev/shm`` tmpfs when available, so that workers read their input slices
+and write their output slices in place. Only the file names and the chunk
+boundaries go through pickling.
+"""
+
+import os
+import queue
+import tempfile
+import multiprocessing
+
+import numpy
+
+
+SCRATCH_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+"""Directory of the scratch files (None for the default temp directory)"""
+
+
+class SharedArray(object):
+    """Numpy array backed by a memory-mapped scratch file.
+
+    Instances created with :meth:`create` own the file and must be
+    :meth:`unlink` ed. Workers re-open the file with :meth:`attach`,
+    using the picklable :attr:`descriptor`.
+    """
+    def __init__(self, descriptor, array, owner):
+        self.descriptor = descriptor
+        self.array = array
+        self._owner = owner
+
+    @classmethod
+    def create(cls, shape, dtype):
+        """Allocate a new shared array.
+
+        :param shape: Shape of the array
+        :param dtype: Data type of the array
+        """
+        dtype = numpy.dtype(dtype)
+        fd, path = tempfile.mkstemp(suffix=".scratch", dir=SCRATCH_DIR)
+        os.close(fd)
+        shape = tuple(shape)
+        if int(numpy.prod(shape)) == 0:
+            # numpy cannot map an empty file
+            array = numpy.empty(shape, dtype=dtype)
+        else:
+            array = numpy.memmap(path, dtype=dtype, mode="w+", shape=shape)
+        return cls((path, shape, dtype.str), array, owner=True)
+
+    @classmethod
+    def attach(cls, descriptor):
+        """Open a shared array created in another process.
+
+        :param descriptor: :attr:`descriptor` of the original array
+        """
+        path, shape, dtype = descriptor
+        if int(numpy.prod(shape)) == 0:
+            array = numpy.empty(shape, dtype=dtype)
+        else:
+            array = numpy.memmap(path, dtype=dtype, mode="r+", shape=shape)
+        return cls(descriptor, array, owner=False)
+
+    @classmethod
+    def wrap(cls, x):
+        """Return a shared array (not owning its file) if *x* is the
+        :attr:`array` of a :class:`SharedArray`, else None."""
+        if (not isinstance(x, numpy.memmap) or x.filename is None or
+                not x.filename.endswith(".scratch") or x.offset != 0 or
+                not x.flags.c_contiguous or
+                x.nbytes != os.path.getsize(x.filename)):
+            return None
+        return cls((x.filename, x.shape, x.dtype.str), x, owner=False)
+
+    @classmethod
+    def from_array(cls, x):
+        """Allocate a shared array and copy *x* into it."""
+        shared = cls.create(x.shape, x.dtype)
+        shared.array[...] = x
+        return shared
+
+    def close(self):
+        """Release this process' view of the file. The mapping itself is
+        released once no view on :attr:`array` is alive."""
+        self.array = None
+
+    def unlink(self):
+        """Close and remove the scratch file (owner only)."""
+        self.close()
+        path = self.descriptor[0]
+        if self._owner and os.path.exists(path):
+            os.remove(path)
+
+
+def chunk_bounds(n, chunk):
+    """List of *(start, stop)* slices of at most *chunk* items covering
+    *range(n)*."""
+    chunk = max(int(chunk), 1)
+    return [(start, min(start + chunk, n)) for start in range(0, n, chunk)]
+
+
+def _evaluate(func, x, y, bounds, inplace):
+    """Evaluate *func* on every chunk of *bounds* of *x* into *y*."""
+    for start, stop in bounds:
+        if inplace:
+            func(x[start:stop], y[start:stop])
+        else:
+            y[start:stop] = func(x[start:stop])
+
+
+def _output_dtype(func, x, inplace):
+    if inplace:
+        return numpy.result_type(x.dtype, numpy.float16)
+    return numpy.asarray(func(x[:1])).dtype
+
+
+def _evaluate_chunks(func, in_descriptor, out_descriptor, bounds, inplace):
+    """Worker body: evaluate *func* on every chunk of *bounds*, reading from
+    and writing to the shared buffers."""
+    x = SharedArray.attach(in_descriptor)
+    y = SharedArray.attach(out_descriptor)
+    try:
+        _evaluate(func, x.array, y.array, bounds, inplace)
+    finally:
+        # drop the numpy views before closing the underlying buffers
+        x.close()
+        y.close()
+
+
+def parallel_map_array(func, x, nworkers=None, chunk=None, inplace=False):
+    """Evaluate the element-wise kernel *func* on the 1D array *x* using
+    *nworkers* processes.
+
+    Chunks are dealt round-robin to the workers, which write their results
+    directly into a shared output buffer.
+
+    :param func: Picklable function mapping an array slice to an array
+        slice of the same length
+    :param x: Input array. A :class:`SharedArray`, or its :attr:`array`,
+        is used as is, without the initial copy to shared memory.
+    :param int nworkers: Number of processes (default: number of CPUs)
+    :param int chunk: Number of items per chunk (default: one chunk
+        per worker)
+    :param bool inplace: True if *func* has the signature
+        ``func(x, out)`` and writes its result into *out* (e.g.
+        :func:`fused_f0.f0_tiled`), False if it returns its result.
+    :return: Output array
+    :rtype: numpy.ndarray
+    """
+    if isinstance(x, SharedArray):
+        shared_x = SharedArray(x.descriptor, x.array, owner=False)
+    else:
+        shared_x = SharedArray.wrap(x)
+    x = numpy.asarray(x.array if isinstance(x, SharedArray) else x)
+    n = len(x)
+    if nworkers is None:
+        nworkers = multiprocessing.cpu_count()
+    nworkers = max(min(nworkers, n), 1)
+    if chunk is None:
+        chunk = -(-n // nworkers)
+
+    out_dtype = _output_dtype(func, x, inplace)
+    if n == 0:
+        return numpy.empty((0,), dtype=out_dtype)
+
+    bounds = chunk_bounds(n, chunk)
+    if shared_x is None:
+        shared_x = SharedArray.from_array(x)
+    shared_y = SharedArray.create((n,), out_dtype)
+    try:
+        processes = [
+            multiprocessing.Process(
+                target=_evaluate_chunks,
+                args=(func, shared_x.descriptor, shared_y.descriptor,
+                      bounds[i::nworkers], inplace))
+            for i in range(nworkers)]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+        failed = [p.exitcode for p in processes if p.exitcode != 0]
+        if failed:
+            raise RuntimeError("%d worker(s) failed" % len(failed))
+        return numpy.array(shared_y.array)
+    finally:
+        shared_x.unlink()
+        shared_y.unlink()
+
+
+def _pool_worker(cpu, tasks, results):
+    """Main loop of an :class:`ArrayPool` worker.
+
+    Messages are tuples whose first item is the command:
+
+    - ``("attach", key, descriptor)``: open a shared array
+    - ``("detach", key)``: close a shared array
+    - ``("map", func, in_key, out_key, bounds, inplace)``: evaluate
+      chunks
+    - ``None``: exit
+    """
+    if cpu is not None and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, {cpu})
+        except OSError:
+            pass
+
+    arrays = {}
+    while True:
+        message = tasks.get()
+        if message is None:
+            break
+        command = message[0]
+        if command == "attach":
+            arrays[message[1]] = SharedArray.attach(message[2])
+        elif command == "detach":
+            shared = arrays.pop(message[1], None)
+            if shared is not None:
+                shared.close()
+        elif command == "map":
+            func, in_key, out_key, bounds, inplace = message[1:]
+            try:
+                if bounds:
+                    _evaluate(func, arrays[in_key].array,
+                              arrays[out_key].array, bounds, inplace)
+            except Exception as e:
+                results.put(("error", repr(e)))
+            else:
+                results.put(("done", None))
+
+    for shared in arrays.values():
+        shared.close()
+
+
+class ArrayPool(object):
+    """Pool of long-lived worker processes evaluating element-wise kernels
+    on shared arrays.
+
+    Workers are started once, optionally pinned to one core each, and keep
+    the shared arrays they were sent attached until :meth:`unshare` or
+    :meth:`close`. Read-only inputs evaluated many times should be
+    registered once with :meth:`share`::
+
+        if __name__ == "__main__":
+            with ArrayPool(8) as pool:
+                key = pool.share(x)
+                for kernel in kernels:
+                    y = pool.map(kernel, key)
+
+    :param int nworkers: Number of processes (default: number of CPUs)
+    :param bool pin: Pin each worker to a distinct core when supported
+    """
+    def __init__(self, nworkers=None, pin=True):
+        if nworkers is None:
+            nworkers = multiprocessing.cpu_count()
+        self.nworkers = max(int(nworkers), 1)
+
+        cpus = [None]
+        if pin and hasattr(os, "sched_getaffinity"):
+            cpus = sorted(os.sched_getaffinity(0))
+
+        self._shared = {}
+        """Shared arrays owned by the pool, by key"""
+        self._outputs = {}
+        """Reusable output keys, by (length, dtype)"""
+        self._counter = 0
+
+        self._results = multiprocessing.Queue()
+        self._tasks = [multiprocessing.Queue() for _ in range(self.nworkers)]
+        self._processes = [
+            multiprocessing.Process(
+                target=_pool_worker,
+                args=(cpus[i % len(cpus)], self._tasks[i], self._results))
+            for i in range(self.nworkers)]
+        for p in self._processes:
+            p.daemon = True
+            p.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _broadcast(self, message):
+        for tasks in self._tasks:
+            tasks.put(message)
+
+    def _register(self, shared):
+        key = "array%d" % self._counter
+        self._counter += 1
+        self._shared[key] = shared
+        self._broadcast(("attach", key, shared.descriptor))
+        return key
+
+    def share(self, x):
+        """Copy *x* to shared memory once and attach it in every worker.
+
+        :param numpy.ndarray x: 1D input array
+        :return: Key to pass to :meth:`map` instead of the array
+        """
+        return self._register(SharedArray.from_array(numpy.asarray(x)))
+
+    def unshare(self, key):
+        """Release an array registered with :meth:`share`."""
+        self._broadcast(("detach", key))
+        # wait for the workers to drop their views before unlinking
+        self._barrier()
+        self._shared.pop(key).unlink()
+
+    def _barrier(self):
+        self._broadcast(("map", None, None, None, [], False))
+        self._collect()
+
+    def _collect(self):
+        errors = []
+        pending = self.nworkers
+        while pending:
+            try:
+                status, error = self._results.get(timeout=1.)
+            except queue.Empty:
+                if not all(p.is_alive() for p in self._processes):
+                    raise RuntimeError("A pool worker died")
+                continue
+            pending -= 1
+            if status == "error":
+                errors.append(error)
+        if errors:
+            raise RuntimeError("Worker error: %s" % errors[0])
+
+    def _output_key(self, n, dtype):
+        key = self._outputs.get((n, dtype.str))
+        if key is None:
+            key = self._register(SharedArray.create((n,), dtype))
+            self._outputs[(n, dtype.str)] = key
+        return key
+
+    def map(self, func, x, chunk=None, copy=True, inplace=False):
+        """Evaluate *func* on a shared array key or on an array.
+
+        Passing an array instead of a key shares it for the duration of the
+        call only.
+
+        :param func: Picklable element-wise kernel
+        :param x: Key returned by :meth:`share`, or 1D array
+        :param int chunk: Number of items per chunk (default: one chunk
+            per worker)
+        :param bool copy: True (default) to return a copy of the result.
+            If False, the returned array is a view on a shared buffer which
+            is overwritten by the next call with the same output length and
+            type.
+        :param bool inplace: See :func:`parallel_map_array`
+        :rtype: numpy.ndarray
+        """
+        temporary = not isinstance(x, str)
+        key = self.share(x) if temporary else x
+        try:
+            n = len(self._shared[key].array)
+            out_dtype = _output_dtype(func, self._shared[key].array, inplace)
+            if n == 0:
+                return numpy.empty((0,), dtype=out_dtype)
+            if chunk is None:
+                chunk = -(-n // self.nworkers)
+            out_key = self._output_key(n, out_dtype)
+
+            bounds = chunk_bounds(n, chunk)
+            for i, tasks in enumerate(self._tasks):
+                tasks.put(("map", func, key, out_key,
+                           bounds[i::self.nworkers], inplace))
+            self._collect()
+
+            result = self._shared[out_key].array
+            return numpy.array(result) if copy else result
+        finally:
+            if temporary:
+                self.unshare(key)
+
+    def close(self):
+        """Stop the workers and release all shared arrays."""
+        if not self._processes:
+            return
+        self._broadcast(None)
+        for p in self._processes:
+            p.join()
+        self._processes = []
+        for shared in self._shared.values():
+            shared.unlink()
+        self._shared.clear()
+        self._outputs.clear()
@@ -0,0 +1,163 @@
+# coding: utf-8
+"""
+Opt-in timing of the methods of a widget (or of any object), recorded in a
+fixed-size in-memory ring of events.
+
+Methods are timed by wrappers installed as instance attributes by
+:func:`instrument` and removed by :func:`restore`: an object which is not
+instrumented runs its methods unchanged, at no cost.
+
+Events can be summarized per name, and dumped to JSON or to the Chrome
+trace event format (to open in chrome://tracing or https://ui.perfetto.dev).
+
+This module does not depend on Qt.
+"""
+
+import collections
+import functools
+import json
+import os
+import threading
+import time
+
+import numpy
+
+
+class Profiler(object):
+    """Ring of the last *capacity* timed events.
+
+    Each event is a (name, category, start, duration, thread id) tuple,
+    start and duration in seconds, start relative to the creation of the
+    profiler.
+
+    :param int capacity: Number of events kept, oldest dropped first
+    """
+    def __init__(self, capacity=65536):
+        self._events = collections.deque(maxlen=capacity)
+        self._origin = time.perf_counter()
+
+    def record(self, name, category, start, duration):
+        """Add an event (thread-safe).
+
+        :param float start: :func:`time.perf_counter` value at the start
+        :param float duration: Duration in seconds (0 for an instant)
+        """
+        self._events.append((name, category, start - self._origin, duration,
+                             threading.get_ident()))
+
+    def mark(self, name, category="event"):
+        """Add an instant event, e.g. a user interaction"""
+        self.record(name, category, time.perf_counter(), 0.)
+
+    def timed(self, func, name, category):
+        """Return a wrapper of *func* recording each call as an event"""
+        record = self.record
+        perf_counter = time.perf_counter
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, category, start, perf_counter() - start)
+        return wrapper
+
+    def getEvents(self):
+        """Return the list of the recorded events, oldest first"""
+        return list(self._events)
+
+    def clear(self):
+        self._events.clear()
+
+    def summary(self):
+        """Statistics of the durations of the events, by name.
+
+        :return: dict {name: {"category", "count", "total", "mean", "min",
+            "max", "p50", "p95"}}, durations in seconds
+        """
+        durations = collections.defaultdict(list)
+        categories = {}
+        for name, category, _, duration, _ in self.getEvents():
+            durations[name].append(duration)
+            categories[name] = category
+        result = {}
+        for name, values in durations.items():
+            values = numpy.array(values)
+            result[name] = {"category": categories[name],
+                            "count": len(values),
+                            "total": float(values.sum()),
+                            "mean": float(values.mean()),
+                            "min": float(values.min()),
+                            "max": float(values.max()),
+                            "p50": float(numpy.percentile(values, 50)),
+                            "p95": float(numpy.percentile(values, 95))}
+        return result
+
+    def formatSummary(self):
+        """Return the summary as a text table, by decreasing total time"""
+        lines = ["%-32s %-10s %7s %10s %10s %10s" % (
+            "name", "category", "count", "total ms", "mean ms", "max ms")]
+        items = sorted(self.summary().items(),
+                       key=lambda item: item[1]["total"], reverse=True)
+        for name, stats in items:
+            lines.append("%-32s %-10s %7d %10.2f %10.3f %10.3f" % (
+                name, stats["category"], stats["count"],
+                1e3 * stats["total"], 1e3 * stats["mean"],
+                1e3 * stats["max"]))
+        return "\n".join(lines)
+
+    def dumpJson(self, path):
+        """Write the events and their summary to a JSON file"""
+        events = [{"name": name, "category": category, "start": start,
+                   "duration": duration, "thread": thread}
+                  for name, category, start, duration, thread
+                  in self.getEvents()]
+        with open(path, "w") as f:
+            json.dump({"events": events, "summary": self.summary()}, f,
+                      indent=1)
+
+    def dumpChromeTrace(self, path):
+        """Write the events in the Chrome trace event format"""
+        pid = os.getpid()
+        trace = []
+        for name, category, start, duration, thread in self.getEvents():
+            event = {"name": name, "cat": category, "pid": pid,
+                     "tid": thread, "ts": 1e6 * start}
+            if duration > 0:
+                event.update(ph="X", dur=1e6 * duration)
+            else:
+                event.update(ph="i", s="t")
+            trace.append(event)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+
+def instrument(obj, methods, profiler, prefix=""):
+    """Time methods of *obj* by setting wrappers as instance attributes.
+
+    :param obj: Object to instrument
+    :param methods: List of (method name, category)
+    :param Profiler profiler:
+    :param str prefix: Prefix of the event names
+    :return: What :func:`restore` needs to remove the wrappers
+    """
+    saved = []
+    for name, category in methods:
+        method = getattr(obj, name, None)
+        if method is None:
+            continue
+        # attributes set on the instance (e.g. patched methods) are put back
+        saved.append((name, obj.__dict__.get(name)))
+        setattr(obj, name, profiler.timed(method, prefix + name, category))
+    return obj, saved
+
+
+def restore(instrumented):
+    """Remove the wrappers installed by :func:`instrument`"""
+    obj, saved = instrumented
+    for name, previous in saved:
+        if previous is None:
+            delattr(obj, name)
+        else:
+            setattr(obj, name, previous)
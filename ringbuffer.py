@@ -0,0 +1,84 @@
+# coding: utf-8
+"""
+Fixed-size buffer of the last samples of a stream, written in batches by
+producer threads and read by a display.
+
+This module does not depend on Qt.
+"""
+
+import threading
+
+import numpy
+
+
+class RingBuffer(object):
+    """Preallocated circular buffer of the last *capacity* samples.
+
+    Memory does not grow with the stream: older samples are overwritten.
+    The buffer counts the samples overwritten before being read
+    (*dropped*), and the batches read together by one :meth:`read`
+    (*coalesced*).
+
+    :param int capacity: Number of samples kept
+    :param dtype: Type of the samples
+    """
+    def __init__(self, capacity, dtype=numpy.float64):
+        self._data = numpy.zeros((capacity,), dtype=dtype)
+        self._ordered = numpy.zeros((capacity,), dtype=dtype)
+        self._lock = threading.Lock()
+        self._total = 0
+        """Number of samples pushed since the creation"""
+        self._read = 0
+        """Value of _total at the last read"""
+        self._batches = 0
+        """Number of batches pushed since the last read"""
+        self.dropped = 0
+        self.coalesced = 0
+
+    @property
+    def capacity(self):
+        return len(self._data)
+
+    def push(self, samples):
+        """Append a batch of samples (thread-safe).
+
+        :param samples: 1D array
+        """
+        samples = numpy.asarray(samples, dtype=self._data.dtype).reshape(-1)
+        capacity = len(self._data)
+        with self._lock:
+            count = len(samples)
+            if count > capacity:
+                samples = samples[-capacity:]
+            start = (self._total + count - len(samples)) % capacity
+            first = min(len(samples), capacity - start)
+            self._data[start:start + first] = samples[:first]
+            self._data[:len(samples) - first] = samples[first:]
+            self._total += count
+            self._batches += 1
+
+    def read(self):
+        """Return the buffered samples, oldest first, and update the
+        dropped and coalesced counters.
+
+        :return: (samples, new) with samples a view of an internal array
+            valid until the next read, and new the number of samples pushed
+            since the previous read
+        """
+        capacity = len(self._data)
+        with self._lock:
+            new = self._total - self._read
+            self.dropped += max(0, new - capacity)
+            self.coalesced += max(0, self._batches - 1)
+            self._read = self._total
+            self._batches = 0
+            count = min(self._total, capacity)
+            start = (self._total - count) % capacity
+            first = min(count, capacity - start)
+            self._ordered[:first] = self._data[start:start + first]
+            self._ordered[first:count] = self._data[:count - first]
+        return self._ordered[:count], new
+
+    def getTotal(self):
+        """Number of samples pushed since the creation"""
+        return self._total
@@ -0,0 +1,69 @@
+# coding: utf-8
+"""
+Level-of-detail reduction of scatter plots: points are binned on a regular
+grid (typically one bin per screen pixel) and each non-empty bin is
+displayed as a single point.
+
+This module does not depend on Qt.
+"""
+
+import numpy
+
+
+STATISTICS = ("min", "max", "mean")
+
+
+def visible_points(x, y, xrange_, yrange):
+    """Boolean array of the points inside the given ranges."""
+    xmin, xmax = sorted(xrange_)
+    ymin, ymax = sorted(yrange)
+    return (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+
+
+def bin_scatter(x, y, v, xrange_, yrange, nx, ny, inside=None):
+    """Bin scatter points inside the given ranges on a *nx* x *ny* grid.
+
+    :param x: 1D array of x coordinates
+    :param y: 1D array of y coordinates
+    :param v: 1D array of values
+    :param xrange_: (min, max) range of x
+    :param yrange: (min, max) range of y
+    :param int nx: Number of bins along x
+    :param int ny: Number of bins along y
+    :param inside: Result of :func:`visible_points` if already computed
+    :return: dict with the bin centers ``"x"`` and ``"y"``, the number of
+        points ``"count"`` and the ``"min"``, ``"max"`` and ``"mean"``
+        values of each non-empty bin
+    """
+    xmin, xmax = sorted(xrange_)
+    ymin, ymax = sorted(yrange)
+    if inside is None:
+        inside = visible_points(x, y, (xmin, xmax), (ymin, ymax))
+    x, y, v = x[inside], y[inside], numpy.asarray(v)[inside]
+
+    xbin = (xmax - xmin) / nx or 1.
+    ybin = (ymax - ymin) / ny or 1.
+    ix = numpy.clip(((x - xmin) / xbin).astype(numpy.intp), 0, nx - 1)
+    iy = numpy.clip(((y - ymin) / ybin).astype(numpy.intp), 0, ny - 1)
+    index = iy * nx + ix
+
+    counts = numpy.bincount(index, minlength=nx * ny)
+    sums = numpy.bincount(index, weights=v, minlength=nx * ny)
+    non_empty = numpy.flatnonzero(counts)
+
+    # min and max: sort values by bin and reduce each run of equal bins
+    order = numpy.argsort(index, kind="stable")
+    sorted_values = v[order]
+    starts = numpy.cumsum(counts)[non_empty] - counts[non_empty]
+    if len(starts):
+        vmin = numpy.minimum.reduceat(sorted_values, starts)
+        vmax = numpy.maximum.reduceat(sorted_values, starts)
+    else:
+        vmin = vmax = numpy.empty((0,), dtype=v.dtype)
+
+    return {"x": xmin + (non_empty % nx + 0.5) * xbin,
+            "y": ymin + (non_empty // nx + 0.5) * ybin,
+            "count": counts[non_empty],
+            "min": vmin,
+            "max": vmax,
+            "mean": sums[non_empty] / counts[non_empty]}
@@ -0,0 +1,423 @@
+# coding: utf-8
+"""
+HDF5 helpers for the session files of :mod:`MaskImageWidget` and
+:mod:`MaskScatterWidget`.
+
+This module does not depend on Qt.
+"""
+
+import contextlib
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+from compactmask import CompactMask
+
+
+PREVIEW_SUFFIX = " preview"
+"""Suffix of the name of the downsampled copy of an image dataset"""
+
+PREVIEW_SIZE = 1024
+"""Default maximum size (in pixels) of the largest side of a preview"""
+
+COMPRESSIONS = (None, "gzip", "lzf")
+"""Supported HDF5 compression filters"""
+
+SMALL_DATASET_SIZE = 4096
+"""Datasets with less items are stored contiguous and uncompressed"""
+
+REPACK_RATIO = 0.5
+"""A session file updated in place is repacked when this fraction of it is
+used by no dataset"""
+
+REPACK_MIN_BYTES = 2**20
+"""Minimum unused space (in bytes) for a session file to be repacked"""
+
+SCATTER_LAYERS = "scatter layers"
+"""Group of the named scatter layers of a :mod:`MaskScatterWidget`
+session"""
+
+
+def preview_step(shape, max_size=PREVIEW_SIZE):
+    """Integer downsampling factor so that the 2 first dimensions of *shape*
+    are at most *max_size*."""
+    return max(1, -(-max(shape[:2]) // max_size))
+
+
+def downsample(data, step, method="mean"):
+    """Reduce the 2 first dimensions of an image by an integer factor.
+
+    Edge blocks are padded by repeating the last row and column.
+
+    :param numpy.ndarray data: Image (nrows, ncols) or RGB(A) pixmap
+        (nrows, ncols, 3 or 4)
+    :param int step: Downsampling factor
+    :param str method: "mean" or "max" of each step x step block
+    :return: Image with the same dtype as *data*
+    """
+    data = numpy.asarray(data)
+    if step <= 1:
+        return data
+    nrows, ncols = data.shape[:2]
+    prows, pcols = -(-nrows // step) * step, -(-ncols // step) * step
+    if (prows, pcols) != (nrows, ncols):
+        padding = [(0, prows - nrows), (0, pcols - ncols)]
+        padding += [(0, 0)] * (data.ndim - 2)
+        data = numpy.pad(data, padding, mode="edge")
+    blocks = data.reshape((prows // step, step, pcols // step, step) +
+                          data.shape[2:])
+    if method == "max":
+        return blocks.max(axis=(1, 3))
+    reduced = blocks.mean(axis=(1, 3), dtype=numpy.float64)
+    if numpy.issubdtype(data.dtype, numpy.integer):
+        reduced = numpy.rint(reduced)
+    return reduced.astype(data.dtype)
+
+
+def write_preview(group, name, data, max_size=PREVIEW_SIZE):
+    """Store a downsampled copy of an image as ``<name> preview``, with its
+    downsampling factor as ``step`` attribute."""
+    step = preview_step(numpy.shape(data), max_size)
+    write_dataset(group, name + PREVIEW_SUFFIX, downsample(data, step),
+                  compression=None)
+    group[name + PREVIEW_SUFFIX].attrs["step"] = step
+
+
+def read_preview(group, name, max_size=PREVIEW_SIZE):
+    """Read a downsampled version of image dataset *name*.
+
+    The stored ``<name> preview`` is used when available, otherwise the
+    dataset is read with a stride.
+
+    :return: (preview image, downsampling factor)
+    """
+    if name + PREVIEW_SUFFIX in group:
+        preview = group[name + PREVIEW_SUFFIX]
+        return preview[()], int(preview.attrs.get("step", 1))
+    dataset = group[name]
+    step = preview_step(dataset.shape, max_size)
+    return dataset[::step, ::step], step
+
+
+def map_dataset(dataset):
+    """Memory-map an HDF5 dataset if it is stored contiguously and
+    uncompressed in its file.
+
+    :param h5py.Dataset dataset:
+    :return: Read-only numpy.memmap or None if the dataset cannot be mapped
+    """
+    if (dataset.chunks is not None or dataset.compression is not None or
+            dataset.dtype.kind not in "biufc" or dataset.size == 0):
+        return None
+    offset = dataset.id.get_offset()
+    if offset is None:   # no data written yet
+        return None
+    return numpy.memmap(dataset.file.filename, mode="r",
+                        dtype=dataset.dtype, shape=dataset.shape,
+                        offset=offset)
+
+
+def row_blocks(dataset, nrows=None):
+    """List of (start, stop) row ranges to read *dataset* chunk by chunk.
+
+    :param dataset: h5py Dataset or numpy array
+    :param int nrows: Number of rows per block, default: the dataset's
+        chunk height, or enough rows for about 16 MB.
+    """
+    if nrows is None:
+        if getattr(dataset, "chunks", None) is not None:
+            nrows = dataset.chunks[0]
+        else:
+            row_bytes = dataset.dtype.itemsize * max(
+                1, int(numpy.prod(dataset.shape[1:])))
+            nrows = max(1, 2**24 // row_bytes)
+    return [(start, min(start + nrows, dataset.shape[0]))
+            for start in range(0, dataset.shape[0], nrows)]
+
+
+def read_scale(group, name):
+    """Read a (origin, scale) pair stored by the session writers."""
+    origin, scale = group[name][()]
+    return float(origin), float(scale)
+
+
+def array_digest(data, block=2**24):
+    """SHA-1 hex digest of the shape, dtype and content of an array.
+
+    The array is hashed by blocks of about *block* bytes so that no full
+    contiguous copy is made.
+    """
+    data = numpy.asarray(data)
+    digest = hashlib.sha1()
+    digest.update(repr((data.shape, data.dtype.str)).encode("ascii"))
+    if data.ndim == 0 or data.size == 0:
+        digest.update(numpy.ascontiguousarray(data).tobytes())
+        return digest.hexdigest()
+    row_bytes = max(1, data[0].nbytes)
+    nrows = max(1, block // row_bytes)
+    for start in range(0, len(data), nrows):
+        digest.update(numpy.ascontiguousarray(data[start:start + nrows]))
+    return digest.hexdigest()
+
+
+def write_dataset(group, name, data, compression="gzip", digest=None):
+    """Write an array as a chunked and compressed dataset, unless a dataset
+    with the same content is already stored.
+
+    The content hash is stored in the ``sha1`` attribute of the dataset.
+
+    An existing dataset with the same shape, type and storage layout is
+    overwritten in place. Otherwise it is deleted and recreated: HDF5 does
+    not reuse the space of a dataset deleted in a previous session, so the
+    file grows until it is repacked (see :func:`session_writer`).
+
+    :param group: h5py Group or File open in a writable mode
+    :param str name: Name of the dataset
+    :param numpy.ndarray data:
+    :param compression: One of :data:`COMPRESSIONS`
+    :param str digest: Precomputed :func:`array_digest` of *data*
+    :return: True if the dataset was written, False if it was up to date
+    :rtype: bool
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError("Unsupported compression: %s" % compression)
+    data = numpy.asarray(data)
+    if digest is None:
+        digest = array_digest(data)
+
+    contiguous = data.size < SMALL_DATASET_SIZE or compression is None
+    if name in group:
+        dataset = group[name]
+        if dataset.attrs.get("sha1") == digest:
+            return False
+        if (dataset.shape == data.shape and dataset.dtype == data.dtype and
+                (dataset.chunks is None if contiguous else
+                 dataset.compression == compression)):
+            dataset[...] = data
+            dataset.attrs["sha1"] = digest
+            return True
+        del group[name]
+
+    if contiguous:
+        dataset = group.create_dataset(name, data=data)
+    else:
+        dataset = group.create_dataset(
+            name, data=data, chunks=True, compression=compression,
+            shuffle=data.dtype.itemsize > 1)
+    dataset.attrs["sha1"] = digest
+    return True
+
+
+MASK_ENCODINGS = ("auto", "packbits", "rle", "none")
+"""Supported mask encodings, see :func:`write_mask`"""
+
+
+def write_mask(group, name, mask, compression="gzip", encoding="auto"):
+    """Write a selection mask.
+
+    Encodings, stored in the ``encoding`` attribute of the dataset:
+
+    - ``"none"``: uint8 array
+    - ``"packbits"``: bit-packed array, see :class:`CompactMask`
+    - ``"rle"``: (2, nruns) array of run starts and lengths in the
+      flattened mask
+    - ``"auto"``: the smallest of ``"packbits"`` and ``"rle"``, or
+      ``"none"`` if the mask uses several levels
+
+    Packed and run-length encoded masks have their original ``shape`` as
+    attribute.
+
+    :param mask: uint8 array or :class:`CompactMask`
+    :param compression: One of :data:`COMPRESSIONS`
+    :param str encoding: One of :data:`MASK_ENCODINGS`
+    :return: True if the dataset was written, False if it was up to date
+    """
+    if encoding not in MASK_ENCODINGS:
+        raise ValueError("Unsupported mask encoding: %s" % encoding)
+    if isinstance(mask, CompactMask):
+        compact = mask
+        if encoding == "none":
+            mask = compact.asUint8()
+    else:
+        mask = numpy.asarray(mask, dtype=numpy.uint8)
+        compact = None
+        if encoding != "none":
+            if encoding == "auto" and mask.size and mask.max() > 1:
+                encoding = "none"
+            else:
+                compact = CompactMask.fromArray(mask)
+
+    if encoding == "auto":
+        encoding = "rle" if compact.rleSize() < compact.nbytes else "packbits"
+
+    if encoding == "none":
+        data = mask
+    elif encoding == "packbits":
+        data = compact.getBits(copy=False)
+    else:
+        data = numpy.array(compact.toRle())
+    written = write_dataset(group, name, data, compression)
+    group[name].attrs["encoding"] = encoding
+    if encoding != "none":
+        group[name].attrs["shape"] = compact.shape
+    return written
+
+
+def read_compact_mask(group, name):
+    """Read a mask written with :func:`write_mask` as a
+    :class:`CompactMask`."""
+    dataset = group[name]
+    encoding = dataset.attrs.get("encoding", "none")
+    if encoding == "packbits":
+        return CompactMask(dataset[()], dataset.attrs["shape"])
+    if encoding == "rle":
+        starts, lengths = dataset[()]
+        return CompactMask.fromRle(starts, lengths, dataset.attrs["shape"])
+    return CompactMask.fromArray(dataset[()])
+
+
+def read_mask(group, name):
+    """Read a mask written with :func:`write_mask` (or a plain uint8 array).
+
+    :rtype: numpy.ndarray of uint8
+    """
+    dataset = group[name]
+    if dataset.attrs.get("encoding", "none") == "none":
+        return numpy.asarray(dataset[()], dtype=numpy.uint8)
+    return numpy.array(read_compact_mask(group, name).asUint8())
+
+
+def open_for_update(path, incremental=True):
+    """Open a session file for writing.
+
+    :param bool incremental: True to keep the existing datasets of an HDF5
+        file, so that unchanged arrays are not rewritten.
+    """
+    if incremental and h5py.is_hdf5(path):
+        return h5py.File(path, "a")
+    return h5py.File(path, "w")
+
+
+@contextlib.contextmanager
+def _replacing(path):
+    """Context manager returning the name of a temporary file, in the
+    directory of *path*, which replaces *path* on success"""
+    fd, tmp = tempfile.mkstemp(suffix=".h5",
+                               dir=os.path.dirname(os.path.abspath(path)))
+    os.close(fd)
+    try:
+        shutil.copymode(path, tmp)
+        yield tmp
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def unused_bytes(h5file):
+    """Size of an open HDF5 file minus the storage size of its datasets,
+    that is mostly space left by deleted datasets, plus metadata."""
+    sizes = []
+
+    def add(name, obj):
+        if isinstance(obj, h5py.Dataset):
+            sizes.append(obj.id.get_storage_size())
+    h5file.visititems(add)
+    return h5file.id.get_filesize() - sum(sizes)
+
+
+def repack(path):
+    """Rewrite an HDF5 file without its unused space."""
+    with _replacing(path) as tmp:
+        with h5py.File(path, "r") as source, h5py.File(tmp, "w") as target:
+            for key, value in source.attrs.items():
+                target.attrs[key] = value
+            for name in source:
+                source.copy(source[name], target, name=name)
+
+
+@contextlib.contextmanager
+def session_writer(path, incremental=True, replace=False):
+    """Context manager opening a session file for writing, see
+    :func:`open_for_update`, and closing it.
+
+    With *replace*, the session is written to a temporary file in the same
+    directory (a copy of *path* in incremental mode), which replaces *path*
+    once complete. Arrays memory-mapped from the previous file stay valid,
+    whereas truncating it would crash their next access (SIGBUS) and
+    updating it in place would change them.
+
+    A file updated incrementally is repacked once more than
+    :data:`REPACK_RATIO` of it (and :data:`REPACK_MIN_BYTES`) is unused.
+
+    :param str path: Session file
+    :param bool incremental: See :func:`open_for_update`
+    :param bool replace: True if arrays are memory-mapped from *path*
+    """
+    with contextlib.ExitStack() as stack:
+        target = path
+        if replace and os.path.exists(path):
+            target = stack.enter_context(_replacing(path))
+            if incremental and h5py.is_hdf5(path):
+                shutil.copyfile(path, target)
+        h5file = open_for_update(target, incremental)
+        try:
+            yield h5file
+            unused = unused_bytes(h5file) if incremental else 0
+            size = h5file.id.get_filesize()
+        finally:
+            h5file.close()
+        if unused > max(REPACK_MIN_BYTES, REPACK_RATIO * size):
+            repack(target)
+
+
+def session_kind(group):
+    """Return "image" for a :mod:`MaskImageWidget` session, "scatter" for a
+    :mod:`MaskScatterWidget` session.
+
+    :raise ValueError: If *group* is not a session
+    """
+    if "image" in group:
+        return "image"
+    if "scatter x" in group or SCATTER_LAYERS in group:
+        return "scatter"
+    raise ValueError("Not a mask session: %s" % group.file.filename)
+
+
+def scatter_layer_names(group):
+    """Return the names of the scatter layers of a session, in their
+    order, and the names of the selected ones, in their order of
+    concatenation.
+
+    :return: (names, selected names), empty lists if the session has no
+        layers
+    """
+    if SCATTER_LAYERS not in group:
+        return [], []
+    layers = group[SCATTER_LAYERS]
+    names = sorted(layers, key=lambda name: layers[name].attrs["index"])
+    selected = sorted((name for name in names
+                       if layers[name].attrs["selected"] >= 0),
+                      key=lambda name: layers[name].attrs["selected"])
+    return names, selected
+
+
+def load_session_mask(path):
+    """Read the kind and the mask of a session file, without its data.
+
+    :param str path: Session file written by a widget's ``saveSession``
+    :return: (kind, mask) with kind "image" or "scatter", see
+        :func:`session_kind`, and the uint8 mask (for a session with
+        scatter layers, the masks of the selected layers, concatenated)
+    """
+    with h5py.File(path, "r") as h5file:
+        return session_kind(h5file), read_mask(h5file, "mask")
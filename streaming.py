@@ -0,0 +1,191 @@
+"""
+Out-of-core evaluation of element-wise kernels on a ``linspace`` grid.
+
+The input grid is generated block by block, and the output is written to a
+memory-mapped ``.npy`` file or to a chunked HDF5 dataset, so that the peak
+memory is bounded by the block size times the number of workers whatever
+the number of points.
+
+Usage::
+
+    python streaming.py y0.npy --num 1000000000 --block 1048576 --workers 8
+"""
+
+import argparse
+import multiprocessing
+import time
+
+import numpy
+from numpy.lib.format import open_memmap
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+from multipoop import f0
+
+
+def linspace_block(start, stop, num, first, last):
+    """Items *first* to *last* of ``numpy.linspace(start, stop, num)``,
+    computed without allocating the full grid."""
+    if num == 1:
+        return numpy.full((last - first,), start, dtype=numpy.float64)
+    step = (stop - start) / float(num - 1)
+    block = numpy.arange(first, last, dtype=numpy.float64)
+    block *= step
+    block += start
+    if last == num:
+        block[-1] = stop
+    return block
+
+
+def block_bounds(num, block):
+    """List of (first, last) index ranges of at most *block* items."""
+    return [(first, min(first + block, num))
+            for first in range(0, num, block)]
+
+
+def _is_hdf5(path):
+    return path.lower().endswith((".h5", ".hdf5", ".nxs"))
+
+
+def _evaluate_block(func, grid, bounds):
+    first, last = bounds
+    return first, last, func(linspace_block(*(grid + bounds)))
+
+
+def _evaluate_block_to_npy(func, grid, bounds, path):
+    first, last, y = _evaluate_block(func, grid, bounds)
+    out = open_memmap(path, mode="r+")
+    out[first:last] = y
+    out.flush()
+    del out
+    return first, last, None
+
+
+def stream_map(func, start, stop, num, path, block=2**20, nworkers=1,
+               dataset="data", compression=None):
+    """Evaluate *func* on ``numpy.linspace(start, stop, num)`` block by
+    block and write the result to *path*.
+
+    :param func: Picklable element-wise kernel returning float64
+    :param str path: Output ``.npy`` file, or HDF5 file if the extension
+        is ``.h5``, ``.hdf5`` or ``.nxs``
+    :param int block: Number of points per block
+    :param int nworkers: Number of processes. With a ``.npy`` output each
+        worker writes its block directly in the memory-mapped file.
+    :param str dataset: Name of the HDF5 dataset
+    :param compression: HDF5 compression filter (e.g. "gzip", "lzf")
+    """
+    num, block = int(num), int(block)
+    grid = (start, stop, num)
+    bounds = block_bounds(num, block)
+    hdf5 = _is_hdf5(path)
+
+    if hdf5:
+        if h5py is None:
+            raise ImportError("h5py is required to write HDF5 output")
+        h5file = h5py.File(path, "w")
+        out = h5file.create_dataset(dataset, shape=(num,), dtype="float64",
+                                    chunks=(min(block, max(num, 1)),),
+                                    compression=compression)
+    else:
+        out = open_memmap(path, mode="w+", dtype="float64", shape=(num,))
+
+    def store(result):
+        first, last, y = result
+        if y is not None:
+            out[first:last] = y
+
+    try:
+        if nworkers <= 1:
+            for b in bounds:
+                store(_evaluate_block(func, grid, b))
+            return
+
+        if not hdf5:
+            # workers reopen the file: release our mapping first
+            out.flush()
+            out = None
+
+        pool = multiprocessing.Pool(nworkers)
+        try:
+            # keep at most 2 blocks per worker in flight to bound memory
+            pending = []
+            for b in bounds:
+                if hdf5:
+                    args = (func, grid, b)
+                    task = pool.apply_async(_evaluate_block, args)
+                else:
+                    args = (func, grid, b, path)
+                    task = pool.apply_async(_evaluate_block_to_npy, args)
+                pending.append(task)
+                if len(pending) >= 2 * nworkers:
+                    store(pending.pop(0).get())
+            for task in pending:
+                store(task.get())
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        if hdf5:
+            h5file.close()
+        elif out is not None:
+            out.flush()
+
+
+def validate_stream(func, start, stop, num, path, block=2**20,
+                    dataset="data"):
+    """Check block by block that *path* holds *func* evaluated on
+    ``numpy.linspace(start, stop, num)``.
+
+    :return: True if all blocks match (see :func:`numpy.allclose`)
+    """
+    num, block = int(num), int(block)
+    if _is_hdf5(path):
+        h5file = h5py.File(path, "r")
+        data = h5file[dataset]
+    else:
+        h5file = None
+        data = numpy.load(path, mmap_mode="r")
+    try:
+        if data.shape != (num,):
+            return False
+        for first, last in block_bounds(num, block):
+            reference = func(linspace_block(start, stop, num, first, last))
+            if not numpy.allclose(data[first:last], reference):
+                return False
+        return True
+    finally:
+        if h5file is not None:
+            h5file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("output", help=".npy or HDF5 output file")
+    parser.add_argument("--start", type=float, default=0.)
+    parser.add_argument("--stop", type=float, default=120245.)
+    parser.add_argument("--num", type=float, default=1e6)
+    parser.add_argument("--block", type=int, default=2**20)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--compression", default=None)
+    parser.add_argument("--no-validate", action="store_true")
+    args = parser.parse_args()
+
+    t0 = time.time()
+    stream_map(f0, args.start, args.stop, args.num, args.output,
+               block=args.block, nworkers=args.workers,
+               compression=args.compression)
+    t1 = time.time()
+    print("Streaming time", (t1 - t0))
+
+    if not args.no_validate:
+        assert validate_stream(f0, args.start, args.stop, args.num,
+                               args.output, block=args.block)
+        print("Validation time", (time.time() - t1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+# coding: utf-8
+"""Tests of :mod:`datastats`"""
+
+import unittest
+
+import numpy
+
+from datastats import compute_statistics
+
+
+class TestComputeStatistics(unittest.TestCase):
+    def testFloat(self):
+        data = numpy.array([1., numpy.nan, 3., numpy.inf, 2.])
+        stats = compute_statistics(data, bins=4)
+        self.assertEqual((stats["min"], stats["max"]), (1., 3.))
+        self.assertEqual(stats["count"], 3)
+        self.assertEqual(stats["histogram"].sum(), 3)
+
+    def testInteger(self):
+        for dtype in (numpy.int64, numpy.uint8, numpy.uint16, bool):
+            data = (numpy.arange(200 * 150) % 200).astype(dtype)
+            stats = compute_statistics(data, bins=16, block=1000)
+            self.assertEqual(stats["count"], data.size)
+            self.assertEqual(stats["min"], data.min())
+            self.assertEqual(stats["max"], data.max())
+            self.assertEqual(stats["histogram"].sum(), data.size)
+
+    def testEmpty(self):
+        stats = compute_statistics(numpy.array([], dtype=numpy.int32))
+        self.assertEqual(stats["count"], 0)
+        self.assertIsNone(stats["min"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+# coding: utf-8
+"""Tests of :mod:`mappedio`"""
+
+import unittest
+
+import numpy
+
+from mappedio import as_display_array, display_dtype
+
+
+class TestDisplayArray(unittest.TestCase):
+    def testDisplayDtype(self):
+        for dtype, expected in ((numpy.uint16, numpy.uint16),
+                                (">f4", numpy.float32),
+                                (bool, numpy.uint8),
+                                (numpy.int64, numpy.float64),
+                                (numpy.uint64, numpy.float64),
+                                (numpy.float16, numpy.float32)):
+            self.assertEqual(display_dtype(dtype), numpy.dtype(expected))
+
+    def testUsedAsIs(self):
+        data = numpy.arange(12, dtype=numpy.int32).reshape(3, 4)
+        self.assertIs(as_display_array(data), data)
+
+    def testLargeCounts(self):
+        data = numpy.arange(2**24, 2**24 + 100, dtype=numpy.int64)
+        converted = as_display_array(data.reshape(10, 10), nrows=3)
+        self.assertEqual(converted.dtype, numpy.float64)
+        numpy.testing.assert_array_equal(converted.ravel(), data)
+
+
+if __name__ == "__main__":
+    unittest.main()
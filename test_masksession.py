@@ -0,0 +1,122 @@
+# coding: utf-8
+"""Tests of the session files of :mod:`MaskImageWidget` and
+:mod:`MaskScatterWidget`"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+try:
+    import h5py
+    from silx.gui import qt
+    from MaskImageWidget import MaskImageWidget
+    from MaskScatterWidget import MaskScatterWidget
+except ImportError:
+    qt = None
+
+from mappedio import maps_file
+
+
+@unittest.skipIf(qt is None, "silx, Qt and h5py are required")
+class TestSaveLoadedSession(unittest.TestCase):
+    """Saving to the file a session was loaded from, while its data is
+    memory-mapped"""
+    @classmethod
+    def setUpClass(cls):
+        cls.app = qt.QApplication.instance() or qt.QApplication([])
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "session.h5")
+        self.background = numpy.arange(64 * 64.).reshape(64, 64)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def createImageSession(self):
+        widget = MaskImageWidget()
+        widget.setBackgroundImage(self.background)
+        widget.setImage(numpy.ones((64, 64), dtype=numpy.float32))
+        widget.setSelectionMask(numpy.zeros((64, 64), dtype=numpy.uint8))
+        # uncompressed, so that loading memory-maps the images
+        widget.saveSession(self.path, compression=None)
+
+    def checkImageSaves(self, widget, incremental):
+        self.assertTrue(maps_file([widget.getImage().getData(copy=False)],
+                                  self.path))
+        for value in (2, 3):
+            widget.setImage(numpy.full((64, 64), value, numpy.float32))
+            widget.saveSession(self.path, incremental=incremental)
+            numpy.testing.assert_array_equal(
+                widget.getBackgroundImage().getData(copy=False),
+                self.background)
+
+        loaded = MaskImageWidget()
+        loaded.loadSession(self.path)
+        numpy.testing.assert_array_equal(
+            loaded.getImage().getData(copy=False), 3)
+
+    def testImageLoadSaveSave(self):
+        for incremental in (True, False):
+            self.createImageSession()
+            widget = MaskImageWidget()
+            widget.loadSession(self.path)
+            self.checkImageSaves(widget, incremental)
+
+    def testImageLazyLoadSaveSave(self):
+        for incremental in (True, False):
+            self.createImageSession()
+            widget = MaskImageWidget()
+            widget.loadSession(self.path, lazy=True)
+            while widget._sessionLoader is not None:
+                self.app.processEvents()
+            self.checkImageSaves(widget, incremental)
+
+    def testImageSavedInItsType(self):
+        counts = numpy.arange(64 * 64, dtype=numpy.int64).reshape(64, 64)
+        counts += 2**24 + 1
+        widget = MaskImageWidget()
+        widget.setBackgroundImage(self.background)
+        widget.setImage(counts, copy=False)
+        widget.setSelectionMask(numpy.zeros((64, 64), dtype=numpy.uint8))
+        numpy.testing.assert_array_equal(
+            widget.getImage().getData(copy=False), counts)
+        widget.saveSession(self.path)
+        with h5py.File(self.path, "r") as h5file:
+            self.assertEqual(h5file["image"].dtype, numpy.int64)
+            digest = h5file["image"].attrs["sha1"]
+        # unchanged, so not rewritten
+        loaded = MaskImageWidget()
+        loaded.loadSession(self.path)
+        loaded.saveSession(self.path)
+        with h5py.File(self.path, "r") as h5file:
+            self.assertEqual(h5file["image"].dtype, numpy.int64)
+            self.assertEqual(h5file["image"].attrs["sha1"], digest)
+
+    def testScatterLoadSaveSave(self):
+        x = numpy.arange(1000.)
+        widget = MaskScatterWidget()
+        widget.setBackgroundImage(self.background)
+        widget.setScatter(x, 2 * x, 3 * x)
+        widget.saveSession(self.path)
+
+        widget = MaskScatterWidget()
+        widget.loadSession(self.path)
+        self.assertTrue(maps_file(
+            [widget.getScatter().getXData(copy=False)], self.path))
+        widget.saveSession(self.path)
+        widget.saveSession(self.path)
+        numpy.testing.assert_array_equal(
+            widget.getScatter().getValueData(copy=False), 3 * x)
+
+        loaded = MaskScatterWidget()
+        loaded.loadSession(self.path)
+        numpy.testing.assert_array_equal(
+            loaded.getScatter().getYData(copy=False), 2 * x)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+# coding: utf-8
+"""Tests of :mod:`sessionio`"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+from mappedio import map_or_read, maps_file
+from sessionio import REPACK_MIN_BYTES, session_writer, unused_bytes, \
+    write_dataset
+
+
+@unittest.skipIf(h5py is None, "h5py is required")
+class TestSessionWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "session.h5")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, data, **kwargs):
+        with session_writer(self.path, **kwargs) as h5file:
+            write_dataset(h5file, "data", data, compression=None)
+
+    def testSaveOverMappedSession(self):
+        """load -> save -> save to the same file"""
+        for incremental in (True, False):
+            self.write(numpy.arange(100.), incremental=False)
+            with h5py.File(self.path, "r") as h5file:
+                mapped = map_or_read(h5file["data"])
+            self.assertTrue(maps_file([mapped], self.path))
+            for value in (1., 2.):
+                self.write(numpy.full(100, value), incremental=incremental,
+                           replace=True)
+                numpy.testing.assert_array_equal(mapped, numpy.arange(100.))
+            with h5py.File(self.path, "r") as h5file:
+                numpy.testing.assert_array_equal(h5file["data"][()], 2.)
+            del mapped
+        self.assertEqual(os.listdir(self.tmpdir), ["session.h5"])
+
+    def testIncrementalReplaceKeepsDatasets(self):
+        with session_writer(self.path) as h5file:
+            write_dataset(h5file, "other", numpy.arange(10))
+        self.write(numpy.ones(10), replace=True)
+        with h5py.File(self.path, "r") as h5file:
+            self.assertEqual(sorted(h5file), ["data", "other"])
+
+    def testFailedReplace(self):
+        self.write(numpy.arange(10.))
+        with self.assertRaises(RuntimeError):
+            with session_writer(self.path, replace=True) as h5file:
+                write_dataset(h5file, "data", numpy.ones(10))
+                raise RuntimeError()
+        self.assertEqual(os.listdir(self.tmpdir), ["session.h5"])
+        with h5py.File(self.path, "r") as h5file:
+            numpy.testing.assert_array_equal(h5file["data"][()],
+                                             numpy.arange(10.))
+
+    def testOverwriteInPlace(self):
+        for compression in (None, "gzip"):
+            for value in range(5):
+                with session_writer(self.path, incremental=value > 0) as \
+                        h5file:
+                    write_dataset(h5file, "data",
+                                  numpy.full((256, 256), float(value)),
+                                  compression=compression)
+                    if value == 0:
+                        offset = h5file["data"].id.get_offset()
+                with h5py.File(self.path, "r") as h5file:
+                    self.assertEqual(h5file["data"][0, 0], value)
+                    if compression is None:
+                        self.assertEqual(h5file["data"].id.get_offset(),
+                                         offset)
+
+    def testRepack(self):
+        """Replaced datasets do not make the file grow without bound"""
+        sizes = []
+        for length in range(2**16, 2**16 + 20):
+            self.write(numpy.arange(float(length)))
+            sizes.append(os.path.getsize(self.path))
+            with h5py.File(self.path, "r") as h5file:
+                self.assertEqual(len(h5file["data"]), length)
+                self.assertLessEqual(unused_bytes(h5file),
+                                     REPACK_MIN_BYTES + sizes[-1] // 2)
+        self.assertLess(max(sizes), 20 * 2**19)
+        self.assertLess(min(sizes[1:]), max(sizes))
+
+    def testMapsFile(self):
+        self.write(numpy.arange(10.))
+        self.assertFalse(maps_file([numpy.arange(10.), None], self.path))
+        with h5py.File(self.path, "r") as h5file:
+            mapped = map_or_read(h5file["data"])
+        self.assertTrue(maps_file([mapped[2:5]], self.path))
+        self.assertFalse(maps_file([mapped], __file__))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+# coding: utf-8
+"""Tests of :mod:`spatialindex`"""
+
+import unittest
+import warnings
+
+import numpy
+
+from spatialindex import GridIndex
+
+
+class TestGridIndex(unittest.TestCase):
+    def _check(self, x, y, index):
+        """Compare rectangle and stroke queries with brute force"""
+        rng = numpy.random.RandomState(1)
+        for _ in range(20):
+            x0, x1 = sorted(rng.uniform(x.min() - 1, x.max() + 1, 2))
+            y0, y1 = sorted(rng.uniform(y.min() - 1, y.max() + 1, 2))
+            expected = numpy.flatnonzero(
+                (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1))
+            self.assertEqual(sorted(index.queryRect(x0, x1, y0, y1)),
+                             list(expected))
+        stroke = index.queryStroke(x.min(), y.min(), x.max(), y.max(), 2.)
+        self.assertEqual(len(stroke), len(x))
+
+    def testRandom(self):
+        rng = numpy.random.RandomState(0)
+        x, y = rng.rand(10000), rng.rand(10000)
+        self._check(x, y, GridIndex(x, y))
+
+    def testDegenerateExtent(self):
+        rng = numpy.random.RandomState(0)
+        cases = [
+            (1e-300 * rng.rand(5000), 1e-300 * rng.rand(5000)),
+            (1e-300 * rng.rand(5000), rng.rand(5000)),
+            (numpy.full(5000, 3.), rng.rand(5000)),
+            (rng.rand(5000), numpy.full(5000, -2.)),
+            (numpy.full(5000, 1.), numpy.full(5000, 1.))]
+        for x, y in cases:
+            with warnings.catch_warnings():
+                warnings.simplefilter("error")
+                index = GridIndex(x, y)
+                self._check(x, y, index)
+
+
+if __name__ == "__main__":
+    unittest.main()